@@ -0,0 +1,127 @@
+"""
+Coroutine versions of the data access helpers.
+
+Each helper runs its counterpart from watney.helpers on the sync facade of an AsyncSession.
+The statements themselves go through the async driver (aiosqlite or asyncpg), and the
+event loop serves other requests while they wait on the database. The Python code
+between two statements does run on the event loop, so the helpers that build a model
+or JSON per broken link fetch the rows this way and then build the response in the
+threadpool, where it cannot stall other requests. Ingestion inserts its rows in chunks
+of settings.ingest_chunk_size, each one a round trip that yields to the loop.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from sqlmodel.sql.expression import SelectOfScalar
+
+from watney import fastjson, helpers, rollups
+from watney.diff import ReportDiff
+from watney.schema import (
+    BrokenLink,
+    BrokenLinkReport,
+    ReportList,
+    RepoTrend,
+    StatusCodeCount,
+    TimeToFixResponse,
+    UrlCount,
+)
+
+
+async def report_exists(session: AsyncSession, report_id: UUID) -> bool:
+    return await session.run_sync(helpers.report_exists, report_id)
+
+
+async def persist(session: AsyncSession, broken_link_report: BrokenLinkReport) -> UUID:
+    return await session.run_sync(helpers.persist, broken_link_report)
+
+
+async def get_report_by_id(
+    session: AsyncSession, id_: UUID
+) -> Optional[BrokenLinkReport]:
+    found = await session.run_sync(helpers.report_rows, id_)
+    if found is None:
+        return None
+    return await run_in_threadpool(helpers.build_report, id_, *found)
+
+
+async def report_json(session: AsyncSession, report_id: UUID) -> Optional[bytes]:
+    found = await session.run_sync(helpers.report_rows, report_id)
+    if found is None:
+        return None
+    return await run_in_threadpool(fastjson.render_report, report_id, *found)
+
+
+async def get_report_list(
+    session: AsyncSession,
+    limit: Optional[int] = None,
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
+    before_id: Optional[UUID] = None,
+    after_id: Optional[UUID] = None,
+) -> ReportList:
+    return await session.run_sync(
+        helpers.get_report_list, limit, before, after, before_id, after_id
+    )
+
+
+async def get_report_date(session: AsyncSession, report_id: UUID) -> Optional[datetime]:
+    return await session.run_sync(helpers.get_report_date, report_id)
+
+
+async def get_last_two_reports(session: AsyncSession) -> Optional[Tuple[UUID, UUID]]:
+    return await session.run_sync(helpers.get_last_two_reports)
+
+
+async def get_report_diff(
+    session: AsyncSession, prev_id: UUID, new_id: UUID
+) -> (List[BrokenLink], List[BrokenLink]):
+    existing, new = await session.run_sync(
+        helpers.get_report_diff_rows, prev_id, new_id
+    )
+    return await run_in_threadpool(
+        lambda: (helpers.broken_links(existing), helpers.broken_links(new))
+    )
+
+
+async def query_report_diff(
+    session: AsyncSession, prev_id: UUID, new_id: UUID
+) -> ReportDiff:
+    return await session.run_sync(helpers.query_report_diff, prev_id, new_id)
+
+
+async def report_diff_queries(
+    session: AsyncSession, prev_id: UUID, new_id: UUID
+) -> Dict[str, SelectOfScalar]:
+    return await session.run_sync(helpers.report_diff_queries, prev_id, new_id)
+
+
+async def repo_trends(
+    session: AsyncSession,
+    repo_name: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List[RepoTrend]:
+    return await session.run_sync(rollups.repo_trends, repo_name, since, until)
+
+
+async def top_urls(
+    session: AsyncSession, report_id: UUID, limit: int
+) -> List[UrlCount]:
+    return await session.run_sync(rollups.top_urls, report_id, limit)
+
+
+async def status_code_counts(
+    session: AsyncSession, report_id: UUID
+) -> List[StatusCodeCount]:
+    return await session.run_sync(rollups.status_code_counts, report_id)
+
+
+async def time_to_fix(
+    session: AsyncSession,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> TimeToFixResponse:
+    return await session.run_sync(rollups.time_to_fix, since, until)
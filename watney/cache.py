@@ -0,0 +1,311 @@
+"""
+Caching of serialized API responses.
+
+Responses are cached as rendered JSON bytes together with a strong ETag, so a hit skips
+both the database and the serialization, and clients holding the ETag get a 304 without a
+body. Whatever changes the stored reports awaits invalidate_cache once its transaction
+is committed: the API routes that store reports, the retention loop and the CLI commands.
+
+settings.cache_backend picks where the responses are kept: nowhere ("none"), in each
+worker process ("memory") or in Redis, shared by all workers ("redis"). Lookups are
+coroutines, so the Redis backend never blocks the event loop.
+"""
+import functools
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from watney import fastjson
+from watney.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class CacheBackend:
+    """
+    Stores byte strings under string keys. Subclasses implement _get, _set and clear,
+    the public get and set keep count of hits and misses. Every method is a coroutine.
+
+    get also returns the generation the lookup saw, which is passed back to set. Clearing
+    the cache starts a new generation, and a value loaded before that is stored in the
+    generation it was loaded in, where no later lookup finds it.
+    """
+
+    name = "none"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Tuple[Optional[bytes], Any]:
+        value, generation = await self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value, generation
+
+    async def set(self, key: str, value: bytes, generation: Any):
+        """
+        :param key:
+        :param value:
+        :param generation: as returned by the get that missed, None to skip the store
+        """
+        if generation is not None:
+            await self._set(key, value, generation)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return dict(
+            backend=self.name,
+            hits=self.hits,
+            misses=self.misses,
+            hit_ratio=self.hits / lookups if lookups else None,
+        )
+
+    async def _get(self, key: str) -> Tuple[Optional[bytes], Any]:
+        return None, 0
+
+    async def _set(self, key: str, value: bytes, generation: Any):
+        pass
+
+    async def clear(self):
+        pass
+
+
+class LRUCache(CacheBackend):
+    """
+    A thread-safe, in-process least recently used cache with a per-entry time to live.
+    A max_entries of 0 disables the cache. The generation is an epoch counted up by
+    clear, a value from an earlier epoch is not stored.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    async def _get(self, key: Hashable) -> Tuple[Optional[Any], int]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, self._epoch
+            expires, value = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                return None, self._epoch
+            self._entries.move_to_end(key)
+            return value, self._epoch
+
+    async def _set(self, key: Hashable, value: Any, generation: int):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation != self._epoch:
+                return
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Read the current generation and the entry of a key in it, in one round trip.
+# KEYS[1] is the generation key, ARGV the prefix and the key.
+REDIS_GET = """
+local generation = redis.call('GET', KEYS[1]) or '0'
+return {generation, redis.call('GET', ARGV[1] .. ':' .. generation .. ':' .. ARGV[2])}
+"""
+
+
+class RedisCache(CacheBackend):
+    """
+    A cache shared by every worker through a Redis server, entries expire after ttl seconds.
+    Keys are namespaced by a generation number stored in Redis. Clearing the cache bumps
+    the generation, which orphans every entry in one round trip, and the orphans expire
+    on their own. A value is written into the generation its lookup read, so a value
+    loaded while the cache was cleared is orphaned as well. All commands go through a redis.asyncio client, which should have
+    socket timeouts set so a hung server cannot stall a request. While Redis is
+    unreachable, every lookup is a miss.
+    """
+
+    name = "redis"
+
+    def __init__(self, client, ttl: float, prefix: str = "watney"):
+        from redis.exceptions import ConnectionError, TimeoutError
+
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._get_script = client.register_script(REDIS_GET)
+        self._unavailable = (ConnectionError, TimeoutError)
+
+    def _generation_key(self) -> str:
+        return f"{self.prefix}:generation"
+
+    async def _get(self, key: str) -> Tuple[Optional[bytes], Optional[int]]:
+        try:
+            generation, value = await self._get_script(
+                keys=[self._generation_key()], args=[self.prefix, key]
+            )
+        except self._unavailable as error:
+            logger.warning(
+                "Redis cache unavailable, lookup of %s missed: %s", key, error
+            )
+            return None, None
+        return value, int(generation)
+
+    async def _set(self, key: str, value: bytes, generation: int):
+        try:
+            await self.client.set(
+                f"{self.prefix}:{generation}:{key}", value, ex=max(1, int(self.ttl))
+            )
+        except self._unavailable as error:
+            logger.warning("Redis cache unavailable, %s not stored: %s", key, error)
+
+    async def clear(self):
+        try:
+            await self.client.incr(self._generation_key())
+        except self._unavailable as error:
+            logger.warning(
+                "Redis cache unavailable, entries expire after %ss: %s", self.ttl, error
+            )
+
+
+def create_cache_backend(
+    backend: str,
+    max_entries: int,
+    ttl: float,
+    redis_url: str,
+    redis_timeout: Optional[float] = None,
+) -> CacheBackend:
+    if backend == "none":
+        return CacheBackend()
+    if backend == "memory":
+        return LRUCache(max_entries, ttl)
+    if backend == "redis":
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise ImportError(
+                "The redis cache backend requires the redis package, "
+                "install watney[redis]"
+            )
+        client = redis.asyncio.Redis.from_url(
+            redis_url,
+            socket_timeout=redis_timeout,
+            socket_connect_timeout=redis_timeout,
+        )
+        return RedisCache(client, ttl)
+    raise ValueError(f"Unknown cache backend {backend}")
+
+
+@functools.cache
+def get_cache() -> CacheBackend:
+    return create_cache_backend(
+        settings.cache_backend,
+        settings.cache_max_entries,
+        settings.cache_ttl,
+        settings.cache_redis_url,
+        settings.cache_redis_timeout,
+    )
+
+
+async def invalidate_cache():
+    """
+    Drop every cached response, awaited whenever stored report data changes, after the
+    change is committed
+    """
+    await get_cache().clear()
+
+
+def cache_key(key: Tuple) -> str:
+    return ":".join(str(part) for part in key)
+
+
+def render(content: Any) -> CachedResponse:
+    """
+    Serialize the content of a response and compute its ETag
+    :param content: the response content, or bytes that already hold its JSON
+    :return:
+    """
+    if isinstance(content, bytes):
+        body = content
+    elif settings.fast_json:
+        body = fastjson.dumps(content)
+    else:
+        body = JSONResponse(jsonable_encoder(content)).body
+    return CachedResponse(body=body, etag=f'"{hashlib.sha256(body).hexdigest()}"')
+
+
+def encode(cached: CachedResponse) -> bytes:
+    return cached.etag.encode() + b"\n" + cached.body
+
+
+def decode(value: bytes) -> CachedResponse:
+    etag, body = value.split(b"\n", 1)
+    return CachedResponse(body=body, etag=etag.decode())
+
+
+def etag_response(request: Request, cached: CachedResponse) -> Response:
+    """
+    The cached body, or a bodiless 304 if the client already holds it
+    """
+    headers = {"ETag": cached.etag}
+    if_none_match = request.headers.get("if-none-match", "")
+    if cached.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
+
+
+async def cached_response(
+    request: Request, key: Tuple, load: Callable[[], Awaitable[Any]]
+) -> Response:
+    """
+    Serve the response for key from the cache, loading and rendering it on a miss
+    :param request:
+    :param key: identifies the response, e.g. ("report", report_id)
+    :param load: produces the response content, exceptions are not cached
+    :return:
+    """
+    cache = get_cache()
+    value, generation = await cache.get(cache_key(key))
+    if value is None:
+        # Rendering a large response is CPU bound, keep it off the event loop
+        cached = await run_in_threadpool(render, await load())
+        await cache.set(cache_key(key), encode(cached), generation)
+    else:
+        cached = decode(value)
+    return etag_response(request, cached)
@@ -0,0 +1,110 @@
+"""
+Maintenance commands, e.g.
+
+    watney migrate
+    watney backfill-diffs
+    STORAGE_LAYOUT=normalized watney convert-layout
+    watney prune --dry-run
+    watney rollup
+"""
+import argparse
+import asyncio
+from typing import List, Optional
+
+from watney.cache import invalidate_cache
+from watney.db.migrations import SCHEMA_VERSION, bootstrap, migrate
+from watney.db.session import get_engine_from_settings, get_session
+from watney.helpers import backfill_report_diffs
+from watney.layouts import convert_layout
+from watney.retention import RetentionPolicy, expired_reports, prune_reports
+from watney.rollups import rebuild_rollups
+from watney.settings import settings
+
+
+def migrate_schema(args: argparse.Namespace):
+    """
+    Bring the database schema up to date, run once per deploy
+    """
+    count = migrate(get_engine_from_settings())
+    print(f"Applied {count} migrations, the schema is at version {SCHEMA_VERSION}")
+
+
+def backfill_diffs(args: argparse.Namespace):
+    """
+    Materialize the diffs between consecutive reports stored before diffs were materialized
+    """
+    bootstrap(get_engine_from_settings())
+    with get_session() as session:
+        count = backfill_report_diffs(session)
+    print(f"Materialized {count} report diffs")
+
+
+def convert(args: argparse.Namespace):
+    """
+    Move the stored broken links to the storage layout of the settings
+    """
+    bootstrap(get_engine_from_settings(), check_layout=False)
+    with get_session() as session:
+        count = convert_layout(session)
+    print(f"Moved {count} broken links to the {settings.storage_layout} layout")
+
+
+def prune(args: argparse.Namespace):
+    """
+    Delete the reports the retention policy of the settings does not keep
+    """
+    policy = RetentionPolicy.from_settings()
+    if args.keep_reports is not None:
+        policy = policy._replace(keep_reports=args.keep_reports)
+    bootstrap(get_engine_from_settings())
+    with get_session() as session:
+        if args.dry_run:
+            report_ids = expired_reports(session, policy)
+        else:
+            report_ids = prune_reports(session, policy)
+    if report_ids and not args.dry_run:
+        asyncio.run(invalidate_cache())
+    for report_id in report_ids:
+        print(report_id)
+    verb = "Would delete" if args.dry_run else "Deleted"
+    print(f"{verb} {len(report_ids)} reports")
+
+
+def rollup(args: argparse.Namespace):
+    """
+    Recompute the rollups behind the /stats endpoints
+    """
+    bootstrap(get_engine_from_settings())
+    with get_session() as session:
+        count = rebuild_rollups(session)
+    asyncio.run(invalidate_cache())
+    print(f"Rolled up {count} reports")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="watney", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help=migrate_schema.__doc__.strip()).set_defaults(
+        func=migrate_schema
+    )
+    commands.add_parser(
+        "backfill-diffs", help=backfill_diffs.__doc__.strip()
+    ).set_defaults(func=backfill_diffs)
+    commands.add_parser("convert-layout", help=convert.__doc__.strip()).set_defaults(
+        func=convert
+    )
+    prune_parser = commands.add_parser("prune", help=prune.__doc__.strip())
+    prune_parser.add_argument(
+        "--dry-run", action="store_true", help="list the reports without deleting them"
+    )
+    prune_parser.add_argument(
+        "--keep-reports", type=int, help="override settings.retention_keep_reports"
+    )
+    prune_parser.set_defaults(func=prune)
+    commands.add_parser("rollup", help=rollup.__doc__.strip()).set_defaults(func=rollup)
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Leases, which let one process at a time do a job that several processes would start.
+
+A lease is a LeaseData row naming its holder and when it expires. take_lease takes a
+free or expired lease, or renews one already held, with a single INSERT ... ON CONFLICT
+DO UPDATE, so of the processes racing for a lease exactly one gets it. A holder that
+dies leaves the lease to the others once it expires, so holders renew their lease more
+often than it expires.
+
+lock_for_transaction uses the same rows as locks held until the end of a transaction.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, or_
+from sqlmodel import Session, select
+
+from watney.db.models import LeaseData
+from watney.db.session import insert_on_conflict
+
+
+def take_lease(
+    session: Session,
+    name: str,
+    holder: str,
+    duration: timedelta,
+    now: Optional[datetime] = None,
+) -> bool:
+    """
+    Take the lease for duration, or renew it if holder already holds it. Commits.
+    :param session:
+    :param name:
+    :param holder: unique to the process, e.g. uuid4().hex
+    :param duration:
+    :param now: defaults to the current time, in UTC
+    :return: whether holder holds the lease
+    """
+    now = now or datetime.utcnow()
+    statement = insert_on_conflict(session.get_bind().dialect.name, LeaseData).values(
+        name=name, holder=holder, expires=now + duration
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[LeaseData.name],
+            set_=dict(
+                holder=statement.excluded.holder, expires=statement.excluded.expires
+            ),
+            where=or_(LeaseData.expires <= now, LeaseData.holder == holder),
+        )
+    )
+    held = (
+        session.exec(select(LeaseData.holder).where(LeaseData.name == name)).one()
+        == holder
+    )
+    session.commit()
+    return held
+
+
+def lock_for_transaction(session: Session, name: str):
+    """
+    Hold the lock named name until the session's transaction ends. The lock is an upsert
+    of the LeaseData row of the name, which the database lets one transaction at a time
+    write: the others wait for it to commit or roll back. Does not commit.
+    :param session:
+    :param name: not the name of a lease taken with take_lease
+    """
+    statement = insert_on_conflict(session.get_bind().dialect.name, LeaseData).values(
+        name=name, holder="transaction", expires=datetime.utcnow()
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[LeaseData.name],
+            set_=dict(expires=statement.excluded.expires),
+        )
+    )
+
+
+def release_lease(session: Session, name: str, holder: str):
+    """
+    Give up the lease if holder holds it. Commits.
+    """
+    session.execute(
+        delete(LeaseData).where(LeaseData.name == name, LeaseData.holder == holder)
+    )
+    session.commit()
+
+
+__all__ = ["take_lease", "lock_for_transaction", "release_lease"]
@@ -0,0 +1,204 @@
+"""
+The versioned bootstrap of the schema.
+
+The version of a database is the number of MIGRATIONS applied to it, recorded in
+SchemaVersionData. migrate applies the missing ones in order, run it once per deploy with
+
+    watney migrate
+
+schema_is_current is a single primary key lookup, cheap enough for every process start,
+while creating the schema inspects every table and index. The API and the maintenance commands
+call bootstrap when they start and refuse to run against an outdated database, unless
+settings.auto_migrate has them migrate it themselves. Concurrent migrations are not
+coordinated, so leave it off when several processes start at once.
+
+Change the schema by appending a migration, never by editing an applied one. Every
+migration spells out its DDL, so it does the same whatever the current models are;
+watney/tests/test_migrations.py checks that the migrated schema matches
+watney.db.models.
+"""
+from typing import Callable, List
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    select,
+    text,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.future import Engine
+
+from watney.db import schema_v1
+from watney.db.models import SchemaVersionData
+from watney.db.session import insert_on_conflict
+from watney.errors import SchemaVersionError
+from watney.layouts import check_storage_layout
+from watney.settings import settings
+
+
+def extend_report_date_index(engine: Engine):
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX IF EXISTS ix_brokenlinkreportdata_date"))
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_brokenlinkreportdata_date_report_id "
+                "ON brokenlinkreportdata (date, report_id)"
+            )
+        )
+
+
+def index_rollup_reads(engine: Engine):
+    metadata = MetaData()
+    schema_v1.metadata.tables["brokenlinkreportdata"].to_metadata(metadata)
+    repo_status_counts = Table(
+        "repostatuscountdata",
+        metadata,
+        schema_v1.report_id_column(primary_key=True),
+        Column("repo_name", String(), primary_key=True),
+        Column("repo_url", String(), primary_key=True),
+        Column("status_code", Integer(), primary_key=True),
+        Column("count", Integer(), nullable=False),
+        Column("report_date", DateTime(), nullable=False),
+        Index(
+            "ix_repostatuscountdata_report_status", "report_id", "status_code", "count"
+        ),
+        Index(
+            "ix_repostatuscountdata_repo_date",
+            "repo_name",
+            "repo_url",
+            "report_date",
+            "report_id",
+        ),
+    )
+    columns = "report_id, repo_name, repo_url, status_code, count, report_date"
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE repostatuscountdata_v2 AS SELECT counts.report_id, "
+                "counts.repo_name, counts.repo_url, counts.status_code, counts.count, "
+                "reports.date AS report_date FROM repostatuscountdata AS counts "
+                "JOIN brokenlinkreportdata AS reports "
+                "ON reports.report_id = counts.report_id"
+            )
+        )
+        connection.execute(text("DROP TABLE repostatuscountdata"))
+        repo_status_counts.create(connection)
+        connection.execute(
+            text(
+                f"INSERT INTO repostatuscountdata ({columns}) "
+                f"SELECT {columns} FROM repostatuscountdata_v2"
+            )
+        )
+        connection.execute(text("DROP TABLE repostatuscountdata_v2"))
+        connection.execute(text("DROP INDEX IF EXISTS ix_urlcountdata_report_count"))
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_urlcountdata_report_count_url "
+                "ON urlcountdata (report_id, count DESC, url)"
+            )
+        )
+
+
+def create_leases(engine: Engine):
+    metadata = MetaData()
+    Table(
+        "leasedata",
+        metadata,
+        Column("name", String(), primary_key=True),
+        Column("holder", String(), nullable=False),
+        Column("expires", DateTime(), nullable=False),
+    )
+    metadata.create_all(engine)
+
+
+# Migration n brings a database from version n - 1 to version n
+MIGRATIONS: List[Callable[[Engine], None]] = [
+    # The tables and indexes of watney.db.schema_v1. Databases created before the schema
+    # was versioned get the tables and indexes they are missing.
+    schema_v1.create_schema,
+    # Key the report list pages on (date, report_id), which replaces the date index
+    extend_report_date_index,
+    # Read the rollups in index order: the report date moves into repostatuscountdata,
+    # so the repo trends are read without a join, the status codes of a report get an
+    # index, and the top urls index covers the url order of ties
+    index_rollup_reads,
+    # The leases of watney.db.leases, which keep the background retention to one process
+    create_leases,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(engine: Engine) -> int:
+    """
+    The version of the schema of a database, 0 if it was never migrated
+    """
+    try:
+        with engine.connect() as connection:
+            version = connection.execute(
+                select(SchemaVersionData.version).where(SchemaVersionData.id == 1)
+            ).scalar_one_or_none()
+    except DBAPIError:
+        # No schemaversiondata table
+        return 0
+    return version or 0
+
+
+def schema_is_current(engine: Engine) -> bool:
+    return schema_version(engine) == SCHEMA_VERSION
+
+
+def set_schema_version(engine: Engine, version: int):
+    """
+    Record the version in the single row of SchemaVersionData with one upsert
+    """
+    statement = insert_on_conflict(engine.dialect.name, SchemaVersionData).values(
+        id=1, version=version
+    )
+    with engine.begin() as connection:
+        connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=[SchemaVersionData.id], set_=dict(version=version)
+            )
+        )
+
+
+def migrate(engine: Engine) -> int:
+    """
+    Apply the migrations a database is missing
+    :param engine:
+    :return: the number of migrations applied
+    """
+    start = schema_version(engine)
+    if start > SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"The database schema is at version {start}, newer than the version "
+            f"{SCHEMA_VERSION} of this watney"
+        )
+    for version, migration in enumerate(MIGRATIONS[start:], start + 1):
+        migration(engine)
+        set_schema_version(engine, version)
+    return SCHEMA_VERSION - start
+
+
+def bootstrap(engine: Engine, check_layout: bool = True):
+    """
+    Make sure the schema of a database is current before serving it: migrate it with
+    settings.auto_migrate, otherwise only check its version
+    :param engine:
+    :param check_layout: also check that the links are stored in the layout of the
+        settings, see watney.layouts.check_storage_layout
+    """
+    if settings.auto_migrate:
+        migrate(engine)
+    elif not schema_is_current(engine):
+        raise SchemaVersionError(
+            f"The database schema is at version {schema_version(engine)}, this watney "
+            f"needs version {SCHEMA_VERSION}, run watney migrate"
+        )
+    if check_layout:
+        check_storage_layout(engine)
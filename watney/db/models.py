@@ -1,11 +1,79 @@
 from datetime import datetime
+from typing import Optional
 from uuid import UUID
 
+from sqlalchemy import Index, UniqueConstraint, text
 from sqlalchemy.future import Engine
 from sqlmodel import SQLModel, Field
 
+# Indexing scheme, every query in watney.helpers is served by one of these:
+#
+# brokenlinkreportdata
+#   primary key (report_id)           report_exists, report header lookups
+#   ix_brokenlinkreportdata_date_report_id
+#                                     report_exists_for_date, get_report_list (whose
+#                                     pages are keyed on date and report_id),
+#                                     get_last_two_reports, get_last_report_id_and_datestamp
+# brokenlinkfiledata
+#   primary key (report_id, repo_name, repo_url, file)
+#                                     every per-report scan (filtered on the report_id
+#                                     prefix, already ordered by repo for get_report_by_id)
+#                                     and the EXISTS probes of the report diff queries
+# reportdiffdata
+#   primary key (prev_report_id, new_report_id)
+#                                     checking whether a diff has been materialized
+#   ix_reportdiffdata_new_report_id   deleting the diffs of a report, with the primary key
+# brokenlinkdiffdata
+#   primary key (prev_report_id, new_report_id, state, repo_name, repo_url, file)
+#                                     reading one class of links of a materialized diff
+#   ix_brokenlinkdiffdata_new_report_id
+#                                     deleting the diffs of a report, with the primary key
+#
+# The normalized layout, see watney.normalized:
+#
+# repodata, filedata, urldata
+#   unique (repo_name, repo_url), (repo_id, path), (url)
+#                                     interning, looking up the id of a stored value
+# reportlinkdata
+#   primary key (report_id, file_id)  every per-report scan and the EXISTS probes of the
+#                                     report diff queries
+#
+# The link history layout, see watney.history:
+#
+# linkhistorydata
+#   ix_linkhistorydata_first_seen_date, ix_linkhistorydata_last_seen_date
+#                                     the links of a report (a range of first_seen_date)
+#                                     and the links still present (last_seen_date IS NULL)
+#   ix_linkhistorydata_link           the EXISTS probes of the report diff queries
+#
+# The rollups, see watney.rollups:
+#
+# repostatuscountdata
+#   primary key (report_id, repo_name, repo_url, status_code)
+#                                     deleting the rollups of a report
+#   ix_repostatuscountdata_report_status
+#                                     the status code distribution of a report, read in
+#                                     status code order
+#   ix_repostatuscountdata_repo_date  the trends of the repos, read in date order
+# urlcountdata
+#   ix_urlcountdata_report_count_url  the top urls of a report, read in count order
+# openlinkdata
+#   primary key (repo_name, repo_url, file)
+#                                     matching the links of a new report
+# fixtimedata
+#   primary key (report_id)           the time to fix, joined to the reports in a date range
+#
+# leasedata
+#   primary key (name)                taking and renewing a lease, see watney.db.leases
+#
+# watney/tests/test_query_plans.py fails when a query stops using them.
+
 
 class BrokenLinkReportData(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_brokenlinkreportdata_date_report_id", "date", "report_id"),
+    )
+
     report_id: UUID = Field(default=None, primary_key=True)
     date: datetime
 
@@ -24,8 +92,209 @@ class BrokenLinkFileData(SQLModel, table=True):
     status_code: int
 
 
+class ReportDiffData(SQLModel, table=True):
+    """
+    Marks the diff between two reports as materialized in BrokenLinkDiffData
+    """
+
+    __table_args__ = (Index("ix_reportdiffdata_new_report_id", "new_report_id"),)
+
+    prev_report_id: UUID = Field(
+        default=None, primary_key=True, foreign_key="brokenlinkreportdata.report_id"
+    )
+    new_report_id: UUID = Field(
+        default=None, primary_key=True, foreign_key="brokenlinkreportdata.report_id"
+    )
+
+
+class BrokenLinkDiffData(SQLModel, table=True):
+    """
+    A broken link classified as new, existing or fixed between two reports
+    """
+
+    __table_args__ = (Index("ix_brokenlinkdiffdata_new_report_id", "new_report_id"),)
+
+    prev_report_id: UUID = Field(
+        default=None, primary_key=True, foreign_key="brokenlinkreportdata.report_id"
+    )
+    new_report_id: UUID = Field(
+        default=None, primary_key=True, foreign_key="brokenlinkreportdata.report_id"
+    )
+    state: str = Field(default=None, primary_key=True)
+    repo_name: str = Field(default=None, primary_key=True)
+    repo_url: str = Field(default=None, primary_key=True)
+    file: str = Field(default=None, primary_key=True)
+    url: str
+    status_code: int
+
+
+class RepoData(SQLModel, table=True):
+    """
+    A repository stored once and referenced by id from FileData
+    """
+
+    __table_args__ = (UniqueConstraint("repo_name", "repo_url"),)
+
+    repo_id: Optional[int] = Field(default=None, primary_key=True)
+    repo_name: str
+    repo_url: str
+
+
+class FileData(SQLModel, table=True):
+    """
+    A file of a repository, the identity of a broken link across reports
+    """
+
+    __table_args__ = (UniqueConstraint("repo_id", "path"),)
+
+    file_id: Optional[int] = Field(default=None, primary_key=True)
+    repo_id: int = Field(foreign_key="repodata.repo_id")
+    path: str
+
+
+class UrlData(SQLModel, table=True):
+    """
+    A broken link target stored once and referenced by id from ReportLinkData
+    """
+
+    url_id: Optional[int] = Field(default=None, primary_key=True)
+    url: str = Field(sa_column_kwargs=dict(unique=True))
+
+
+class ReportLinkData(SQLModel, table=True):
+    """
+    A broken link in a report of the normalized layout
+    """
+
+    report_id: UUID = Field(
+        default=None, primary_key=True, foreign_key="brokenlinkreportdata.report_id"
+    )
+    file_id: int = Field(default=None, primary_key=True, foreign_key="filedata.file_id")
+    url_id: int = Field(foreign_key="urldata.url_id")
+    status_code: int
+
+
+class LinkHistoryData(SQLModel, table=True):
+    """
+    A broken link that was present, with the same url and status code, in every report
+    from first_seen_report to last_seen_report. last_seen_report is None while the link
+    is still in the latest report.
+    """
+
+    __table_args__ = (
+        Index("ix_linkhistorydata_first_seen_date", "first_seen_date"),
+        Index("ix_linkhistorydata_last_seen_date", "last_seen_date"),
+        Index("ix_linkhistorydata_link", "repo_name", "repo_url", "file"),
+    )
+
+    link_id: Optional[int] = Field(default=None, primary_key=True)
+    repo_name: str
+    repo_url: str
+    file: str
+    url: str
+    status_code: int
+    first_seen_report: UUID = Field(foreign_key="brokenlinkreportdata.report_id")
+    first_seen_date: datetime
+    last_seen_report: Optional[UUID] = Field(
+        default=None, foreign_key="brokenlinkreportdata.report_id"
+    )
+    last_seen_date: Optional[datetime] = None
+
+
+class RepoStatusCountData(SQLModel, table=True):
+    """
+    The number of broken links per status code in each repo of a report, with the date
+    of the report so the trends are read without a join
+    """
+
+    __table_args__ = (
+        Index(
+            "ix_repostatuscountdata_report_status", "report_id", "status_code", "count"
+        ),
+        Index(
+            "ix_repostatuscountdata_repo_date",
+            "repo_name",
+            "repo_url",
+            "report_date",
+            "report_id",
+        ),
+    )
+
+    report_id: UUID = Field(
+        default=None, primary_key=True, foreign_key="brokenlinkreportdata.report_id"
+    )
+    repo_name: str = Field(default=None, primary_key=True)
+    repo_url: str = Field(default=None, primary_key=True)
+    status_code: int = Field(default=None, primary_key=True)
+    count: int
+    report_date: datetime
+
+
+class UrlCountData(SQLModel, table=True):
+    """
+    The number of files linking to each broken url in a report
+    """
+
+    __table_args__ = (
+        Index(
+            "ix_urlcountdata_report_count_url", "report_id", text("count DESC"), "url"
+        ),
+    )
+
+    report_id: UUID = Field(
+        default=None, primary_key=True, foreign_key="brokenlinkreportdata.report_id"
+    )
+    url: str = Field(default=None, primary_key=True)
+    count: int
+
+
+class OpenLinkData(SQLModel, table=True):
+    """
+    A broken link of the latest report, with the date of the report it first appeared in
+    """
+
+    repo_name: str = Field(default=None, primary_key=True)
+    repo_url: str = Field(default=None, primary_key=True)
+    file: str = Field(default=None, primary_key=True)
+    first_seen_date: datetime
+
+
+class FixTimeData(SQLModel, table=True):
+    """
+    The links fixed in a report, and the sum of the time they were broken for
+    """
+
+    report_id: UUID = Field(
+        default=None, primary_key=True, foreign_key="brokenlinkreportdata.report_id"
+    )
+    fixed_links: int
+    fix_seconds: float
+
+
+class SchemaVersionData(SQLModel, table=True):
+    """
+    The version of the schema, a single row written by watney.db.migrations
+    """
+
+    id: int = Field(default=1, primary_key=True)
+    version: int
+
+
+class LeaseData(SQLModel, table=True):
+    """
+    A lease taken by one process until it expires, see watney.db.leases
+    """
+
+    name: str = Field(default=None, primary_key=True)
+    holder: str
+    expires: datetime
+
+
 def create_tables(engine: Engine):
     """
-    Create the tables in the database
+    Create the tables in the database, and any indexes missing from existing tables
     """
     SQLModel.metadata.create_all(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
@@ -0,0 +1,168 @@
+"""
+Version 1 of the schema, created by the first migration, see watney.db.migrations.
+
+These are the tables and indexes of watney.db.models as they were when the schema was
+first versioned, spelled out so the migration never changes with the models. Do not
+edit them: change the schema by appending a migration instead.
+"""
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    UniqueConstraint,
+)
+from sqlalchemy.future import Engine
+from sqlmodel.sql.sqltypes import GUID
+
+metadata = MetaData()
+
+
+def report_id_column(name: str = "report_id", **kwargs) -> Column:
+    return Column(
+        name,
+        GUID(),
+        ForeignKey("brokenlinkreportdata.report_id"),
+        nullable=False,
+        **kwargs,
+    )
+
+
+Table(
+    "brokenlinkreportdata",
+    metadata,
+    Column("report_id", GUID(), primary_key=True),
+    Column("date", DateTime(), nullable=False),
+    Index("ix_brokenlinkreportdata_date", "date"),
+)
+Table(
+    "brokenlinkfiledata",
+    metadata,
+    report_id_column(primary_key=True),
+    Column("repo_name", String(), primary_key=True),
+    Column("repo_url", String(), primary_key=True),
+    Column("file", String(), primary_key=True),
+    Column("url", String(), nullable=False),
+    Column("status_code", Integer(), nullable=False),
+)
+Table(
+    "reportdiffdata",
+    metadata,
+    report_id_column("prev_report_id", primary_key=True),
+    report_id_column("new_report_id", primary_key=True),
+    Index("ix_reportdiffdata_new_report_id", "new_report_id"),
+)
+Table(
+    "brokenlinkdiffdata",
+    metadata,
+    report_id_column("prev_report_id", primary_key=True),
+    report_id_column("new_report_id", primary_key=True),
+    Column("state", String(), primary_key=True),
+    Column("repo_name", String(), primary_key=True),
+    Column("repo_url", String(), primary_key=True),
+    Column("file", String(), primary_key=True),
+    Column("url", String(), nullable=False),
+    Column("status_code", Integer(), nullable=False),
+    Index("ix_brokenlinkdiffdata_new_report_id", "new_report_id"),
+)
+Table(
+    "repodata",
+    metadata,
+    Column("repo_id", Integer(), primary_key=True),
+    Column("repo_name", String(), nullable=False),
+    Column("repo_url", String(), nullable=False),
+    UniqueConstraint("repo_name", "repo_url"),
+)
+Table(
+    "filedata",
+    metadata,
+    Column("file_id", Integer(), primary_key=True),
+    Column("repo_id", Integer(), ForeignKey("repodata.repo_id"), nullable=False),
+    Column("path", String(), nullable=False),
+    UniqueConstraint("repo_id", "path"),
+)
+Table(
+    "urldata",
+    metadata,
+    Column("url_id", Integer(), primary_key=True),
+    Column("url", String(), nullable=False, unique=True),
+)
+Table(
+    "reportlinkdata",
+    metadata,
+    report_id_column(primary_key=True),
+    Column("file_id", Integer(), ForeignKey("filedata.file_id"), primary_key=True),
+    Column("url_id", Integer(), ForeignKey("urldata.url_id"), nullable=False),
+    Column("status_code", Integer(), nullable=False),
+)
+Table(
+    "linkhistorydata",
+    metadata,
+    Column("link_id", Integer(), primary_key=True),
+    Column("repo_name", String(), nullable=False),
+    Column("repo_url", String(), nullable=False),
+    Column("file", String(), nullable=False),
+    Column("url", String(), nullable=False),
+    Column("status_code", Integer(), nullable=False),
+    report_id_column("first_seen_report"),
+    Column("first_seen_date", DateTime(), nullable=False),
+    Column("last_seen_report", GUID(), ForeignKey("brokenlinkreportdata.report_id")),
+    Column("last_seen_date", DateTime()),
+    Index("ix_linkhistorydata_first_seen_date", "first_seen_date"),
+    Index("ix_linkhistorydata_last_seen_date", "last_seen_date"),
+    Index("ix_linkhistorydata_link", "repo_name", "repo_url", "file"),
+)
+Table(
+    "repostatuscountdata",
+    metadata,
+    report_id_column(primary_key=True),
+    Column("repo_name", String(), primary_key=True),
+    Column("repo_url", String(), primary_key=True),
+    Column("status_code", Integer(), primary_key=True),
+    Column("count", Integer(), nullable=False),
+    Index("ix_repostatuscountdata_repo", "repo_name", "repo_url", "report_id"),
+)
+Table(
+    "urlcountdata",
+    metadata,
+    report_id_column(primary_key=True),
+    Column("url", String(), primary_key=True),
+    Column("count", Integer(), nullable=False),
+    Index("ix_urlcountdata_report_count", "report_id", "count"),
+)
+Table(
+    "openlinkdata",
+    metadata,
+    Column("repo_name", String(), primary_key=True),
+    Column("repo_url", String(), primary_key=True),
+    Column("file", String(), primary_key=True),
+    Column("first_seen_date", DateTime(), nullable=False),
+)
+Table(
+    "fixtimedata",
+    metadata,
+    report_id_column(primary_key=True),
+    Column("fixed_links", Integer(), nullable=False),
+    Column("fix_seconds", Float(), nullable=False),
+)
+Table(
+    "schemaversiondata",
+    metadata,
+    Column("id", Integer(), primary_key=True, autoincrement=False),
+    Column("version", Integer(), nullable=False),
+)
+
+
+def create_schema(engine: Engine):
+    """
+    Create the tables of version 1, and any of their indexes missing from existing tables
+    """
+    metadata.create_all(engine)
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
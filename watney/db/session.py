@@ -1,23 +1,191 @@
 import functools
+from typing import AsyncIterator, Iterator
 
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlalchemy.future import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.sql import Insert
 from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from watney.metrics import instrument_engine
+from watney.profiling import log_slow_queries
 from watney.settings import settings
 
 
+# Async drivers used for the sync database URLs from Settings
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+
+def insert_on_conflict(dialect_name: str, table) -> Insert:
+    """
+    The INSERT construct of a dialect, which supports on_conflict_do_nothing and
+    on_conflict_do_update. Both backends of ASYNC_DRIVERS have INSERT ... ON CONFLICT.
+    :param dialect_name: e.g. session.bind.dialect.name
+    :param table:
+    :return:
+    """
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"No INSERT ... ON CONFLICT for {dialect_name} databases")
+    return insert(table)
+
+
+def _engine_options(
+    uri: str, pool_size: int, max_overflow: int, pool_recycle: int, pool_timeout: float
+) -> dict:
+    """
+    Connection pool and driver arguments for create_engine and create_async_engine.
+    SQLite file databases default to NullPool, so they are given a QueuePool and allowed to
+    be shared between the threads FastAPI runs sync endpoints on. In-memory SQLite databases
+    keep the default pool, since each connection would be a different database.
+    """
+    url = make_url(uri)
+    options = dict(
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_timeout=pool_timeout,
+        pool_pre_ping=True,
+    )
+    if url.get_backend_name() == "postgresql" and url.get_driver_name() == "psycopg2":
+        # Batch executemany INSERTs into multi-row VALUES statements
+        options.update(executemany_mode="values_plus_batch")
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return {}
+        if url.get_dialect().is_async:
+            options.update(poolclass=AsyncAdaptedQueuePool)
+        else:
+            options.update(
+                poolclass=QueuePool, connect_args={"check_same_thread": False}
+            )
+    return options
+
+
+def get_async_database_url(uri: str) -> str:
+    """
+    Translate a database URL to the equivalent URL for the backend's async driver,
+    e.g. sqlite:///database.db becomes sqlite+aiosqlite:///database.db
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases")
+    return str(url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}"))
+
+
 @functools.cache
-def get_engine(uri: str, echo: bool = False) -> Engine:
-    return create_engine(uri, echo=echo)
+def get_engine(
+    uri: str,
+    echo: bool = False,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_recycle: int = -1,
+    pool_timeout: float = 30,
+) -> Engine:
+    engine = create_engine(
+        uri,
+        echo=echo,
+        **_engine_options(uri, pool_size, max_overflow, pool_recycle, pool_timeout),
+    )
+    if settings.metrics:
+        instrument_engine(engine)
+    if settings.slow_query_threshold > 0:
+        log_slow_queries(engine)
+    return engine
 
 
 def get_engine_from_settings() -> Engine:
-    return get_engine(settings.database_url, settings.database_echo)
+    return get_engine(
+        settings.database_url,
+        settings.database_echo,
+        settings.database_pool_size,
+        settings.database_max_overflow,
+        settings.database_pool_recycle,
+        settings.database_pool_timeout,
+    )
 
 
-@functools.cache
 def get_session() -> Session:
+    """
+    Open a new session on the pooled engine. The caller owns the session and is responsible
+    for closing it, preferably by using it as a context manager.
+    """
     return Session(get_engine_from_settings())
 
 
-__all__ = ["get_session"]
+def get_db_session() -> Iterator[Session]:
+    """
+    FastAPI dependency handing out one session per request. The session's connection goes
+    back to the pool when the request is done.
+    """
+    with get_session() as session:
+        yield session
+
+
+@functools.cache
+def get_async_engine(
+    uri: str,
+    echo: bool = False,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_recycle: int = -1,
+    pool_timeout: float = 30,
+) -> AsyncEngine:
+    async_uri = get_async_database_url(uri)
+    engine = create_async_engine(
+        async_uri,
+        echo=echo,
+        future=True,
+        **_engine_options(
+            async_uri, pool_size, max_overflow, pool_recycle, pool_timeout
+        ),
+    )
+    if settings.metrics:
+        instrument_engine(engine.sync_engine)
+    if settings.slow_query_threshold > 0:
+        log_slow_queries(engine.sync_engine)
+    return engine
+
+
+def get_async_engine_from_settings() -> AsyncEngine:
+    return get_async_engine(
+        settings.database_url,
+        settings.database_echo,
+        settings.database_pool_size,
+        settings.database_max_overflow,
+        settings.database_pool_recycle,
+        settings.database_pool_timeout,
+    )
+
+
+def get_async_session() -> AsyncSession:
+    """
+    Open a new async session on the pooled async engine. As with get_session, the caller
+    owns the session.
+    """
+    return AsyncSession(get_async_engine_from_settings(), expire_on_commit=False)
+
+
+async def get_async_db_session() -> AsyncIterator[AsyncSession]:
+    """
+    FastAPI dependency handing out one async session per request
+    """
+    async with get_async_session() as session:
+        yield session
+
+
+__all__ = [
+    "get_session",
+    "get_db_session",
+    "get_async_session",
+    "get_async_db_session",
+]
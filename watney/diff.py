@@ -0,0 +1,220 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import exists, insert, literal
+from sqlalchemy.orm import aliased
+from sqlmodel import select
+from sqlalchemy.sql import Select
+from sqlmodel.sql.expression import SelectOfScalar
+
+from watney.db.models import BrokenLinkDiffData, BrokenLinkFileData, ReportDiffData
+
+LinkKey = Tuple[str, str, str]
+
+
+class LinkRow(NamedTuple):
+    """
+    A broken link as read by the query paths, a plain tuple without the identity map and
+    instance state of a BrokenLinkFileData object
+    """
+
+    repo_name: str
+    repo_url: str
+    file: str
+    url: str
+    status_code: int
+
+
+class ReportDiff(NamedTuple):
+    """
+    The classification of broken links between a previous and a new report
+    """
+
+    new: List[LinkRow]
+    existing: List[LinkRow]
+    fixed: List[LinkRow]
+
+
+def link_columns(query: Select) -> Select:
+    """
+    Narrow a query of broken links, e.g. of BrokenLinkFileData or BrokenLinkDiffData, to
+    the columns of LinkRow
+    :param query:
+    :return:
+    """
+    columns = query.selected_columns
+    return query.with_only_columns(
+        columns.repo_name,
+        columns.repo_url,
+        columns.file,
+        columns.url,
+        columns.status_code,
+    )
+
+
+def link_key(row: LinkRow) -> LinkKey:
+    """
+    The identity of a broken link across reports
+    :param row:
+    :return:
+    """
+    return row.repo_name, row.repo_url, row.file
+
+
+def diff_links(prev_rows: Iterable[LinkRow], new_rows: Iterable[LinkRow]) -> ReportDiff:
+    """
+    Classify the broken links of two reports as new, existing or fixed.
+
+    The keys of the previous report are hashed once, then the rows of the new report are
+    classified in a single pass. Rows are never copied, the returned lists reference the
+    rows that were passed in.
+    :param prev_rows: rows of the previous report
+    :param new_rows: rows of the new report
+    :return:
+    """
+    prev_rows = list(prev_rows)
+    prev_keys = {link_key(row) for row in prev_rows}
+    new_keys = set()
+    new = []
+    existing = []
+
+    for row in new_rows:
+        key = link_key(row)
+        new_keys.add(key)
+        if key in prev_keys:
+            existing.append(row)
+        else:
+            new.append(row)
+
+    fixed = [row for row in prev_rows if link_key(row) not in new_keys]
+    return ReportDiff(new=new, existing=existing, fixed=fixed)
+
+
+def _link_in_report(report_id: UUID):
+    """
+    Correlated EXISTS clause matching a BrokenLinkFileData row against the same link in
+    another report. Every column is part of the primary key, so this is an index lookup.
+    :param report_id: the report to look for the link in
+    :return:
+    """
+    other = aliased(BrokenLinkFileData)
+    return exists().where(
+        other.report_id == report_id,
+        other.repo_name == BrokenLinkFileData.repo_name,
+        other.repo_url == BrokenLinkFileData.repo_url,
+        other.file == BrokenLinkFileData.file,
+    )
+
+
+def new_links_query(prev_id: UUID, new_id: UUID) -> SelectOfScalar[BrokenLinkFileData]:
+    """
+    Links in the new report that are not in the previous report (anti-join)
+    """
+    return select(BrokenLinkFileData).where(
+        BrokenLinkFileData.report_id == new_id, ~_link_in_report(prev_id)
+    )
+
+
+def existing_links_query(
+    prev_id: UUID, new_id: UUID
+) -> SelectOfScalar[BrokenLinkFileData]:
+    """
+    Links in the new report that were already in the previous report (semi-join)
+    """
+    return select(BrokenLinkFileData).where(
+        BrokenLinkFileData.report_id == new_id, _link_in_report(prev_id)
+    )
+
+
+def fixed_links_query(
+    prev_id: UUID, new_id: UUID
+) -> SelectOfScalar[BrokenLinkFileData]:
+    """
+    Links in the previous report that are gone from the new report (anti-join)
+    """
+    return select(BrokenLinkFileData).where(
+        BrokenLinkFileData.report_id == prev_id, ~_link_in_report(new_id)
+    )
+
+
+def diff_queries(prev_id: UUID, new_id: UUID) -> Dict[str, SelectOfScalar]:
+    """
+    The set-based query for each class of links, keyed by the ReportDiff field name
+    """
+    return dict(
+        new=new_links_query(prev_id, new_id),
+        existing=existing_links_query(prev_id, new_id),
+        fixed=fixed_links_query(prev_id, new_id),
+    )
+
+
+def materialized_diff_queries(
+    prev_id: UUID, new_id: UUID
+) -> Dict[str, SelectOfScalar[BrokenLinkDiffData]]:
+    """
+    Read each class of links of a materialized diff, keyed by the ReportDiff field name
+    """
+    return {
+        state: select(BrokenLinkDiffData).where(
+            BrokenLinkDiffData.prev_report_id == prev_id,
+            BrokenLinkDiffData.new_report_id == new_id,
+            BrokenLinkDiffData.state == state,
+        )
+        for state in ReportDiff._fields
+    }
+
+
+def materialize_diff_statements(
+    prev_id: UUID, new_id: UUID, queries: Optional[Dict[str, Select]] = None
+) -> list:
+    """
+    INSERT ... SELECT statements that store the diff of two reports, starting with the
+    ReportDiffData marker row
+    :param prev_id:
+    :param new_id:
+    :param queries: the queries of each class of links, see
+        watney.storage.StorageLayout.diff_queries, by default those of the flat layout
+    :return:
+    """
+    statements = [
+        insert(ReportDiffData).values(prev_report_id=prev_id, new_report_id=new_id)
+    ]
+    id_type = ReportDiffData.__table__.c.prev_report_id.type
+    queries = queries or diff_queries(prev_id, new_id)
+    for state, query in queries.items():
+        statements.append(
+            insert(BrokenLinkDiffData).from_select(
+                [
+                    "repo_name",
+                    "repo_url",
+                    "file",
+                    "url",
+                    "status_code",
+                    "prev_report_id",
+                    "new_report_id",
+                    "state",
+                ],
+                link_columns(query).add_columns(
+                    literal(prev_id, id_type),
+                    literal(new_id, id_type),
+                    literal(state),
+                ),
+            )
+        )
+    return statements
+
+
+__all__ = [
+    "LinkKey",
+    "LinkRow",
+    "ReportDiff",
+    "link_columns",
+    "link_key",
+    "diff_links",
+    "new_links_query",
+    "existing_links_query",
+    "fixed_links_query",
+    "diff_queries",
+    "materialized_diff_queries",
+    "materialize_diff_statements",
+]
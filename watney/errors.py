@@ -4,3 +4,19 @@ class DuplicateReportError(Exception):
 
 class NoReportDataError(Exception):
     pass
+
+
+class InvalidReportDataError(Exception):
+    pass
+
+
+class OutOfOrderReportError(Exception):
+    pass
+
+
+class SchemaVersionError(Exception):
+    pass
+
+
+class StorageLayoutError(Exception):
+    pass
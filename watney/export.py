@@ -0,0 +1,159 @@
+"""
+CSV and newline-delimited JSON exports streamed straight from the database.
+
+Rows are fetched through a server-side cursor in batches of settings.export_batch_size and
+written to the response as they arrive, so neither the server's memory nor the time to the
+first byte depend on the size of the report.
+"""
+import csv
+import io
+import json
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy.sql import Select
+
+from watney.db.session import get_async_session
+from watney.diff import link_columns
+from watney.layouts import storage_layout
+from watney.settings import settings
+
+# The format of the CSV files served by watney
+CSV_FORMAT = dict(delimiter=" ", quotechar="|", quoting=csv.QUOTE_MINIMAL)
+
+REPORT_CSV_HEADER = ["repo name", "repo url", "file path", "full url", "status code"]
+BROKEN_LINKS_CSV_HEADER = ["file path", "full url", "status code", "new or existing"]
+DIFF_CSV_HEADER = [
+    "repo name",
+    "repo url",
+    "file path",
+    "full url",
+    "status code",
+    "new, existing or fixed",
+]
+DIFF_FIELDS = ["repo_name", "repo_url", "file", "url", "status_code", "state"]
+
+
+def csv_line(values: Sequence) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, **CSV_FORMAT).writerow(values)
+    return buffer.getvalue()
+
+
+async def stream_rows(query: Select) -> AsyncIterator[Sequence]:
+    """
+    Execute the query on its own session and yield the rows as the cursor produces them.
+    The session is not the request's session, which may be closed before the response body
+    is sent.
+    :param query:
+    :return:
+    """
+    query = query.execution_options(yield_per=settings.export_batch_size)
+    async with get_async_session() as session:
+        result = await session.stream(query)
+        async for row in result:
+            yield row
+
+
+async def stream_csv(
+    header: Sequence[str], queries: Iterable[Tuple[Select, Tuple]]
+) -> AsyncIterator[str]:
+    """
+    Yield the CSV header, then the rows of each query in turn.
+    :param header:
+    :param queries: pairs of a query and the values to append to each of its rows
+    :return:
+    """
+    yield csv_line(header)
+    for query, suffix in queries:
+        async for row in stream_rows(query):
+            yield csv_line(tuple(row) + suffix)
+
+
+async def stream_ndjson(
+    fields: Sequence[str], queries: Iterable[Tuple[Select, Tuple]]
+) -> AsyncIterator[str]:
+    """
+    Yield the rows of each query in turn as JSON objects, one per line.
+    :param fields: the keys of the values of a row
+    :param queries: pairs of a query and the values to append to each of its rows
+    :return:
+    """
+    for query, suffix in queries:
+        async for row in stream_rows(query):
+            yield json.dumps(dict(zip(fields, tuple(row) + suffix))) + "\n"
+
+
+def csv_response(content: AsyncIterator[str], filename: str) -> StreamingResponse:
+    response = StreamingResponse(content, media_type="text/csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+def report_csv_response(report_id: UUID) -> StreamingResponse:
+    """
+    Every broken link of one report, ordered by repo
+    :param report_id:
+    :return:
+    """
+    query = storage_layout().ordered_links_query(report_id)
+    return csv_response(
+        stream_csv(REPORT_CSV_HEADER, [(query, ())]), f"report-{report_id}.csv"
+    )
+
+
+def broken_links_csv_response(queries: Dict[str, Select]) -> StreamingResponse:
+    """
+    The known and the newly broken links of a report diff
+    :param queries: the diff's queries keyed by ReportDiff field name, see
+        watney.helpers.report_diff_queries
+    :return:
+    """
+
+    def csv_columns(query: Select) -> Select:
+        columns = query.selected_columns
+        return query.with_only_columns(columns.file, columns.url, columns.status_code)
+
+    labelled_queries = [
+        (csv_columns(queries["existing"]), ("existing/known",)),
+        (csv_columns(queries["new"]), ("new",)),
+    ]
+    return csv_response(
+        stream_csv(BROKEN_LINKS_CSV_HEADER, labelled_queries), "export.csv"
+    )
+
+
+def diff_response(
+    queries: Dict[str, Select],
+    states: List[str],
+    repo_name: Optional[str] = None,
+    status_code: Optional[int] = None,
+    format: str = "ndjson",
+) -> StreamingResponse:
+    """
+    The links of a report diff, one class after the other, as NDJSON or CSV
+    :param queries: the diff's queries keyed by ReportDiff field name, see
+        watney.helpers.report_diff_queries
+    :param states: the classes of links to include, in order
+    :param repo_name: only links of this repo
+    :param status_code: only links with this status code
+    :param format: "ndjson" or "csv"
+    :return:
+    """
+    labelled_queries = []
+    for state in states:
+        query = link_columns(queries[state])
+        columns = query.selected_columns
+        if repo_name is not None:
+            query = query.where(columns.repo_name == repo_name)
+        if status_code is not None:
+            query = query.where(columns.status_code == status_code)
+        labelled_queries.append((query, (state,)))
+
+    if format == "csv":
+        return csv_response(stream_csv(DIFF_CSV_HEADER, labelled_queries), "diff.csv")
+    return StreamingResponse(
+        stream_ndjson(DIFF_FIELDS, labelled_queries),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,64 @@
+"""
+Fast JSON rendering with orjson, enabled with settings.fast_json.
+
+The default path builds a pydantic model per broken link and walks them again with
+jsonable_encoder. render_report renders a report straight from the selected row tuples
+into plain dicts and lists, which orjson serializes in one call, see
+watney.async_helpers.report_json. The bytes are identical to
+those of the default path.
+"""
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Iterable
+from uuid import UUID
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any):
+    if isinstance(value, BaseModel):
+        return value.dict()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize content, which may contain pydantic models, as compact JSON
+    :param content:
+    :return:
+    """
+    if orjson is None:
+        raise ImportError("settings.fast_json requires orjson, install watney[orjson]")
+    return orjson.dumps(content, default=_default)
+
+
+def render_report(report_id: UUID, report_date: datetime, rows: Iterable) -> bytes:
+    """
+    The JSON of a report from its repo_name, repo_url, file, url and status_code rows,
+    ordered by repo
+    :param report_id:
+    :param report_date:
+    :param rows:
+    :return:
+    """
+    report = [
+        {
+            "repo_name": repo_name,
+            "repo_url": repo_url,
+            "broken_links": [
+                {"file": file, "url": url, "status_code": status_code}
+                for _, _, file, url, status_code in rows
+            ],
+        }
+        for (repo_name, repo_url), rows in groupby(rows, key=itemgetter(0, 1))
+    ]
+    return dumps({"report": report, "report_date": report_date, "report_id": report_id})
+
+
+__all__ = ["dumps", "render_report"]
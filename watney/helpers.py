@@ -1,16 +1,39 @@
-import copy
-import json
-from random import randint
+from itertools import groupby
 from uuid import UUID, uuid4
 from datetime import datetime
-from typing import Tuple, List, Optional
-
-from fastapi.responses import FileResponse
-from sqlmodel import select, desc
-
-from watney.db.session import get_session
-from watney.db.models import BrokenLinkReportData, BrokenLinkFileData
+from typing import Dict, Iterable, Iterator, Tuple, List, Optional
+
+from sqlalchemy import and_, delete, insert, or_, tuple_, update
+from sqlmodel import Session, select, desc
+from sqlalchemy.sql import Select
+from sqlmodel.sql.expression import SelectOfScalar
+
+from watney.db.models import (
+    BrokenLinkDiffData,
+    BrokenLinkReportData,
+    BrokenLinkFileData,
+    FileData,
+    LeaseData,
+    LinkHistoryData,
+    RepoData,
+    ReportDiffData,
+    ReportLinkData,
+    UrlData,
+)
+from watney.diff import (
+    LinkRow,
+    ReportDiff,
+    diff_links,
+    link_columns,
+    materialize_diff_statements,
+    materialized_diff_queries,
+)
 from watney.errors import DuplicateReportError, NoReportDataError
+from watney.layouts import storage_layout
+from watney.metrics import observe_diff, observe_ingest
+from watney.profiling import profiled
+from watney.rollups import delete_rollups, update_rollups
+from watney.settings import settings
 from watney.schema import (
     BrokenLink,
     BrokenLinkRepo,
@@ -19,13 +42,9 @@ from watney.schema import (
     ReportSummary,
 )
 
-from faker import Faker
-
-fake = Faker()
 
-
-def report_exists(report_id: UUID) -> bool:
-    results = get_session().exec(
+def report_exists(session: Session, report_id: UUID) -> bool:
+    results = session.exec(
         select(BrokenLinkReportData)
         .where(BrokenLinkReportData.report_id == report_id)
         .limit(1)
@@ -35,8 +54,8 @@ def report_exists(report_id: UUID) -> bool:
     return True
 
 
-def report_exists_for_date(datestamp: datetime) -> bool:
-    results = get_session().exec(
+def report_exists_for_date(session: Session, datestamp: datetime) -> bool:
+    results = session.exec(
         select(BrokenLinkReportData)
         .where(BrokenLinkReportData.date == datestamp)
         .limit(1)
@@ -46,25 +65,78 @@ def report_exists_for_date(datestamp: datetime) -> bool:
     return True
 
 
-def get_last_report_id_and_datestamp() -> Tuple[UUID, datetime]:
-    query = select(BrokenLinkReportData.date, BrokenLinkReportData.report_id).order_by(
-        desc(BrokenLinkReportData.date)
+def get_report_date(session: Session, report_id: UUID) -> Optional[datetime]:
+    query = select(BrokenLinkReportData.date).where(
+        BrokenLinkReportData.report_id == report_id
     )
-    result: tuple[datetime, UUID] = get_session().exec(query).first()
-    return result[1], result[0]
+    return session.exec(query).first()
 
 
-def get_report_list() -> ReportList:
+def get_last_report_id_and_datestamp(session: Session) -> Tuple[UUID, datetime]:
     query = (
         select(BrokenLinkReportData.date, BrokenLinkReportData.report_id)
-        .distinct()
         .order_by(desc(BrokenLinkReportData.date))
+        .limit(1)
     )
-    result = get_session().exec(query).fetchall()
+    result: tuple[datetime, UUID] = session.exec(query).first()
+    return result[1], result[0]
+
+
+def get_report_list(
+    session: Session,
+    limit: Optional[int] = None,
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
+    before_id: Optional[UUID] = None,
+    after_id: Optional[UUID] = None,
+) -> ReportList:
+    """
+    One page of the report summaries, newest first.
+    Pages are addressed by report date and id (keyset pagination), so every page is a
+    range scan of the (date, report_id) index no matter how deep into the history it is.
+    The id breaks ties between reports sharing a date, which persist rejects but clones
+    and concurrent ingestion can still store.
+    :param session:
+    :param limit: the page size, defaults to settings.report_list_page_size
+    :param before: only list reports older than this date
+    :param after: only list reports newer than this date. Without before, pages move
+        forward in time from this date.
+    :param before_id: with before, also list the reports dated before with a lower id
+    :param after_id: with after, also list the reports dated after with a higher id
+    :return: the page, with next_cursor and next_cursor_id set to the values of before
+        and before_id (or after and after_id) for the next page if there may be more
+        reports
+    """
+    limit = limit or settings.report_list_page_size
+    forward = after is not None and before is None
+    date, report_id = BrokenLinkReportData.date, BrokenLinkReportData.report_id
+    key = tuple_(date, report_id)
+    query = select(date, report_id)
+    if before is not None:
+        query = query.where(
+            date < before if before_id is None else key < (before, before_id)
+        )
+    if after is not None:
+        query = query.where(
+            date > after if after_id is None else key > (after, after_id)
+        )
+    if forward:
+        query = query.order_by(date, report_id)
+    else:
+        query = query.order_by(desc(date), desc(report_id))
+    result = session.exec(query.limit(limit)).fetchall()
+
+    next_cursor = next_cursor_id = None
+    if len(result) == limit:
+        next_cursor, next_cursor_id = result[-1]
+    if forward:
+        result.reverse()
     summary_items = [
         ReportSummary(report_id=str(x[1]), report_date=x[0].isoformat()) for x in result
     ]
-    return ReportList(reports=summary_items)
+    return ReportList(
+        reports=summary_items, next_cursor=next_cursor, next_cursor_id=next_cursor_id
+    )
 
 
 def create_data(
@@ -84,121 +156,154 @@ def create_data(
     )
 
 
-def persist(broken_link_report: BrokenLinkReport):
+def link_rows(report_id: UUID, broken_link_report: BrokenLinkReport) -> Iterator[dict]:
+    """
+    Flatten a report into BrokenLinkFileData column values, one dict per broken link
+    :param report_id:
+    :param broken_link_report:
+    :return:
+    """
+    for repo in broken_link_report.report:
+        for link in repo.broken_links:
+            yield dict(
+                report_id=report_id,
+                repo_name=repo.repo_name,
+                repo_url=repo.repo_url,
+                file=link.file,
+                url=link.url,
+                status_code=link.status_code,
+            )
+
+
+@profiled
+def persist(session: Session, broken_link_report: BrokenLinkReport):
     """
-    Persist all the BrokenLinkReportData to the table
+    Persist all the BrokenLinkReportData to the table.
+    The broken links are stored in the layout of settings.storage_layout, a chunk at a
+    time, inside a single transaction. With settings.bulk_ingest the flat layout bypasses
+    the ORM unit of work and writes chunked executemany INSERTs.
+    :param session:
     :param broken_link_report:
     :return:
     """
 
     # if a report already exists with matching datetime, error
-    if report_exists_for_date(broken_link_report.report_date):
+    if report_exists_for_date(session, broken_link_report.report_date):
         raise DuplicateReportError
 
     # otherwise, persist the data into the table
+    layout = storage_layout()
     report_id = uuid4()
-    result = []
-
-    # Create the report row
-    blrd = BrokenLinkReportData(
-        report_id=report_id, date=broken_link_report.report_date
+    report_date = broken_link_report.report_date
+    layout.check_new_report(session, report_date)
+    session.execute(
+        insert(BrokenLinkReportData).values(report_id=report_id, date=report_date)
     )
-    # Create the data rows
-    for repo in broken_link_report.report:
-        for link in repo.broken_links:
-            result.append(
-                BrokenLinkFileData(
-                    report_id=report_id,
-                    repo_name=repo.repo_name,
-                    repo_url=repo.repo_url,
-                    file=link.file,
-                    url=link.url,
-                    status_code=link.status_code,
-                )
-            )
-
-    with get_session() as session:
-        session.add(blrd)
-        session.add_all(result)
-        session.commit()
+    count = layout.write_links(
+        session, report_id, report_date, link_rows(report_id, broken_link_report)
+    )
+    derive_report_data(session, report_id, report_date)
+    session.commit()
+    observe_ingest(count, "json")
     return report_id
 
 
-def get_report_by_id(id_: UUID) -> Optional[BrokenLinkReport]:
+def derive_report_data(session: Session, report_id: UUID, report_date: datetime):
+    """
+    Compute the data derived from a newly stored report: the materialized diffs with its
+    neighbours and the rollups, as enabled in the settings. The caller is responsible for
+    committing.
+    :param session:
+    :param report_id:
+    :param report_date:
+    :return:
+    """
+    if settings.materialize_diffs:
+        materialize_adjacent_diffs(session, report_id, report_date)
+    if settings.maintain_rollups:
+        update_rollups(session, report_id, report_date)
+
+
+@profiled
+def get_report_by_id(session: Session, id_: UUID) -> Optional[BrokenLinkReport]:
     """
-    Reconstitute the report from the data in the table
+    Reconstitute the report from the data in the table.
+    The rows are read in a single scan ordered by repo, so the number of queries does not
+    depend on the number of repos in the report. Only the columns of the links are
+    selected, no ORM object is built per row.
+    :param session:
     :param id_:
     :return:
     """
-    query = (
-        select(BrokenLinkReportData)
-        .where(BrokenLinkReportData.report_id == str(id_))
-        .order_by(BrokenLinkReportData.date)
+    found = report_rows(session, id_)
+    if found is None:
+        return None
+    return build_report(id_, *found)
+
+
+@profiled
+def report_rows(
+    session: Session, id_: UUID
+) -> Optional[Tuple[datetime, List[LinkRow]]]:
+    """
+    The date of a report and its links, ordered by repo and file
+    :param session:
+    :param id_:
+    :return: None if there is no such report
+    """
+    query = select(BrokenLinkReportData.date).where(
+        BrokenLinkReportData.report_id == str(id_)
     )
 
-    with get_session() as session:
-        result = session.exec(query)
-        report_data = result.fetchall()
-        if len(report_data) == 0:
-            return None
-        report_id = id_
-        report_date = report_data[0].date.isoformat()
-
-        query = (
-            select(BrokenLinkFileData)
-            .where(BrokenLinkFileData.report_id == str(id_))
-            .order_by(BrokenLinkFileData.repo_name)
-        )
-        result = session.exec(query)
-        row_data = result.fetchall()
-        if len(row_data) == 0:
-            # Report exists, but there are no broken links
-            return BrokenLinkReport(
-                report_date=report_date, report_id=report_id, report=[]
-            )
+    report_date = session.exec(query).first()
+    if report_date is None:
+        return None
 
-        # Build a list of all the repo names
-        repo_list = []
-        query = (
-            select(BrokenLinkFileData.repo_name, BrokenLinkFileData.repo_url)
-            .where(BrokenLinkFileData.report_id == report_id)
-            .distinct()
-        )
-        repo_data = session.exec(query).fetchall()
-
-        broken_link_repos = []
-        for repo_name, repo_url in repo_data:
-            query = (
-                select(BrokenLinkFileData)
-                .where(BrokenLinkFileData.report_id == report_id)
-                .where(BrokenLinkFileData.repo_name == repo_name)
-            )
-            broken_links = session.exec(query).fetchall()
+    query = storage_layout().ordered_links_query(id_)
+    return report_date, fetch_link_rows(session, query)
 
-            broken_link_repos.append(
-                BrokenLinkRepo(
-                    repo_name=repo_name, repo_url=repo_url, broken_links=broken_links
-                )
-            )
-        return BrokenLinkReport(
-            report_date=report_date,
-            report_id=report_id,
-            report=broken_link_repos,
-        )
 
+@profiled
+def build_report(
+    id_: UUID, report_date: datetime, rows: Iterable[LinkRow]
+) -> BrokenLinkReport:
+    """
+    The report model of the rows returned by report_rows
+    """
+    return BrokenLinkReport(
+        report_date=report_date,
+        report_id=id_,
+        report=broken_link_repos(rows),
+    )
 
-def get_csv_report_by_id(report_id) -> FileResponse:
-    blr_json = get_report_by_id(report_id)
-    with open("/tmp/json_out.txt", "w") as json_file:
-        json.dump(blr_json, json_file)
-    return FileResponse("/tmp/json_out.txt")
+
+def broken_link_repos(rows: Iterable) -> List[BrokenLinkRepo]:
+    """
+    Group rows with repo_name, repo_url, file, url and status_code attributes, ordered by
+    repo, into the repos of a report
+    :param rows:
+    :return:
+    """
+    return [
+        BrokenLinkRepo(
+            repo_name=repo_name,
+            repo_url=repo_url,
+            broken_links=[
+                BrokenLink(file=row.file, url=row.url, status_code=row.status_code)
+                for row in rows
+            ],
+        )
+        for (repo_name, repo_url), rows in groupby(
+            rows, key=lambda row: (row.repo_name, row.repo_url)
+        )
+    ]
 
 
 class NotEnoughDataError(Exception):
     pass
 
 
-def get_last_two_reports() -> Optional[Tuple[UUID, UUID]]:
+def get_last_two_reports(session: Session) -> Optional[Tuple[UUID, UUID]]:
     """
     Gets the report ids of the most recent two reports
     :return:
@@ -208,7 +313,7 @@ def get_last_two_reports() -> Optional[Tuple[UUID, UUID]]:
         .order_by(desc(BrokenLinkReportData.date))
         .limit(2)
     )
-    result = get_session().exec(query)
+    result = session.exec(query)
     last_two = result.fetchall()
     if len(last_two) < 2:
         raise NotEnoughDataError
@@ -216,151 +321,395 @@ def get_last_two_reports() -> Optional[Tuple[UUID, UUID]]:
     return last_two[1][0], last_two[0][0]
 
 
-def broken_links_from_report(report_id: UUID) -> List[BrokenLinkFileData]:
-    with get_session() as session:
-        query = select(BrokenLinkFileData).where(
-            BrokenLinkFileData.report_id == report_id
-        )
-        return session.exec(query).fetchall()
+def report_has_links(session: Session, report_id: UUID) -> bool:
+    """
+    Check whether a report contains any broken links without loading them
+    :param session:
+    :param report_id:
+    :return:
+    """
+    query = storage_layout().links_query(report_id).limit(1)
+    return session.execute(query).first() is not None
 
 
+def fetch_link_rows(session: Session, query: Select) -> List[LinkRow]:
+    """
+    Run a query of broken links for its LinkRow columns only, see watney.diff.link_columns
+    The rows are fetched settings.export_batch_size at a time, so on an AsyncSession each
+    batch is a round trip that yields to the event loop.
+    :param session:
+    :param query:
+    :return:
+    """
+    query = link_columns(query).execution_options(yield_per=settings.export_batch_size)
+    return list(map(LinkRow._make, session.execute(query)))
+
+
+def broken_links_from_report(session: Session, report_id: UUID) -> List[LinkRow]:
+    return fetch_link_rows(session, storage_layout().links_query(report_id))
+
+
+def broken_links(rows: Optional[Iterable[LinkRow]]) -> Optional[List[BrokenLink]]:
+    """
+    The BrokenLink models of link rows
+    :param rows:
+    :return: None if rows is None
+    """
+    if rows is None:
+        return None
+    return [
+        BrokenLink(file=row.file, url=row.url, status_code=row.status_code)
+        for row in rows
+    ]
+
+
+@profiled
 def get_report_diff(
-    prev_id: UUID, new_id: UUID
+    session: Session, prev_id: UUID, new_id: UUID
 ) -> (List[BrokenLink], List[BrokenLink]):
     """
     Compare two reports and return the list of newly broken links and the list of known/existing
     broken links.
     :return:
     """
+    existing, new = get_report_diff_rows(session, prev_id, new_id)
+    return broken_links(existing), broken_links(new)
+
+
+@profiled
+def get_report_diff_rows(
+    session: Session, prev_id: UUID, new_id: UUID
+) -> Tuple[Optional[List[LinkRow]], Optional[List[LinkRow]]]:
+    """
+    The rows of get_report_diff: the known/existing and the newly broken links of two
+    reports, as LinkRow tuples
+    :return:
+    """
     if new_id is None:
         # No report data in the database
         raise NoReportDataError
 
     if prev_id is None:
-        return broken_links_from_report(new_id), None
+        new = broken_links_from_report(session, new_id)
+        observe_diff(new=len(new))
+        return new, None
 
-    existing_broken = []
+    if not report_has_links(session, prev_id):
+        new = broken_links_from_report(session, new_id)
+        observe_diff(new=len(new))
+        return None, new
 
-    old_report = get_report_by_id(prev_id)
-    if len(old_report.report) == 0:
-        return None, broken_links_from_report(new_id)
+    report_diff = query_report_diff(session, prev_id, new_id)
+    observe_diff(new=len(report_diff.new), existing=len(report_diff.existing))
+    return report_diff.existing, report_diff.new
 
-    with get_session() as session:
-        prev_query = select(BrokenLinkFileData).where(
-            BrokenLinkFileData.report_id == prev_id
-        )
-        prev_results = session.exec(prev_query).fetchall()
-        new_query = select(BrokenLinkFileData).where(
-            BrokenLinkFileData.report_id == new_id
+
+def query_report_diff(session: Session, prev_id: UUID, new_id: UUID) -> ReportDiff:
+    """
+    Classify the links of two reports as new, existing or fixed.
+    When settings.diff_in_database is enabled each class is fetched with a single
+    set-based query and only the rows of the result are loaded, as LinkRow tuples.
+    :param session:
+    :param prev_id:
+    :param new_id:
+    :return:
+    """
+    if not settings.diff_in_database:
+        return diff_links(
+            broken_links_from_report(session, prev_id),
+            broken_links_from_report(session, new_id),
         )
-        new_results = session.exec(new_query).fetchall()
 
-        # Find all matches in prev_results AND new_results, these are the existing_broken
-        for prev_row in prev_results:
-            for new_row in new_results:
-                if (
-                    prev_row.file == new_row.file
-                    and prev_row.repo_name == new_row.repo_name
-                    and prev_row.repo_url == new_row.repo_url
-                ):
-                    existing_broken.append(new_row)
-                    break
+    queries = report_diff_queries(session, prev_id, new_id)
+    return ReportDiff(
+        **{state: fetch_link_rows(session, query) for state, query in queries.items()}
+    )
+
+
+def report_diff_queries(
+    session: Session, prev_id: UUID, new_id: UUID
+) -> Dict[str, SelectOfScalar]:
+    """
+    The queries returning each class of links of the diff between two reports, keyed by
+    the ReportDiff field name.
+    They read the materialized diff when there is one, i.e. for consecutive reports
+    stored with settings.materialize_diffs, and compare the reports with the set-based
+    queries of the storage layout otherwise. Reading a diff never materializes it, so comparing arbitrary
+    pairs of reports stores nothing.
+    :param session:
+    :param prev_id:
+    :param new_id:
+    :return:
+    """
+    if is_diff_materialized(session, prev_id, new_id):
+        return materialized_diff_queries(prev_id, new_id)
+    return storage_layout().diff_queries(prev_id, new_id)
 
-        # Newly broken = all_broken - existing_broken
-        newly_broken = copy.deepcopy(new_results)
-        for row in existing_broken:
-            try:
-                newly_broken.remove(row)
-            except ValueError:
-                pass
 
-    return existing_broken, newly_broken
+def is_diff_materialized(session: Session, prev_id: UUID, new_id: UUID) -> bool:
+    query = select(ReportDiffData.new_report_id).where(
+        ReportDiffData.prev_report_id == prev_id,
+        ReportDiffData.new_report_id == new_id,
+    )
+    return session.exec(query).first() is not None
 
 
-def clear_db():
+def materialize_report_diff(session: Session, prev_id: UUID, new_id: UUID) -> bool:
     """
-    Exactly what it sounds like. Nukes all the data. Primarily intended for usage during testing.
+    Store the diff between two reports in BrokenLinkDiffData, unless it is already there.
+    The caller is responsible for committing.
+    :param session:
+    :param prev_id:
+    :param new_id:
+    :return: True if the diff was computed
+    """
+    if is_diff_materialized(session, prev_id, new_id):
+        return False
+    queries = storage_layout().diff_queries(prev_id, new_id)
+    for statement in materialize_diff_statements(prev_id, new_id, queries):
+        session.execute(statement)
+    return True
+
+
+def materialize_adjacent_diffs(
+    session: Session, report_id: UUID, report_date: datetime
+):
+    """
+    Materialize the diffs between a new report and the reports right before and after it.
+    The caller is responsible for committing.
+    :param session:
+    :param report_id:
+    :param report_date:
     :return:
     """
-    with get_session() as session:
-        query = select(BrokenLinkReportData)
-        result = get_session().exec(query)
-        for row in result:
-            session.delete(row)
-        query = select(BrokenLinkFileData)
-        result = get_session().exec(query)
-        for row in result:
-            session.delete(row)
+    query = (
+        select(BrokenLinkReportData.report_id)
+        .where(BrokenLinkReportData.date < report_date)
+        .order_by(desc(BrokenLinkReportData.date))
+        .limit(1)
+    )
+    prev_id = session.exec(query).first()
+    if prev_id is not None:
+        materialize_report_diff(session, prev_id, report_id)
+
+    query = (
+        select(BrokenLinkReportData.report_id)
+        .where(BrokenLinkReportData.date > report_date)
+        .order_by(BrokenLinkReportData.date)
+        .limit(1)
+    )
+    next_id = session.exec(query).first()
+    if next_id is not None:
+        materialize_report_diff(session, report_id, next_id)
+
+
+def backfill_report_diffs(session: Session) -> int:
+    """
+    Materialize the diff between every pair of consecutive reports that is missing one,
+    committing after each diff.
+    :param session:
+    :return: the number of diffs computed
+    """
+    query = select(BrokenLinkReportData.report_id).order_by(BrokenLinkReportData.date)
+    report_ids = session.exec(query).fetchall()
+    count = 0
+    for prev_id, new_id in zip(report_ids, report_ids[1:]):
+        if materialize_report_diff(session, prev_id, new_id):
+            session.commit()
+            count += 1
+    return count
+
+
+def delete_in_batches(
+    session: Session,
+    model,
+    condition,
+    key_columns: tuple,
+    batch_size: Optional[int] = None,
+) -> int:
+    """
+    Delete the rows matching condition with DELETE statements of at most batch_size rows
+    each, walking the rows in key order and committing after every batch, so concurrent
+    writers such as an ingestion are never blocked for more than one batch.
+    :param session:
+    :param model:
+    :param condition: a filter on a prefix of an index that continues with key_columns
+    :param key_columns: columns ordering the matching rows
+    :param batch_size: defaults to settings.retention_batch_size
+    :return: the number of rows deleted
+    """
+    batch_size = batch_size or settings.retention_batch_size
+    key = tuple_(*key_columns) if len(key_columns) > 1 else key_columns[0]
+    count = 0
+    while True:
+        # The key of the last row of the batch, None if the batch is the last one
+        boundary = session.execute(
+            select(*key_columns)
+            .where(condition)
+            .order_by(*key_columns)
+            .offset(batch_size - 1)
+            .limit(1)
+        ).first()
+        statement = delete(model).where(condition)
+        if boundary is not None:
+            statement = statement.where(
+                key <= (tuple_(*boundary) if len(key_columns) > 1 else boundary[0])
+            )
+        count += session.execute(statement).rowcount
         session.commit()
+        if boundary is None:
+            return count
 
 
-def delete_report_data(report_id: UUID):
+def delete_report_diffs(
+    session: Session, report_id: UUID, batch_size: Optional[int] = None
+):
     """
-    Delete all data for the report with the matching UUID
+    Delete the materialized diffs involving a report, in batches, see delete_in_batches
+    :param session:
     :param report_id:
+    :param batch_size:
     :return:
     """
-    with get_session() as session:
-        query = select(BrokenLinkFileData).where(
-            BrokenLinkFileData.report_id == report_id
+    query = select(ReportDiffData.prev_report_id, ReportDiffData.new_report_id).where(
+        or_(
+            ReportDiffData.prev_report_id == report_id,
+            ReportDiffData.new_report_id == report_id,
         )
-        query_result = session.exec(query)
-        for row in query_result:
-            session.delete(row)
-        query = select(BrokenLinkReportData).where(
-            BrokenLinkReportData.report_id == report_id
+    )
+    for prev_id, new_id in session.exec(query).fetchall():
+        delete_in_batches(
+            session,
+            BrokenLinkDiffData,
+            and_(
+                BrokenLinkDiffData.prev_report_id == prev_id,
+                BrokenLinkDiffData.new_report_id == new_id,
+            ),
+            (
+                BrokenLinkDiffData.state,
+                BrokenLinkDiffData.repo_name,
+                BrokenLinkDiffData.repo_url,
+                BrokenLinkDiffData.file,
+            ),
+            batch_size,
+        )
+        session.execute(
+            delete(ReportDiffData).where(
+                ReportDiffData.prev_report_id == prev_id,
+                ReportDiffData.new_report_id == new_id,
+            )
         )
-        session.delete(session.exec(query).first())
         session.commit()
 
 
-def clone_report(
-    existing_report: UUID,
-    report_id: UUID,
-    timestamp: str,
-    add_new_links=False,
-    num_new_links=1,
-):
-    valid_timestamp = datetime.fromisoformat(timestamp)
-    with get_session() as session:
-        query = select(BrokenLinkFileData).where(
-            BrokenLinkFileData.report_id == existing_report
+def delete_report_history(session: Session, report_id: UUID):
+    """
+    Remove a report from the link history, see watney.history. Intervals that start or
+    end at the report are shrunk to the reports next to it, intervals covering only the
+    report are deleted.
+    :param session:
+    :param report_id:
+    :return:
+    """
+    report_date = get_report_date(session, report_id)
+    if report_date is None:
+        return
+    prev_report = session.exec(
+        select(BrokenLinkReportData.report_id, BrokenLinkReportData.date)
+        .where(BrokenLinkReportData.date < report_date)
+        .order_by(desc(BrokenLinkReportData.date))
+        .limit(1)
+    ).first()
+    next_report = session.exec(
+        select(BrokenLinkReportData.report_id, BrokenLinkReportData.date)
+        .where(BrokenLinkReportData.date > report_date)
+        .order_by(BrokenLinkReportData.date)
+        .limit(1)
+    ).first()
+
+    # Report dates are unique, and unlike the report ids they are indexed
+    only_in_report = LinkHistoryData.last_seen_date == report_date
+    if next_report is None:
+        only_in_report = or_(only_in_report, LinkHistoryData.last_seen_date.is_(None))
+    session.execute(
+        delete(LinkHistoryData).where(
+            LinkHistoryData.first_seen_date == report_date, only_in_report
         )
-        query_result = session.exec(query).fetchall()
-        session.add(BrokenLinkReportData(report_id=report_id, date=valid_timestamp))
-        total_expected = len(query_result)
-        count = 0
-        for row in query_result:
-            if (
-                add_new_links
-                and num_new_links < 0
-                and count >= total_expected + num_new_links
-            ):
-                break
-            else:
-                session.add(
-                    BrokenLinkFileData(
-                        report_id=report_id,
-                        file=row.file,
-                        url=row.url,
-                        repo_name=row.repo_name,
-                        repo_url=row.repo_url,
-                        status_code=row.status_code,
-                    )
-                )
-                count += 1
-        if add_new_links:
-            if num_new_links > 0:
-                random_row = query_result[randint(0, len(query_result) - 1)]
-                for i in range(0, num_new_links):
-                    session.add(
-                        BrokenLinkFileData(
-                            report_id=report_id,
-                            file=fake.file_path(),
-                            url=random_row.url,
-                            repo_name=random_row.repo_name,
-                            repo_url=random_row.repo_url,
-                            status_code=random_row.status_code,
-                        )
-                    )
-        session.commit()
+    )
+    if next_report is not None:
+        session.execute(
+            update(LinkHistoryData)
+            .where(LinkHistoryData.first_seen_date == report_date)
+            .values(first_seen_report=next_report[0], first_seen_date=next_report[1])
+        )
+    if prev_report is not None:
+        session.execute(
+            update(LinkHistoryData)
+            .where(LinkHistoryData.last_seen_date == report_date)
+            .values(last_seen_report=prev_report[0], last_seen_date=prev_report[1])
+        )
+
+
+def clear_db(session: Session):
+    """
+    Exactly what it sounds like. Nukes all the data. Primarily intended for usage during testing.
+    :param session:
+    :return:
+    """
+    delete_rollups(session)
+    for model in (
+        BrokenLinkDiffData,
+        ReportDiffData,
+        ReportLinkData,
+        FileData,
+        RepoData,
+        UrlData,
+        LinkHistoryData,
+        BrokenLinkFileData,
+        BrokenLinkReportData,
+        LeaseData,
+    ):
+        session.execute(delete(model))
+    session.commit()
+
+
+def delete_report_data(
+    session: Session, report_id: UUID, batch_size: Optional[int] = None
+):
+    """
+    Delete all data for the report with the matching UUID.
+    The rows of the report are deleted in batches, each committed on its own, and the
+    report itself last, see delete_in_batches.
+    :param session:
+    :param report_id:
+    :param batch_size: defaults to settings.retention_batch_size
+    :return:
+    """
+    if not report_exists(session, report_id):
+        return
+    delete_report_diffs(session, report_id, batch_size)
+    delete_report_history(session, report_id)
+    delete_rollups(session, report_id)
+    session.commit()
+    delete_in_batches(
+        session,
+        ReportLinkData,
+        ReportLinkData.report_id == report_id,
+        (ReportLinkData.file_id,),
+        batch_size,
+    )
+    delete_in_batches(
+        session,
+        BrokenLinkFileData,
+        BrokenLinkFileData.report_id == report_id,
+        (
+            BrokenLinkFileData.repo_name,
+            BrokenLinkFileData.repo_url,
+            BrokenLinkFileData.file,
+        ),
+        batch_size,
+    )
+    session.execute(
+        delete(BrokenLinkReportData).where(BrokenLinkReportData.report_id == report_id)
+    )
+    session.commit()
@@ -0,0 +1,218 @@
+"""
+Interval-based storage of the link history.
+
+Broken links mostly persist from one crawl to the next, so instead of a row per link per
+report, the history layout stores a LinkHistoryData row per run of consecutive reports in
+which a link was present with the same url and status code. Storing a report only writes
+the links that appeared, disappeared or changed, so storage grows with the churn rather
+than with the number of reports, and a report is read back with a range query over the
+intervals covering its date.
+
+Enabled with settings.storage_layout = "history". Reports have to be stored in date
+order, and every report in BrokenLinkReportData is part of the history. `watney
+convert-layout` moves the links stored in another layout into it.
+
+Storing a report reads the open intervals and writes the ones it extends, opens or
+closes, so history ingestion is serialized: from the order check to the commit, the
+transaction storing a report holds the HISTORY_LOCK, see
+watney.db.leases.lock_for_transaction, and concurrent ingests wait for it in turn.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import and_, exists, insert, or_, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import ColumnElement, Select
+from sqlmodel import Session, desc, select
+
+from watney.db.leases import lock_for_transaction
+from watney.db.models import BrokenLinkReportData, LinkHistoryData
+from watney.diff import link_columns
+from watney.errors import OutOfOrderReportError
+from watney.storage import LinkWriter, StorageLayout, chunks
+
+# The lock serializing the transactions that store reports in the history
+HISTORY_LOCK = "history"
+
+# Intervals closed per UPDATE ... WHERE link_id IN (...)
+CLOSE_CHUNK_SIZE = 500
+
+
+def in_report(report_date: datetime, history=LinkHistoryData):
+    """
+    Filter on the intervals covering the report with the given date
+    :param report_date:
+    :param history: LinkHistoryData or an alias of it
+    :return:
+    """
+    return and_(
+        history.first_seen_date <= report_date,
+        or_(history.last_seen_date.is_(None), history.last_seen_date >= report_date),
+    )
+
+
+class HistoryWriter(LinkWriter):
+    """
+    Records the links of a report following the ones already in the history: the links
+    still present with the same url and status code extend their open interval, the
+    other ones open an interval, and finish closes the open intervals of the links that
+    are gone or changed. start takes the HISTORY_LOCK, held until the caller commits.
+    """
+
+    def start(self, session: Session):
+        lock_for_transaction(session, HISTORY_LOCK)
+        query = (
+            select(BrokenLinkReportData.report_id, BrokenLinkReportData.date)
+            .where(BrokenLinkReportData.date < self.report_date)
+            .order_by(desc(BrokenLinkReportData.date))
+            .limit(1)
+        )
+        self.prev_report: Optional[Tuple[UUID, datetime]] = session.exec(query).first()
+        query = select(
+            LinkHistoryData.link_id,
+            LinkHistoryData.repo_name,
+            LinkHistoryData.repo_url,
+            LinkHistoryData.file,
+            LinkHistoryData.url,
+            LinkHistoryData.status_code,
+        ).where(LinkHistoryData.last_seen_date.is_(None))
+        # The intervals not yet continued by a link of the report
+        self.open_links: Dict[Tuple[str, str, str], Tuple[int, str, int]] = {
+            (row.repo_name, row.repo_url, row.file): (
+                row.link_id,
+                row.url,
+                row.status_code,
+            )
+            for row in session.execute(query)
+        }
+
+    def write(self, session: Session, rows: List[dict]) -> int:
+        opened = []
+        for row in rows:
+            key = row["repo_name"], row["repo_url"], row["file"]
+            current = self.open_links.get(key)
+            if current is not None and current[1:] == (row["url"], row["status_code"]):
+                del self.open_links[key]
+                continue
+            opened.append(
+                dict(
+                    repo_name=row["repo_name"],
+                    repo_url=row["repo_url"],
+                    file=row["file"],
+                    url=row["url"],
+                    status_code=row["status_code"],
+                    first_seen_report=self.report_id,
+                    first_seen_date=self.report_date,
+                )
+            )
+        if opened:
+            session.execute(insert(LinkHistoryData), opened)
+        return len(rows)
+
+    def finish(self, session: Session):
+        closed = [link_id for link_id, _, _ in self.open_links.values()]
+        for chunk in chunks(closed, CLOSE_CHUNK_SIZE):
+            session.execute(
+                update(LinkHistoryData)
+                .where(LinkHistoryData.link_id.in_(chunk))
+                .values(
+                    last_seen_report=self.prev_report[0],
+                    last_seen_date=self.prev_report[1],
+                )
+            )
+
+
+def report_date_of(report_id: UUID) -> ColumnElement:
+    """
+    The date of a report as a scalar subquery, a primary key lookup
+    """
+    return (
+        select(BrokenLinkReportData.date)
+        .where(BrokenLinkReportData.report_id == report_id)
+        .scalar_subquery()
+    )
+
+
+def history_links_query(report_date) -> Select:
+    """
+    The intervals of the links in the report with the given date
+    :param report_date: a datetime or a SQL expression, see report_date_of
+    :return:
+    """
+    return link_columns(select(LinkHistoryData).where(in_report(report_date)))
+
+
+def _link_in_report(report_date: datetime):
+    """
+    Correlated EXISTS clause matching a LinkHistoryData row against an interval of the
+    same link covering another report
+    """
+    other = aliased(LinkHistoryData)
+    return exists().where(
+        other.repo_name == LinkHistoryData.repo_name,
+        other.repo_url == LinkHistoryData.repo_url,
+        other.file == LinkHistoryData.file,
+        in_report(report_date, other),
+    )
+
+
+def history_diff_queries(prev_date, new_date) -> Dict[str, Select]:
+    """
+    The range query for each class of links between two reports, keyed by the ReportDiff
+    field name. An interval covering the new report that starts before the previous
+    report covers both, only the intervals starting in between need an EXISTS probe.
+    :param prev_date: a datetime or a SQL expression, see report_date_of
+    :param new_date:
+    :return:
+    """
+    history = LinkHistoryData
+    return dict(
+        new=history_links_query(new_date).where(
+            history.first_seen_date > prev_date, ~_link_in_report(prev_date)
+        ),
+        existing=history_links_query(new_date).where(
+            or_(history.first_seen_date <= prev_date, _link_in_report(prev_date))
+        ),
+        fixed=history_links_query(prev_date).where(
+            history.last_seen_date < new_date, ~_link_in_report(new_date)
+        ),
+    )
+
+
+class HistoryLayout(StorageLayout):
+    name = "history"
+    models = (LinkHistoryData,)
+
+    def links_query(self, report_id: UUID) -> Select:
+        return history_links_query(report_date_of(report_id))
+
+    def diff_queries(self, prev_id: UUID, new_id: UUID) -> Dict[str, Select]:
+        return history_diff_queries(report_date_of(prev_id), report_date_of(new_id))
+
+    def writer(self, report_id: UUID, report_date: datetime) -> LinkWriter:
+        return HistoryWriter(report_id, report_date)
+
+    def check_new_report(self, session: Session, report_date: datetime):
+        lock_for_transaction(session, HISTORY_LOCK)
+        query = (
+            select(BrokenLinkReportData.date)
+            .where(BrokenLinkReportData.date > report_date)
+            .limit(1)
+        )
+        newer = session.exec(query).first()
+        if newer is not None:
+            raise OutOfOrderReportError(
+                f"The link history already has a report from {newer}"
+            )
+
+
+__all__ = [
+    "HISTORY_LOCK",
+    "in_report",
+    "HistoryWriter",
+    "report_date_of",
+    "history_links_query",
+    "history_diff_queries",
+    "HistoryLayout",
+]
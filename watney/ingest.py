@@ -0,0 +1,181 @@
+"""
+Incremental ingestion of newline-delimited JSON reports.
+
+The first line is a ReportHeader, e.g. {"report_date": "2023-03-14T14:15:34"}. Every
+following line is either a whole BrokenLinkRepo or a single BrokenLinkRecord. Lines are
+parsed as they arrive and spooled to a temporary file, so only one line is held in
+memory at a time. Once the whole body is received, the report is written from the spool
+in chunks, in a transaction that does not wait on the client.
+"""
+import json
+import tempfile
+from datetime import datetime
+from typing import IO, AsyncIterable, AsyncIterator, Iterator, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from watney.db.models import BrokenLinkReportData
+from watney.errors import DuplicateReportError, InvalidReportDataError
+from watney.metrics import observe_ingest
+from watney.helpers import derive_report_data, report_exists_for_date
+from watney.layouts import storage_layout
+from watney.schema import BrokenLinkRecord, BrokenLinkRepo, ReportHeader
+
+
+async def ndjson_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    Split a stream of byte chunks into non-blank lines
+    :param chunks:
+    :return:
+    """
+    partial = []
+    async for chunk in chunks:
+        *complete, rest = chunk.split(b"\n")
+        for piece in complete:
+            partial.append(piece)
+            line = b"".join(partial)
+            partial = []
+            if line.strip():
+                yield line
+        if rest:
+            partial.append(rest)
+    line = b"".join(partial)
+    if line.strip():
+        yield line
+
+
+def parse_header(line: bytes) -> ReportHeader:
+    try:
+        return ReportHeader.parse_raw(line)
+    except ValidationError as err:
+        raise InvalidReportDataError(f"line 1: {err}")
+
+
+def parse_link_rows(report_id: UUID, line: bytes, line_number: int) -> List[dict]:
+    """
+    Validate a repo or link line and turn it into BrokenLinkFileData column values
+    :param report_id:
+    :param line:
+    :param line_number: used in error messages
+    :return:
+    """
+    try:
+        data = json.loads(line)
+        if isinstance(data, dict) and "broken_links" in data:
+            repo = BrokenLinkRepo.parse_obj(data)
+            records = [
+                BrokenLinkRecord(
+                    repo_name=repo.repo_name, repo_url=repo.repo_url, **link.dict()
+                )
+                for link in repo.broken_links
+            ]
+        else:
+            records = [BrokenLinkRecord.parse_obj(data)]
+    except (ValueError, ValidationError) as err:
+        raise InvalidReportDataError(f"line {line_number}: {err}")
+    return [dict(report_id=report_id, **record.dict()) for record in records]
+
+
+# The BrokenLinkFileData columns of a spooled row, after the number of its line
+SPOOL_COLUMNS = ("repo_name", "repo_url", "file", "url", "status_code")
+
+
+def spool_rows(spool: IO[bytes], rows: List[dict], line_number: int):
+    for row in rows:
+        values = [line_number] + [row[column] for column in SPOOL_COLUMNS]
+        spool.write(json.dumps(values).encode() + b"\n")
+
+
+def spooled_rows(spool: IO[bytes], report_id: UUID) -> Iterator[dict]:
+    """
+    Read back the rows of spool_rows, as BrokenLinkFileData column values
+    """
+    spool.seek(0)
+    for line in spool:
+        line_number, *values = json.loads(line)
+        yield dict(zip(SPOOL_COLUMNS, values), report_id=report_id)
+
+
+def duplicate_line(spool: IO[bytes]) -> Optional[Tuple[int, int]]:
+    """
+    Find the first spooled link with the same repo and file as an earlier one
+    :return: the numbers of the line of the duplicate and of the line of the original
+    """
+    lines = {}
+    spool.seek(0)
+    for line in spool:
+        line_number, repo_name, repo_url, file, *_ = json.loads(line)
+        original = lines.setdefault((repo_name, repo_url, file), line_number)
+        if original != line_number:
+            return line_number, original
+    return None
+
+
+def write_report(
+    session: Session, report_id: UUID, report_date: datetime, spool: IO[bytes]
+) -> int:
+    """
+    Store a report and its spooled links in the storage layout of the settings, as
+    watney.helpers.persist does
+    :return: the number of links stored
+    """
+    if report_exists_for_date(session, report_date):
+        raise DuplicateReportError
+    layout = storage_layout()
+    layout.check_new_report(session, report_date)
+    session.execute(
+        insert(BrokenLinkReportData).values(report_id=report_id, date=report_date)
+    )
+    count = layout.write_links(
+        session, report_id, report_date, spooled_rows(spool, report_id)
+    )
+    derive_report_data(session, report_id, report_date)
+    return count
+
+
+async def persist_ndjson(session: AsyncSession, chunks: AsyncIterable[bytes]) -> UUID:
+    """
+    Persist a newline-delimited JSON report, in the storage layout of the settings.
+    The body is validated and spooled to a temporary file as it is received, and the
+    report is written in one transaction once the body is complete. A malformed line
+    anywhere in the stream, or a link repeating the repo and file of an earlier one,
+    leaves no trace of the report.
+    :param session:
+    :param chunks: the raw request body
+    :return: the id of the new report
+    """
+    lines = ndjson_lines(chunks)
+    try:
+        header = parse_header(await lines.__anext__())
+    except StopAsyncIteration:
+        raise InvalidReportDataError("The report is empty")
+
+    report_id = uuid4()
+    with tempfile.TemporaryFile() as spool:
+        line_number = 1
+        async for line in lines:
+            line_number += 1
+            spool_rows(
+                spool, parse_link_rows(report_id, line, line_number), line_number
+            )
+
+        try:
+            count = await session.run_sync(
+                write_report, report_id, header.report_date, spool
+            )
+            await session.commit()
+        except IntegrityError as error:
+            await session.rollback()
+            duplicate = duplicate_line(spool)
+            if duplicate is None:
+                raise
+            raise InvalidReportDataError(
+                "line {}: duplicate of the link on line {}".format(*duplicate)
+            ) from error
+    observe_ingest(count, "ndjson")
+    return report_id
@@ -0,0 +1,114 @@
+"""
+The storage layouts, see watney.storage, and the migration between them.
+
+settings.storage_layout picks the layout of the links: "flat" (watney.storage),
+"normalized" (watney.normalized) or "history" (watney.history). A database holds its
+links in a single layout: the API and the maintenance commands refuse to start when it
+has links in another layout than the settings, see check_storage_layout. Change the layout of an existing database with
+
+    STORAGE_LAYOUT=normalized watney convert-layout
+"""
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete
+from sqlalchemy.future import Engine
+from sqlmodel import Session, select
+
+from watney.db.models import BrokenLinkReportData
+from watney.errors import StorageLayoutError
+from watney.history import HistoryLayout
+from watney.normalized import NormalizedLayout
+from watney.settings import settings
+from watney.storage import FlatLayout, StorageLayout
+
+LAYOUTS: Dict[str, StorageLayout] = {
+    layout.name: layout
+    for layout in (FlatLayout(), NormalizedLayout(), HistoryLayout())
+}
+
+
+def storage_layout(name: Optional[str] = None) -> StorageLayout:
+    """
+    The layout named name, by default the one of settings.storage_layout
+    """
+    name = name or settings.storage_layout
+    try:
+        return LAYOUTS[name]
+    except KeyError:
+        raise ValueError(f"Unknown storage layout {name}")
+
+
+def stored_layouts(session: Session) -> List[StorageLayout]:
+    """
+    The layouts holding any link, each checked with a single row lookup
+    """
+    return [
+        layout
+        for layout in LAYOUTS.values()
+        if session.exec(select(layout.models[0]).limit(1)).first() is not None
+    ]
+
+
+def check_storage_layout(engine: Engine):
+    """
+    Refuse to serve a database whose links are stored in another layout than the one of
+    the settings, where every report would read back empty
+    """
+    layout = storage_layout()
+    with Session(engine) as session:
+        others = [
+            other.name for other in stored_layouts(session) if other is not layout
+        ]
+    if others:
+        raise StorageLayoutError(
+            f"The database stores links in the {', '.join(others)} layout, not in the "
+            f"{layout.name} layout of the settings, run watney convert-layout"
+        )
+
+
+def convert_layout(session: Session, target: Optional[StorageLayout] = None) -> int:
+    """
+    Move the links of every report from the layout they are stored in to target, in a
+    single transaction. The reports are written in date order, then the tables of the
+    source layout are emptied. Nothing served from the links changes, so the materialized
+    diffs, the rollups and the cached responses are left as they are.
+    :param session:
+    :param target: defaults to the layout of the settings
+    :return: the number of links moved
+    """
+    target = target or storage_layout()
+    sources = [layout for layout in stored_layouts(session) if layout is not target]
+    if not sources:
+        return 0
+    if len(sources) > 1:
+        raise StorageLayoutError(
+            f"The database stores links in the "
+            f"{', '.join(layout.name for layout in sources)} layouts"
+        )
+    (source,) = sources
+
+    query = select(BrokenLinkReportData.report_id, BrokenLinkReportData.date).order_by(
+        BrokenLinkReportData.date
+    )
+    count = 0
+    for report_id, report_date in session.exec(query).fetchall():
+        rows = session.execute(source.links_query(report_id)).fetchall()
+        count += target.write_links(
+            session,
+            report_id,
+            report_date,
+            (dict(report_id=report_id, **row._asdict()) for row in rows),
+        )
+    for model in source.models:
+        session.execute(delete(model))
+    session.commit()
+    return count
+
+
+__all__ = [
+    "LAYOUTS",
+    "storage_layout",
+    "stored_layouts",
+    "check_storage_layout",
+    "convert_layout",
+]
@@ -1,49 +1,149 @@
+import asyncio
 import uuid
 from datetime import datetime
+from typing import List, Optional
 
-from fastapi import HTTPException
+from fastapi import Depends, Header, HTTPException, Query, Request
 from fastapi import FastAPI
-from starlette.responses import FileResponse
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    Response,
+)
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from watney.db.session import get_engine_from_settings
-from watney.db.models import create_tables
-from watney.errors import DuplicateReportError, NoReportDataError
-from watney.helpers import (
+from watney.cache import cached_response, get_cache, invalidate_cache
+from watney.db.session import get_async_db_session, get_engine_from_settings
+from watney.db.migrations import bootstrap
+from watney.errors import (
+    DuplicateReportError,
+    InvalidReportDataError,
+    NoReportDataError,
+    OutOfOrderReportError,
+)
+from watney.async_helpers import (
     persist,
-    get_csv_report_by_id,
+    report_exists,
     get_report_by_id,
     get_report_list as get_report_list_,
     get_last_two_reports,
+    get_report_date,
     get_report_diff,
-    NotEnoughDataError,
+    report_diff_queries,
+    report_json,
+    repo_trends,
+    status_code_counts,
+    time_to_fix,
+    top_urls,
+)
+from watney.diff import ReportDiff
+from watney.export import (
+    broken_links_csv_response,
+    diff_response,
+    report_csv_response,
+)
+from watney.helpers import NotEnoughDataError
+from watney.ingest import persist_ndjson
+from watney.metrics import MetricsMiddleware, content_type, exposition
+from watney.profiling import (
+    ProfilingMiddleware,
+    is_authorized,
+    profile_path,
+    profile_report,
+)
+from watney.retention import run_retention
+from watney.schema import (
+    BrokenLinkReport,
+    BrokenLinksResponse,
+    RepoTrendResponse,
+    StatusCodeResponse,
+    TopUrlsResponse,
+)
+from watney.settings import settings
+
+app = FastAPI(
+    default_response_class=ORJSONResponse if settings.fast_json else JSONResponse
 )
-from watney.schema import BrokenLinkReport, BrokenLinksResponse
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+background_tasks = set()
 
-app = FastAPI()
-create_tables(get_engine_from_settings())
+
+@app.on_event("startup")
+def check_schema():
+    bootstrap(get_engine_from_settings())
+
+
+@app.on_event("startup")
+async def start_retention():
+    if settings.retention_interval > 0:
+        task = asyncio.create_task(run_retention(settings.retention_interval))
+        background_tasks.add(task)
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
 
 
 @app.post("/report", status_code=201)
-def report(broken_link_report: BrokenLinkReport):
+async def report(
+    broken_link_report: BrokenLinkReport,
+    session: AsyncSession = Depends(get_async_db_session),
+):
     """
     Store new broken link report data.
     :param broken_link_report:
+    :param session:
+    :return:
+    """
+    try:
+        report_id = await persist(session, broken_link_report)
+    except (DuplicateReportError, OutOfOrderReportError) as er:
+        raise HTTPException(status_code=409, detail=str(er))
+    await invalidate_cache()
+
+    return {"report_id": report_id}
+
+
+@app.post("/report-stream", status_code=201)
+async def report_stream(
+    request: Request, session: AsyncSession = Depends(get_async_db_session)
+):
+    """
+    Store new broken link report data sent as newline-delimited JSON.
+    The first line holds the report_date, every other line one repo or one broken link.
+    :param request:
+    :param session:
     :return:
     """
     try:
-        report_id = persist(broken_link_report)
-    except DuplicateReportError as er:
+        report_id = await persist_ndjson(session, request.stream())
+    except (DuplicateReportError, OutOfOrderReportError) as er:
         raise HTTPException(status_code=409, detail=str(er))
+    except InvalidReportDataError as er:
+        raise HTTPException(status_code=422, detail=str(er))
+    await invalidate_cache()
 
     return {"report_id": report_id}
 
 
 @app.get("/report/{report_id}")
-def get_report(report_id, csv=False):
+async def get_report(
+    report_id,
+    request: Request,
+    csv: bool = False,
+    session: AsyncSession = Depends(get_async_db_session),
+):
     """
     Retrieve the data from a specific report.
     :param report_id:
+    :param request:
     :param csv:
+    :param session:
     :return:
     """
     import uuid
@@ -53,22 +153,62 @@ def get_report(report_id, csv=False):
     except ValueError:
         raise HTTPException(status_code=400, detail=f"{report_id} is not a valid UUID")
     if csv:
-        return get_csv_report_by_id(report_id)
-    result = get_report_by_id(report_id)
-    if not result:
-        raise HTTPException(status_code=404, detail=f"Report {report_id} not found")
-    return result
+        if not await report_exists(session, report_id):
+            raise HTTPException(status_code=404, detail=f"Report {report_id} not found")
+        return report_csv_response(report_id)
+
+    async def load():
+        if settings.fast_json:
+            result = await report_json(session, uuid.UUID(report_id))
+        else:
+            result = await get_report_by_id(session, report_id)
+        if not result:
+            raise HTTPException(status_code=404, detail=f"Report {report_id} not found")
+        return result
+
+    return await cached_response(request, ("report", uuid.UUID(report_id)), load)
 
 
 @app.get("/report-summary")
-async def get_report_list():
-    return get_report_list_()
+async def get_report_list(
+    request: Request,
+    limit: Optional[int] = Query(
+        default=None, ge=1, le=settings.report_list_max_page_size
+    ),
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
+    before_id: Optional[uuid.UUID] = None,
+    after_id: Optional[uuid.UUID] = None,
+    session: AsyncSession = Depends(get_async_db_session),
+):
+    """
+    List the stored reports, newest first, one page at a time.
+    Pass the next_cursor and next_cursor_id of a page as before and before_id (or as
+    after and after_id, when paging forward in time) to get the following page.
+    :param request:
+    :param limit:
+    :param before:
+    :param after:
+    :param before_id:
+    :param after_id:
+    :param session:
+    :return:
+    """
+    return await cached_response(
+        request,
+        ("report-summary", limit, before, after, before_id, after_id),
+        lambda: get_report_list_(session, limit, before, after, before_id, after_id),
+    )
 
 
 @app.get("/broken-links")
-def broken_links(csv: bool = False):
+async def broken_links(
+    request: Request,
+    csv: bool = False,
+    session: AsyncSession = Depends(get_async_db_session),
+):
     try:
-        prev_report_id, recent_report_id = get_last_two_reports()
+        prev_report_id, recent_report_id = await get_last_two_reports(session)
     except NoReportDataError as err:
         raise HTTPException(
             status_code=409,
@@ -80,38 +220,234 @@ def broken_links(csv: bool = False):
             detail=f"Not enough report data available to analyze ({err})",
         )
 
-    existing_broken_links, new_broken_links = get_report_diff(
-        prev_report_id, recent_report_id
-    )
-
     if csv:
-        import csv
+        queries = await report_diff_queries(session, prev_report_id, recent_report_id)
+        return broken_links_csv_response(queries)
 
-        file_path = "/tmp/export.csv"
-        with open(file_path, "w", newline="") as csvfile:
-            data_writer = csv.writer(
-                csvfile, delimiter=" ", quotechar="|", quoting=csv.QUOTE_MINIMAL
-            )
-            # headers
-            data_writer.writerow(
-                ["file path", "full url", "status code", "new or existing"]
-            )
-            # data
-            for link in existing_broken_links:
-                data_writer.writerow(
-                    [link.file, link.url, link.status_code, "existing/known"]
-                )
-            for link in new_broken_links:
-                data_writer.writerow([link.file, link.url, link.status_code, "new"])
-        response = FileResponse(file_path, media_type="text/csv")
-        response.headers["Content-Disposition"] = "attachment; filename=export.csv"
-        return response
-    else:
+    async def load():
+        existing_broken_links, new_broken_links = await get_report_diff(
+            session, prev_report_id, recent_report_id
+        )
         return BrokenLinksResponse(
             new_broken_links=new_broken_links if new_broken_links else [],
             existing_broken_links=existing_broken_links
             if existing_broken_links
             else [],
-            last_report_id=uuid.uuid4(),
-            last_report_date=datetime.now(),
+            last_report_id=recent_report_id,
+            last_report_date=await get_report_date(session, recent_report_id),
+        )
+
+    return await cached_response(
+        request, ("broken-links", prev_report_id, recent_report_id), load
+    )
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """
+    Hit and miss counters of this worker's response cache.
+    :return:
+    """
+    return get_cache().stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics of this worker, see watney.metrics.
+    :return:
+    """
+    if not settings.metrics:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(exposition(), media_type=content_type())
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    profile: Optional[str] = None,
+    format: str = Query(default="text", regex="^(text|pstats)$"),
+    x_watney_profile: Optional[str] = Header(default=None),
+):
+    """
+    A stored request profile, as text sorted by cumulative time or as a pstats file.
+    Requires the profiling token, in the X-Watney-Profile header or the profile query
+    parameter.
+    :param profile_id: from the X-Watney-Profile-Id header of the profiled response
+    :param profile:
+    :param format: "text" or "pstats"
+    :param x_watney_profile:
+    :return:
+    """
+    if not is_authorized(x_watney_profile or profile):
+        raise HTTPException(status_code=403, detail="Not authorized to read profiles")
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    if format == "pstats":
+        return FileResponse(path, filename=f"{profile_id}.prof")
+    return PlainTextResponse(profile_report(path))
+
+
+@app.get("/diff")
+async def diff(
+    from_: str = Query(alias="from"),
+    to: str = Query(),
+    repo: Optional[str] = None,
+    status: Optional[int] = None,
+    state: List[str] = Query(default=list(ReportDiff._fields)),
+    format: str = Query(default="ndjson", regex="^(ndjson|csv)$"),
+    session: AsyncSession = Depends(get_async_db_session),
+):
+    """
+    Compare any two reports, streaming the new, existing and fixed links as
+    newline-delimited JSON or CSV.
+    :param from_: the id of the earlier report
+    :param to: the id of the later report
+    :param repo: only links of this repo
+    :param status: only links with this status code
+    :param state: the classes of links to include, new, existing and fixed by default
+    :param format: ndjson or csv
+    :param session:
+    :return:
+    """
+    unknown_states = set(state) - set(ReportDiff._fields)
+    if unknown_states:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown states {', '.join(sorted(unknown_states))}",
+        )
+    report_ids = []
+    for report_id in (from_, to):
+        try:
+            report_ids.append(uuid.UUID(report_id))
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail=f"{report_id} is not a valid UUID"
+            )
+        if not await report_exists(session, report_ids[-1]):
+            raise HTTPException(status_code=404, detail=f"Report {report_id} not found")
+
+    queries = await report_diff_queries(session, *report_ids)
+    return diff_response(queries, state, repo, status, format)
+
+
+async def stats_report_id(session: AsyncSession, report_id: Optional[str]) -> uuid.UUID:
+    """
+    The report to compute statistics of, the latest one by default
+    :param session:
+    :param report_id:
+    :return:
+    """
+    if report_id is None:
+        reports = (await get_report_list_(session, limit=1)).reports
+        if not reports:
+            raise HTTPException(status_code=409, detail="No report data available")
+        return uuid.UUID(reports[0].report_id)
+    try:
+        report_uuid = uuid.UUID(report_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{report_id} is not a valid UUID")
+    if not await report_exists(session, report_uuid):
+        raise HTTPException(status_code=404, detail=f"Report {report_id} not found")
+    return report_uuid
+
+
+@app.get("/stats/repos")
+async def stats_repos(
+    request: Request,
+    repo_name: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    session: AsyncSession = Depends(get_async_db_session),
+):
+    """
+    The number of broken links per repo in each report.
+    :param request:
+    :param repo_name: only this repo
+    :param since: only reports from this date on
+    :param until: only reports up to this date
+    :param session:
+    :return:
+    """
+
+    async def load():
+        return RepoTrendResponse(
+            repos=await repo_trends(session, repo_name, since, until)
         )
+
+    return await cached_response(
+        request, ("stats-repos", repo_name, since, until), load
+    )
+
+
+@app.get("/stats/top-urls")
+async def stats_top_urls(
+    request: Request,
+    report_id: Optional[str] = None,
+    limit: int = Query(default=10, ge=1, le=1000),
+    session: AsyncSession = Depends(get_async_db_session),
+):
+    """
+    The broken urls linked from the most files in a report, the latest one by default.
+    :param request:
+    :param report_id:
+    :param limit:
+    :param session:
+    :return:
+    """
+    report_uuid = await stats_report_id(session, report_id)
+
+    async def load():
+        return TopUrlsResponse(
+            report_id=report_uuid, urls=await top_urls(session, report_uuid, limit)
+        )
+
+    return await cached_response(request, ("stats-top-urls", report_uuid, limit), load)
+
+
+@app.get("/stats/status-codes")
+async def stats_status_codes(
+    request: Request,
+    report_id: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_db_session),
+):
+    """
+    The number of broken links per status code in a report, the latest one by default.
+    :param request:
+    :param report_id:
+    :param session:
+    :return:
+    """
+    report_uuid = await stats_report_id(session, report_id)
+
+    async def load():
+        return StatusCodeResponse(
+            report_id=report_uuid,
+            status_codes=await status_code_counts(session, report_uuid),
+        )
+
+    return await cached_response(request, ("stats-status-codes", report_uuid), load)
+
+
+@app.get("/stats/time-to-fix")
+async def stats_time_to_fix(
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    session: AsyncSession = Depends(get_async_db_session),
+):
+    """
+    The mean number of seconds links stayed broken, over the links fixed by the reports
+    in a date range.
+    :param request:
+    :param since:
+    :param until:
+    :param session:
+    :return:
+    """
+    return await cached_response(
+        request,
+        ("stats-time-to-fix", since, until),
+        lambda: time_to_fix(session, since, until),
+    )
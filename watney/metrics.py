@@ -0,0 +1,264 @@
+"""
+Prometheus metrics, enabled with settings.metrics and served at /metrics.
+
+MetricsMiddleware times every request and measures its request and response bodies,
+labelled with the route template so that e.g. every /report/{report_id} falls into one
+series. The engines of watney.db.session are instrumented with cursor execute events:
+every statement is timed and labelled with its verb and first table, e.g.
+"SELECT brokenlinkfiledata", and with the route of the request that sent it, which is
+tracked in a context variable. persist and get_report_diff record the rows they ingest
+and the size of the diffs they return.
+
+Every worker process has its own registry, scrape each of them. prometheus_client is
+only imported once metrics are enabled, so it stays off the startup path otherwise.
+"""
+import functools
+import re
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from watney.settings import settings
+
+# Request and response sizes from 64 bytes to 64 MiB
+SIZE_BUCKETS = tuple(4**i for i in range(3, 14))
+# Rows per report or diff, and statements per request
+COUNT_BUCKETS = (1, 10, 100, 1000, 10_000, 100_000, 1_000_000)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+\"?(\w+)", re.IGNORECASE)
+
+# The route of the request being handled, and the number of statements it sent so far
+current_route: ContextVar[str] = ContextVar("current_route", default="none")
+statement_count: ContextVar[Optional[list]] = ContextVar(
+    "statement_count", default=None
+)
+
+
+class Metrics:
+    """
+    The collectors of a registry
+    """
+
+    def __init__(self, registry):
+        from prometheus_client import Histogram
+
+        self.registry = registry
+        self.request_seconds = Histogram(
+            "watney_http_request_duration_seconds",
+            "Time to handle a request, including streaming the response",
+            ["method", "route", "status"],
+            registry=registry,
+        )
+        self.request_bytes = Histogram(
+            "watney_http_request_size_bytes",
+            "Size of the request body",
+            ["method", "route"],
+            buckets=SIZE_BUCKETS,
+            registry=registry,
+        )
+        self.response_bytes = Histogram(
+            "watney_http_response_size_bytes",
+            "Size of the response body",
+            ["method", "route"],
+            buckets=SIZE_BUCKETS,
+            registry=registry,
+        )
+        self.request_statements = Histogram(
+            "watney_http_request_db_statements",
+            "Database statements sent while handling a request",
+            ["method", "route"],
+            buckets=STATEMENT_BUCKETS,
+            registry=registry,
+        )
+        self.statement_seconds = Histogram(
+            "watney_db_statement_duration_seconds",
+            "Time to execute a database statement",
+            ["statement", "route"],
+            registry=registry,
+        )
+        self.ingested_rows = Histogram(
+            "watney_ingested_rows",
+            "Broken links stored per report",
+            ["source"],
+            buckets=COUNT_BUCKETS,
+            registry=registry,
+        )
+        self.diff_links = Histogram(
+            "watney_diff_links",
+            "Broken links per class returned by get_report_diff",
+            ["state"],
+            buckets=COUNT_BUCKETS,
+            registry=registry,
+        )
+
+
+@functools.cache
+def get_metrics() -> Metrics:
+    """
+    The metrics of this process
+    """
+    try:
+        from prometheus_client import CollectorRegistry
+    except ImportError:
+        raise ImportError(
+            "settings.metrics requires prometheus-client, install watney[metrics]"
+        )
+    return Metrics(CollectorRegistry())
+
+
+def exposition() -> bytes:
+    """
+    The metrics in the Prometheus text format
+    """
+    from prometheus_client import generate_latest
+
+    return generate_latest(get_metrics().registry)
+
+
+def content_type() -> str:
+    from prometheus_client import CONTENT_TYPE_LATEST
+
+    return CONTENT_TYPE_LATEST
+
+
+def statement_name(statement: str) -> str:
+    """
+    A low-cardinality name for a SQL statement: its verb and the first table it reads
+    or writes
+    """
+    words = statement.split(None, 1)
+    if not words:
+        return ""
+    match = TABLE.search(statement)
+    verb = words[0].upper()
+    return f"{verb} {match.group(1).lower()}" if match else verb
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_start"].pop()
+    if not settings.metrics:
+        return
+    get_metrics().statement_seconds.labels(
+        statement_name(statement), current_route.get()
+    ).observe(elapsed)
+    count = statement_count.get()
+    if count is not None:
+        count[0] += 1
+
+
+def instrument_engine(engine: Engine):
+    """
+    Time the statements sent through an engine. For an AsyncEngine, pass its
+    sync_engine.
+    :param engine:
+    :return:
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def observe_ingest(rows: int, source: str):
+    """
+    Record the number of broken links of a stored report
+    :param rows:
+    :param source: "json" or "ndjson"
+    :return:
+    """
+    if settings.metrics:
+        get_metrics().ingested_rows.labels(source).observe(rows)
+
+
+def observe_diff(**sizes: int):
+    """
+    Record the size of each class of links of a diff, e.g. observe_diff(new=3)
+    """
+    if settings.metrics:
+        diff_links = get_metrics().diff_links
+        for state, size in sizes.items():
+            diff_links.labels(state).observe(size)
+
+
+def route_name(scope: Scope) -> str:
+    """
+    The path template of the route matching a request, "unmatched" if there is none
+    """
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Measure every HTTP request while settings.metrics is enabled
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not settings.metrics:
+            await self.app(scope, receive, send)
+            return
+
+        metrics = get_metrics()
+        method = scope["method"]
+        route = route_name(scope)
+        request_bytes = 0
+        response_bytes = 0
+        status = 500
+
+        async def receive_counted() -> Message:
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message: Message):
+            nonlocal response_bytes, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        route_token = current_route.set(route)
+        count_token = statement_count.set([0])
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.request_seconds.labels(method, route, str(status)).observe(elapsed)
+            metrics.request_bytes.labels(method, route).observe(request_bytes)
+            metrics.response_bytes.labels(method, route).observe(response_bytes)
+            metrics.request_statements.labels(method, route).observe(
+                statement_count.get()[0]
+            )
+            current_route.reset(route_token)
+            statement_count.reset(count_token)
+
+
+__all__ = [
+    "get_metrics",
+    "exposition",
+    "content_type",
+    "statement_name",
+    "instrument_engine",
+    "observe_ingest",
+    "observe_diff",
+    "MetricsMiddleware",
+]
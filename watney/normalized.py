@@ -0,0 +1,186 @@
+"""
+Normalized storage of report data.
+
+The flat layout stores every broken link of every report as a BrokenLinkFileData row that
+repeats the repo name, repo url, file path and url strings, although most links are the
+same from one report to the next. The normalized layout stores each of those values once,
+in RepoData, FileData and UrlData, and a report as ReportLinkData rows holding the integer
+ids of its files and urls. Reports grow by a narrow row per link, and the diff queries
+probe an integer primary key instead of a composite of strings.
+
+Enabled with settings.storage_layout = "normalized". `watney convert-layout` moves the
+links stored in another layout into it.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+from uuid import UUID
+
+from sqlalchemy import exists, insert
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+
+from watney.db.models import FileData, RepoData, ReportLinkData, UrlData
+from watney.db.session import insert_on_conflict
+from watney.settings import settings
+from watney.storage import LinkWriter, StorageLayout, chunks
+
+# Values looked up per IN (...) query while interning, well below SQLite's limit of
+# bound parameters per statement
+INTERN_CHUNK_SIZE = 400
+
+
+def intern_values(
+    session: Session, model, columns: Tuple[str, ...], values: Iterable[tuple]
+) -> Dict[tuple, int]:
+    """
+    The id of each value of a RepoData, FileData or UrlData table, inserting the values
+    that are not stored yet. The inserts join the session's transaction, and skip the
+    values a concurrent ingest stored since they were looked up, which are then loaded
+    with the others.
+    :param session:
+    :param model: the interned table
+    :param columns: the columns of its unique constraint
+    :param values: tuples of column values, duplicates are fine
+    :return: the id of every value
+    """
+    table = model.__table__
+    (id_column,) = table.primary_key.columns
+    value_columns = [table.c[name] for name in columns]
+    values = list(dict.fromkeys(values))
+
+    def load(chunk: List[tuple]):
+        # One IN list per column rather than a row value IN list, which SQLite answers
+        # with a full scan. The rows matching every list are a superset of the chunk.
+        wanted = set(chunk)
+        query = select(id_column, *value_columns).where(
+            *(
+                column.in_({value[i] for value in chunk})
+                for i, column in enumerate(value_columns)
+            )
+        )
+        for row in session.execute(query):
+            if tuple(row[1:]) in wanted:
+                ids[tuple(row[1:])] = row[0]
+
+    ids = {}
+    for chunk in chunks(values, INTERN_CHUNK_SIZE):
+        load(chunk)
+    missing = [value for value in values if value not in ids]
+    statement = insert_on_conflict(
+        session.get_bind().dialect.name, table
+    ).on_conflict_do_nothing(index_elements=value_columns)
+    for chunk in chunks(missing, settings.ingest_chunk_size):
+        session.execute(statement, [dict(zip(columns, value)) for value in chunk])
+    for chunk in chunks(missing, INTERN_CHUNK_SIZE):
+        load(chunk)
+    return ids
+
+
+class NormalizedWriter(LinkWriter):
+    def write(self, session: Session, rows: List[dict]) -> int:
+        """
+        Intern the repos, files and urls of a chunk of links and insert a ReportLinkData
+        row per link
+        """
+        repo_ids = intern_values(
+            session,
+            RepoData,
+            ("repo_name", "repo_url"),
+            ((row["repo_name"], row["repo_url"]) for row in rows),
+        )
+        links = [(repo_ids[row["repo_name"], row["repo_url"]], row) for row in rows]
+        file_ids = intern_values(
+            session,
+            FileData,
+            ("repo_id", "path"),
+            ((repo_id, row["file"]) for repo_id, row in links),
+        )
+        url_ids = intern_values(
+            session, UrlData, ("url",), ((row["url"],) for _, row in links)
+        )
+        session.execute(
+            insert(ReportLinkData),
+            [
+                dict(
+                    report_id=self.report_id,
+                    file_id=file_ids[repo_id, row["file"]],
+                    url_id=url_ids[(row["url"],)],
+                    status_code=row["status_code"],
+                )
+                for repo_id, row in links
+            ],
+        )
+        return len(rows)
+
+
+def _link_columns() -> tuple:
+    return (
+        RepoData.repo_name,
+        RepoData.repo_url,
+        FileData.path.label("file"),
+        UrlData.url,
+        ReportLinkData.status_code,
+    )
+
+
+def links_query(report_id: UUID) -> Select:
+    """
+    The broken links of a normalized report, with the same columns as BrokenLinkFileData
+    """
+    return (
+        select(*_link_columns())
+        .select_from(ReportLinkData)
+        .join(FileData, FileData.file_id == ReportLinkData.file_id)
+        .join(RepoData, RepoData.repo_id == FileData.repo_id)
+        .join(UrlData, UrlData.url_id == ReportLinkData.url_id)
+        .where(ReportLinkData.report_id == report_id)
+    )
+
+
+def _file_in_report(report_id: UUID):
+    """
+    Correlated EXISTS clause matching a ReportLinkData row against the same file in
+    another report, a lookup of the (report_id, file_id) primary key
+    """
+    other = aliased(ReportLinkData)
+    return exists().where(
+        other.report_id == report_id, other.file_id == ReportLinkData.file_id
+    )
+
+
+def normalized_diff_queries(prev_id: UUID, new_id: UUID) -> Dict[str, Select]:
+    """
+    The set-based query for each class of links, keyed by the ReportDiff field name,
+    see watney.diff.diff_queries
+    """
+    return dict(
+        new=links_query(new_id).where(~_file_in_report(prev_id)),
+        existing=links_query(new_id).where(_file_in_report(prev_id)),
+        fixed=links_query(prev_id).where(~_file_in_report(new_id)),
+    )
+
+
+class NormalizedLayout(StorageLayout):
+    name = "normalized"
+    # The interned values are kept when a report is deleted, and emptied after the links
+    # referencing them
+    models = (ReportLinkData, FileData, UrlData, RepoData)
+
+    def links_query(self, report_id: UUID) -> Select:
+        return links_query(report_id)
+
+    def diff_queries(self, prev_id: UUID, new_id: UUID) -> Dict[str, Select]:
+        return normalized_diff_queries(prev_id, new_id)
+
+    def writer(self, report_id: UUID, report_date: datetime) -> LinkWriter:
+        return NormalizedWriter(report_id, report_date)
+
+
+__all__ = [
+    "intern_values",
+    "NormalizedWriter",
+    "links_query",
+    "normalized_diff_queries",
+    "NormalizedLayout",
+]
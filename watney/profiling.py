@@ -0,0 +1,280 @@
+"""
+Diagnostics of slow queries and slow requests in production.
+
+With settings.slow_query_threshold, every statement that takes longer is logged to the
+watney.slow_queries logger with its parameters, the watney function that sent it and the
+route of the request, see log_slow_queries.
+
+With settings.profile_token, a request that carries the token in the X-Watney-Profile
+header or in the profile query parameter is profiled: the helpers that read and build
+reports and diffs, and persist, which are wrapped with profiled, run under cProfile. If
+one of them ran before the response started, the response gets an X-Watney-Profile-Id
+header and the profile is stored in settings.profile_dir, where /profiles/{profile_id}
+serves it to callers with the same token. The profiler follows the thread each profiled
+function runs on, the event loop for the queries and a worker thread for building the
+models, so other requests handled meanwhile on those threads can show up in the profile.
+
+A process profiles one request at a time, since profilers of concurrent requests would
+share the event loop thread, and Python 3.12 refuses to enable a second one. A request
+asking for a profile while another one is profiled runs unprofiled, and its response
+gets an X-Watney-Profile-Skipped header instead.
+"""
+import cProfile
+import functools
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+from urllib.parse import parse_qs
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from watney.metrics import current_route
+from watney.settings import settings
+
+logger = logging.getLogger("watney.slow_queries")
+
+PROFILE_HEADER = "x-watney-profile"
+PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+# Characters of the parameters logged with a slow query
+MAX_PARAMETERS_LENGTH = 1000
+# Modules skipped when looking for the function that sent a statement
+INFRASTRUCTURE_MODULES = ("watney.db.", "watney.metrics", "watney.profiling")
+# Held by the request being profiled
+profile_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    The profile of one request, enabled while a profiled function runs
+    """
+
+    def __init__(self):
+        self.profile_id = uuid.uuid4().hex
+        self.profile = cProfile.Profile()
+        self.depth = 0
+        self.calls = 0
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+def caller() -> str:
+    """
+    The innermost watney function on the stack, outside of the database and
+    instrumentation modules
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("watney.") and not module.startswith(
+            INFRASTRUCTURE_MODULES
+        ):
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["slow_query_start"].pop()
+    threshold = settings.slow_query_threshold
+    if threshold <= 0 or elapsed < threshold:
+        return
+    logger.warning(
+        "Slow query (%.3fs) from %s in %s: %s parameters: %s",
+        elapsed,
+        caller(),
+        current_route.get(),
+        statement,
+        repr(parameters)[:MAX_PARAMETERS_LENGTH],
+    )
+
+
+def log_slow_queries(engine: Engine):
+    """
+    Log the statements sent through an engine that are slower than
+    settings.slow_query_threshold. For an AsyncEngine, pass its sync_engine.
+    :param engine:
+    :return:
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def profiled(function):
+    """
+    Run a function under the profiler of the current request, if it is profiled
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        request_profile = current_profile.get()
+        if request_profile is None:
+            return function(*args, **kwargs)
+        request_profile.calls += 1
+        request_profile.depth += 1
+        if request_profile.depth == 1:
+            request_profile.profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            request_profile.depth -= 1
+            if request_profile.depth == 0:
+                request_profile.profile.disable()
+
+    return wrapper
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    """
+    Whether a caller presented the profiling token
+    """
+    return bool(settings.profile_token) and hmac.compare_digest(
+        (token or "").encode(), settings.profile_token.encode()
+    )
+
+
+def request_token(scope: Scope) -> Optional[str]:
+    """
+    The profiling token of a request, from the X-Watney-Profile header or the profile
+    query parameter
+    """
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER.encode():
+            return value.decode("latin-1")
+    values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("profile")
+    return values[0] if values else None
+
+
+def profile_dir() -> str:
+    return settings.profile_dir or os.path.join(
+        tempfile.gettempdir(), "watney-profiles"
+    )
+
+
+def profile_path(profile_id: str) -> Optional[str]:
+    """
+    The file of a stored profile, None if there is no such profile
+    """
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(profile_dir(), f"{profile_id}.prof")
+    return path if os.path.exists(path) else None
+
+
+def store_profile(request_profile: RequestProfile) -> Optional[str]:
+    """
+    Write the profile of a request to settings.profile_dir
+    :return: the path of the file, None if no profiled function ran
+    """
+    if not request_profile.calls:
+        return None
+    os.makedirs(profile_dir(), exist_ok=True)
+    path = os.path.join(profile_dir(), f"{request_profile.profile_id}.prof")
+    request_profile.profile.dump_stats(path)
+    return path
+
+
+def profile_report(path: str, limit: int = 50) -> str:
+    """
+    The functions of a stored profile with the most cumulative time, as text
+    """
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return output.getvalue()
+
+
+def with_header(send: Send, name: bytes, value: bytes = b"1") -> Send:
+    """
+    Add a header to the response sent through send
+    """
+
+    async def send_with_header(message: Message):
+        if message["type"] == "http.response.start":
+            message = dict(message)
+            message["headers"] = [*message.get("headers", []), (name, value)]
+        await send(message)
+
+    return send_with_header
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests of authorized callers that ask for it
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or not settings.profile_token
+            or not is_authorized(request_token(scope))
+        ):
+            await self.app(scope, receive, send)
+            return
+        if not profile_lock.acquire(blocking=False):
+            await self.app(
+                scope, receive, with_header(send, b"x-watney-profile-skipped")
+            )
+            return
+        try:
+            await self.profile(scope, receive, send)
+        finally:
+            profile_lock.release()
+
+    async def profile(self, scope: Scope, receive: Receive, send: Send):
+        request_profile = RequestProfile()
+        advertised = False
+
+        async def send_with_id(message: Message):
+            nonlocal advertised
+            # Only requests that ran a profiled function have a profile to serve, e.g.
+            # not /report-summary or a cache hit
+            if message["type"] == "http.response.start" and request_profile.calls:
+                advertised = True
+                message = dict(message)
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-watney-profile-id", request_profile.profile_id.encode()),
+                ]
+            await send(message)
+
+        token = current_profile.set(request_profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            current_profile.reset(token)
+            if advertised:
+                store_profile(request_profile)
+
+
+__all__ = [
+    "caller",
+    "log_slow_queries",
+    "profiled",
+    "is_authorized",
+    "profile_path",
+    "profile_report",
+    "ProfilingMiddleware",
+]
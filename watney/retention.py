@@ -0,0 +1,149 @@
+"""
+Retention of old report data.
+
+The policy is configured in Settings: keep the newest retention_keep_reports reports,
+keep the reports newer than retention_max_age_days, and with retention_keep_weekly the
+newest report of every week that has no report kept by the other rules. Reports kept by
+none of the enabled rules are deleted one at a time with delete_report_data, in batches
+of retention_batch_size rows, so ingestion carries on while a large history is pruned.
+
+Run it with `watney prune`, or in the background of the API with retention_interval.
+Every worker of the API starts the background task, and the one holding the retention
+lease, see watney.db.leases, is the one that prunes.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+from uuid import UUID, uuid4
+
+from sqlmodel import Session, desc, select
+
+from watney.cache import invalidate_cache
+from watney.db.leases import release_lease, take_lease
+from watney.db.models import BrokenLinkReportData
+from watney.db.session import get_session
+from watney.helpers import delete_report_data
+from watney.settings import settings
+
+logger = logging.getLogger(__name__)
+
+RETENTION_LEASE = "retention"
+
+
+class RetentionPolicy(NamedTuple):
+    keep_reports: int = 0
+    max_age: Optional[timedelta] = None
+    keep_weekly: bool = False
+
+    @classmethod
+    def from_settings(cls) -> "RetentionPolicy":
+        return cls(
+            keep_reports=settings.retention_keep_reports,
+            max_age=timedelta(days=settings.retention_max_age_days)
+            if settings.retention_max_age_days
+            else None,
+            keep_weekly=settings.retention_keep_weekly,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.keep_reports or self.max_age or self.keep_weekly)
+
+
+def expired_reports(
+    session: Session, policy: RetentionPolicy, now: Optional[datetime] = None
+) -> List[UUID]:
+    """
+    The reports the policy does not keep, oldest first
+    :param session:
+    :param policy:
+    :param now: defaults to the current time, in UTC like the report dates
+    :return:
+    """
+    if not policy.enabled:
+        return []
+    now = now or datetime.utcnow()
+    query = select(BrokenLinkReportData.report_id, BrokenLinkReportData.date).order_by(
+        desc(BrokenLinkReportData.date)
+    )
+    expired = []
+    # The weeks that already have a kept report. Reports come newest first, so the ones
+    # kept by the count and age rules mark their weeks before the weekly rule applies.
+    weeks = set()
+    for position, (report_id, report_date) in enumerate(session.exec(query)):
+        week = report_date.isocalendar()[:2]
+        kept = position < policy.keep_reports or (
+            policy.max_age is not None and report_date > now - policy.max_age
+        )
+        if kept or (policy.keep_weekly and week not in weeks):
+            weeks.add(week)
+            continue
+        expired.append(report_id)
+    expired.reverse()
+    return expired
+
+
+def prune_reports(
+    session: Session,
+    policy: RetentionPolicy,
+    now: Optional[datetime] = None,
+    batch_size: Optional[int] = None,
+) -> List[UUID]:
+    """
+    Delete the reports the policy does not keep, oldest first
+    :param session:
+    :param policy:
+    :param now:
+    :param batch_size: rows per DELETE, defaults to settings.retention_batch_size
+    :return: the deleted reports
+    """
+    report_ids = expired_reports(session, policy, now)
+    for report_id in report_ids:
+        delete_report_data(session, report_id, batch_size)
+    return report_ids
+
+
+async def run_retention(interval: float):
+    """
+    Apply the retention policy of the settings every interval seconds, while holding
+    the retention lease. The lease lasts two intervals and is renewed before each
+    report is deleted, so another process takes over once this one stops. The deletes
+    run in a worker thread, off the event loop.
+    :param interval:
+    :return:
+    """
+    holder = uuid4().hex
+    duration = timedelta(seconds=2 * interval)
+
+    def prune() -> List[UUID]:
+        deleted = []
+        with get_session() as session:
+            if not take_lease(session, RETENTION_LEASE, holder, duration):
+                return deleted
+            for report_id in expired_reports(session, RetentionPolicy.from_settings()):
+                if not take_lease(session, RETENTION_LEASE, holder, duration):
+                    break
+                delete_report_data(session, report_id)
+                deleted.append(report_id)
+        return deleted
+
+    def release():
+        with get_session() as session:
+            release_lease(session, RETENTION_LEASE, holder)
+
+    try:
+        while True:
+            try:
+                report_ids = await asyncio.to_thread(prune)
+                if report_ids:
+                    logger.info("Deleted %d expired reports", len(report_ids))
+                    await invalidate_cache()
+            except Exception:
+                logger.exception("Applying the retention policy failed")
+            await asyncio.sleep(interval)
+    finally:
+        await asyncio.to_thread(release)
+
+
+__all__ = ["RetentionPolicy", "expired_reports", "prune_reports", "run_retention"]
@@ -0,0 +1,311 @@
+"""
+Pre-aggregated statistics of the stored reports.
+
+update_rollups runs when a report is stored and aggregates its rows once: the number of
+broken links per repo and status code (RepoStatusCountData) and per url
+(UrlCountData). Time to fix is tracked incrementally as well: OpenLinkData holds the
+links of the latest report with the date they first appeared, and every new report
+records in FixTimeData how many of them it fixed and for how long they had been broken,
+to the millisecond on SQLite. The /stats endpoints only read these tables, never the links of the reports.
+
+Rollups are kept by the ingestion paths of every storage layout, they aggregate the links
+of a report as read through watney.layouts.storage_layout. rebuild_rollups recomputes
+them from scratch, see `watney rollup`.
+"""
+from datetime import datetime
+from itertools import groupby
+from typing import List, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, delete, exists, func, insert, literal
+from sqlalchemy.sql import ColumnElement
+from sqlmodel import Session, desc, select
+
+from watney.db.models import (
+    BrokenLinkReportData,
+    FixTimeData,
+    OpenLinkData,
+    RepoStatusCountData,
+    UrlCountData,
+)
+from watney.layouts import storage_layout
+from watney.schema import (
+    RepoTrend,
+    StatusCodeCount,
+    TimeToFixResponse,
+    TrendPoint,
+    UrlCount,
+)
+
+ROLLUP_MODELS = (RepoStatusCountData, UrlCountData, FixTimeData, OpenLinkData)
+
+
+def seconds_between(
+    session: Session, later: ColumnElement, earlier: ColumnElement
+) -> ColumnElement:
+    """
+    The number of seconds between two datetimes, in SQL
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        # julianday counts days with millisecond precision
+        return (func.julianday(later) - func.julianday(earlier)) * 86400
+    return func.extract("epoch", later - earlier)
+
+
+def update_rollups(
+    session: Session,
+    report_id: UUID,
+    report_date: datetime,
+    track_fixes: Optional[bool] = None,
+):
+    """
+    Aggregate the rows of a newly stored report. The caller is responsible for
+    committing.
+    :param session:
+    :param report_id:
+    :param report_date:
+    :param track_fixes: whether the report is the latest one, and so fixes links of
+        OpenLinkData, looked up by default. Reports stored out of order are left out of
+        the time to fix.
+    :return:
+    """
+    if track_fixes is None:
+        track_fixes = is_latest_report(session, report_date)
+    links = storage_layout().links_query(report_id).subquery()
+    id_type = RepoStatusCountData.__table__.c.report_id.type
+    date_type = RepoStatusCountData.__table__.c.report_date.type
+    session.execute(
+        insert(RepoStatusCountData).from_select(
+            [
+                "report_id",
+                "repo_name",
+                "repo_url",
+                "status_code",
+                "count",
+                "report_date",
+            ],
+            select(
+                literal(report_id, id_type),
+                links.c.repo_name,
+                links.c.repo_url,
+                links.c.status_code,
+                func.count(),
+                literal(report_date, date_type),
+            ).group_by(links.c.repo_name, links.c.repo_url, links.c.status_code),
+        )
+    )
+    session.execute(
+        insert(UrlCountData).from_select(
+            ["report_id", "url", "count"],
+            select(literal(report_id, id_type), links.c.url, func.count()).group_by(
+                links.c.url
+            ),
+        )
+    )
+    if not track_fixes:
+        return
+
+    in_report = exists().where(
+        links.c.repo_name == OpenLinkData.repo_name,
+        links.c.repo_url == OpenLinkData.repo_url,
+        links.c.file == OpenLinkData.file,
+    )
+    broken_for = seconds_between(
+        session, literal(report_date, date_type), OpenLinkData.first_seen_date
+    )
+    session.execute(
+        insert(FixTimeData).from_select(
+            ["report_id", "fixed_links", "fix_seconds"],
+            select(
+                literal(report_id, id_type),
+                func.count(),
+                func.coalesce(func.sum(broken_for), 0),
+            ).where(~in_report),
+        )
+    )
+    session.execute(
+        delete(OpenLinkData)
+        .where(~in_report)
+        .execution_options(synchronize_session=False)
+    )
+    is_open = exists().where(
+        OpenLinkData.repo_name == links.c.repo_name,
+        OpenLinkData.repo_url == links.c.repo_url,
+        OpenLinkData.file == links.c.file,
+    )
+    session.execute(
+        insert(OpenLinkData).from_select(
+            ["repo_name", "repo_url", "file", "first_seen_date"],
+            select(
+                links.c.repo_name,
+                links.c.repo_url,
+                links.c.file,
+                literal(report_date, date_type),
+            ).where(~is_open),
+        )
+    )
+
+
+def is_latest_report(session: Session, report_date: datetime) -> bool:
+    query = (
+        select(BrokenLinkReportData.report_id)
+        .where(BrokenLinkReportData.date > report_date)
+        .limit(1)
+    )
+    return session.exec(query).first() is None
+
+
+def delete_rollups(session: Session, report_id: Optional[UUID] = None):
+    """
+    Delete the rollups of a report, or all of them
+    :param session:
+    :param report_id:
+    :return:
+    """
+    for model in ROLLUP_MODELS:
+        statement = delete(model)
+        if report_id is not None:
+            if model is OpenLinkData:
+                continue
+            statement = statement.where(model.report_id == report_id)
+        session.execute(statement)
+
+
+def rebuild_rollups(session: Session) -> int:
+    """
+    Recompute every rollup, replaying the reports in date order and committing after
+    each report
+    :param session:
+    :return: the number of reports
+    """
+    delete_rollups(session)
+    query = select(BrokenLinkReportData.report_id, BrokenLinkReportData.date).order_by(
+        BrokenLinkReportData.date
+    )
+    reports = session.exec(query).fetchall()
+    for report_id, report_date in reports:
+        update_rollups(session, report_id, report_date, track_fixes=True)
+        session.commit()
+    return len(reports)
+
+
+def repo_trends(
+    session: Session,
+    repo_name: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List[RepoTrend]:
+    """
+    The number of broken links per repo in each report
+    :param session:
+    :param repo_name: only this repo
+    :param since: only reports from this date on
+    :param until: only reports up to this date
+    :return:
+    """
+    counts = RepoStatusCountData
+    key = (counts.repo_name, counts.repo_url, counts.report_date, counts.report_id)
+    query = (
+        select(*key, func.sum(counts.count).label("count"))
+        .group_by(*key)
+        .order_by(*key)
+    )
+    if repo_name is not None:
+        query = query.where(counts.repo_name == repo_name)
+    if since is not None:
+        query = query.where(counts.report_date >= since)
+    if until is not None:
+        query = query.where(counts.report_date <= until)
+    return [
+        RepoTrend(
+            repo_name=repo_name,
+            repo_url=repo_url,
+            counts=[
+                TrendPoint(
+                    report_id=row.report_id,
+                    report_date=row.report_date,
+                    count=row.count,
+                )
+                for row in rows
+            ],
+        )
+        for (repo_name, repo_url), rows in groupby(
+            session.exec(query), key=lambda row: (row.repo_name, row.repo_url)
+        )
+    ]
+
+
+def top_urls(session: Session, report_id: UUID, limit: int = 10) -> List[UrlCount]:
+    """
+    The broken urls linked from the most files in a report
+    :param session:
+    :param report_id:
+    :param limit:
+    :return:
+    """
+    query = (
+        select(UrlCountData.url, UrlCountData.count)
+        .where(UrlCountData.report_id == report_id)
+        .order_by(desc(UrlCountData.count), UrlCountData.url)
+        .limit(limit)
+    )
+    return [UrlCount(url=url, count=count) for url, count in session.exec(query)]
+
+
+def status_code_counts(session: Session, report_id: UUID) -> List[StatusCodeCount]:
+    """
+    The number of broken links per status code in a report
+    :param session:
+    :param report_id:
+    :return:
+    """
+    query = (
+        select(RepoStatusCountData.status_code, func.sum(RepoStatusCountData.count))
+        .where(RepoStatusCountData.report_id == report_id)
+        .group_by(RepoStatusCountData.status_code)
+        .order_by(RepoStatusCountData.status_code)
+    )
+    return [
+        StatusCodeCount(status_code=status_code, count=count)
+        for status_code, count in session.exec(query)
+    ]
+
+
+def time_to_fix(
+    session: Session, since: Optional[datetime] = None, until: Optional[datetime] = None
+) -> TimeToFixResponse:
+    """
+    The mean time links stayed broken, over the links fixed by the reports in a date
+    range
+    :param session:
+    :param since:
+    :param until:
+    :return:
+    """
+    reports = BrokenLinkReportData
+    conditions = []
+    if since is not None:
+        conditions.append(reports.date >= since)
+    if until is not None:
+        conditions.append(reports.date <= until)
+    query = select(
+        func.coalesce(func.sum(FixTimeData.fixed_links), 0),
+        func.sum(FixTimeData.fix_seconds),
+    ).join(reports, and_(reports.report_id == FixTimeData.report_id, *conditions))
+    fixed_links, fix_seconds = session.exec(query).one()
+    return TimeToFixResponse(
+        fixed_links=fixed_links,
+        mean_time_to_fix=fix_seconds / fixed_links if fixed_links else None,
+    )
+
+
+__all__ = [
+    "update_rollups",
+    "is_latest_report",
+    "delete_rollups",
+    "rebuild_rollups",
+    "repo_trends",
+    "top_urls",
+    "status_code_counts",
+    "time_to_fix",
+]
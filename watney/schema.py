@@ -35,6 +35,23 @@ class BrokenLinkReport(BaseModel):
     report_id: Optional[UUID]
 
 
+class ReportHeader(BaseModel):
+    """
+    The first line of a newline-delimited JSON report
+    """
+
+    report_date: datetime
+
+
+class BrokenLinkRecord(BrokenLink):
+    """
+    A single broken link line of a newline-delimited JSON report
+    """
+
+    repo_name: str
+    repo_url: str
+
+
 class BrokenLinksResponse(BaseModel):
     """
     A report that includes data about newly-broken links, links that were already known to be
@@ -54,3 +71,59 @@ class ReportSummary(BaseModel):
 
 class ReportList(BaseModel):
     reports: List[ReportSummary]
+    next_cursor: Optional[datetime]
+    next_cursor_id: Optional[UUID]
+
+
+class TrendPoint(BaseModel):
+    report_id: UUID
+    report_date: datetime
+    count: int
+
+
+class RepoTrend(BaseModel):
+    """
+    The number of broken links in a repo in each report that has any
+    """
+
+    repo_name: str
+    repo_url: str
+    counts: List[TrendPoint]
+
+
+class RepoTrendResponse(BaseModel):
+    repos: List[RepoTrend]
+
+
+class UrlCount(BaseModel):
+    url: str
+    count: int
+
+
+class TopUrlsResponse(BaseModel):
+    """
+    The broken urls linked from the most files in a report
+    """
+
+    report_id: UUID
+    urls: List[UrlCount]
+
+
+class StatusCodeCount(BaseModel):
+    status_code: int
+    count: int
+
+
+class StatusCodeResponse(BaseModel):
+    report_id: UUID
+    status_codes: List[StatusCodeCount]
+
+
+class TimeToFixResponse(BaseModel):
+    """
+    The links fixed in a range of reports, and the mean number of seconds they stayed
+    broken
+    """
+
+    fixed_links: int
+    mean_time_to_fix: Optional[float]
@@ -4,6 +4,65 @@ from pydantic import BaseSettings
 class Settings(BaseSettings):
     database_url: str = "sqlite:///database.db"
     database_echo: bool = False
+    # Connection pool, see sqlalchemy.pool.QueuePool
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_recycle: int = -1
+    database_pool_timeout: float = 30
+    # How the broken links of the reports are stored, see watney.layouts: "flat",
+    # "normalized" or "history". Change it on an existing database with
+    # `watney convert-layout`.
+    storage_layout: str = "flat"
+    # Write report rows with chunked executemany INSERTs instead of ORM objects
+    bulk_ingest: bool = True
+    ingest_chunk_size: int = 5000
+    # Default and maximum number of reports per page of /report-summary
+    report_list_page_size: int = 100
+    report_list_max_page_size: int = 1000
+    # Rows fetched per round trip when streaming exports
+    export_batch_size: int = 1000
+    # Compute report diffs with set-based queries in the database instead of in Python
+    diff_in_database: bool = True
+    # Render JSON responses with orjson, and report responses straight from the rows
+    fast_json: bool = False
+    # Cache of rendered responses: "none", "memory" (per process) or "redis" (shared)
+    cache_backend: str = "none"
+    cache_max_entries: int = 1000
+    cache_ttl: float = 300
+    cache_redis_url: str = "redis://localhost:6379/0"
+    # Seconds to wait for Redis to connect or answer before a lookup counts as a miss
+    cache_redis_timeout: float = 0.5
+    # Store the diff between consecutive reports when a report is ingested
+    materialize_diffs: bool = True
+    # Aggregate the statistics served by /stats when a report is ingested
+    maintain_rollups: bool = True
+    # Retention policy, see watney.retention. Reports kept by none of the enabled rules
+    # are deleted, nothing is deleted while no rule is enabled.
+    # Keep the newest N reports, 0 disables the rule
+    retention_keep_reports: int = 0
+    # Keep the reports newer than this many days, 0 disables the rule
+    retention_max_age_days: float = 0
+    # Keep the newest report of every week beyond the other rules
+    retention_keep_weekly: bool = False
+    # Rows deleted per statement and transaction while pruning
+    retention_batch_size: int = 5000
+    # Seconds between runs of the retention policy in the background, 0 disables it.
+    # Of the API workers, only the one holding the retention lease prunes.
+    retention_interval: float = 0
+    # Expose Prometheus metrics at /metrics, requires watney[metrics]
+    metrics: bool = False
+    # Log statements slower than this many seconds to the watney.slow_queries logger,
+    # 0 disables the log
+    slow_query_threshold: float = 0
+    # Profile the requests that send this token in the X-Watney-Profile header or the
+    # profile query parameter, see watney.profiling. Empty disables profiling.
+    profile_token: str = ""
+    # Where request profiles are stored, defaults to a directory in the temp directory
+    profile_dir: str = ""
+    # Migrate the schema once per deploy with `watney migrate`, the API and the
+    # maintenance commands only check that it is current when they start. Turn this on to
+    # have them apply missing migrations themselves, for a single process deployment.
+    auto_migrate: bool = False
 
 
 settings = Settings()
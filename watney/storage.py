@@ -0,0 +1,185 @@
+"""
+Storage layouts of the broken links of reports.
+
+A layout decides how the links of a report are stored. The reports themselves are
+always BrokenLinkReportData rows, and the data derived from them, the materialized diffs
+and the rollups, is stored the same way whatever the layout. settings.storage_layout
+selects the layout every read and write goes through, see watney.layouts. A layout
+provides:
+
+- the query of the links of a report, with the columns of LinkRow
+- the query of each class of links of the diff between two reports
+- a LinkWriter, which stores the links of a new report one chunk at a time, and the
+  check of whether a new report can be stored at all
+- the tables it owns, emptied when its links are converted to another layout
+
+The flat layout stores every link of every report as a BrokenLinkFileData row.
+"""
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+from uuid import UUID
+
+from sqlalchemy import insert
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+
+from watney.db.models import BrokenLinkFileData
+from watney.diff import diff_queries, link_columns
+from watney.settings import settings
+
+
+def chunks(values: Iterable, size: int) -> Iterator[list]:
+    """
+    Split values into lists of at most size values
+    """
+    values = iter(values)
+    while chunk := list(islice(values, size)):
+        yield chunk
+
+
+class LinkWriter:
+    """
+    Stores the links of a new report, see StorageLayout.writer. start is called once
+    before the first chunk and finish once after the last one. The writes join the
+    session's transaction, committing is up to the caller.
+    """
+
+    def __init__(self, report_id: UUID, report_date: datetime):
+        self.report_id = report_id
+        self.report_date = report_date
+
+    def start(self, session: Session):
+        pass
+
+    def write(self, session: Session, rows: List[dict]) -> int:
+        """
+        Store a chunk of links
+        :param session:
+        :param rows: BrokenLinkFileData column values, see watney.helpers.link_rows
+        :return: the number of links stored
+        """
+        raise NotImplementedError
+
+    def finish(self, session: Session):
+        pass
+
+
+class StorageLayout:
+    # The value of settings.storage_layout
+    name: str
+    # The tables holding the links, emptied in this order by watney.layouts.convert_layout.
+    # The first one has a row per stored link.
+    models: tuple
+
+    def links_query(self, report_id: UUID) -> Select:
+        """
+        The links of a report, with the columns of LinkRow
+        """
+        raise NotImplementedError
+
+    def ordered_links_query(self, report_id: UUID) -> Select:
+        """
+        The links of a report ordered by repo and file, as reports are rendered
+        """
+        query = self.links_query(report_id)
+        columns = query.selected_columns
+        return query.order_by(columns.repo_name, columns.repo_url, columns.file)
+
+    def diff_queries(self, prev_id: UUID, new_id: UUID) -> Dict[str, Select]:
+        """
+        The set-based query for each class of links between two reports, keyed by the
+        ReportDiff field name
+        """
+        raise NotImplementedError
+
+    def writer(self, report_id: UUID, report_date: datetime) -> LinkWriter:
+        raise NotImplementedError
+
+    def check_new_report(self, session: Session, report_date: datetime):
+        """
+        Raise if a report with the given date cannot be stored, checked before the
+        report is inserted
+        """
+
+    def write_links(
+        self,
+        session: Session,
+        report_id: UUID,
+        report_date: datetime,
+        rows: Iterable[dict],
+    ) -> int:
+        """
+        Store all the links of a new report, settings.ingest_chunk_size at a time
+        :param session:
+        :param report_id:
+        :param report_date:
+        :param rows: BrokenLinkFileData column values, see watney.helpers.link_rows
+        :return: the number of links stored
+        """
+        writer = self.writer(report_id, report_date)
+        writer.start(session)
+        count = 0
+        for chunk in chunks(rows, settings.ingest_chunk_size):
+            count += writer.write(session, chunk)
+        writer.finish(session)
+        return count
+
+
+def insert_broken_links(
+    session: Session, rows: Iterable[dict], chunk_size: Optional[int] = None
+) -> int:
+    """
+    Insert BrokenLinkFileData rows with core-level executemany INSERTs of at most chunk_size
+    rows each. The inserts join the session's transaction, committing is up to the caller.
+    :param session:
+    :param rows: column values, see watney.helpers.link_rows
+    :param chunk_size: defaults to settings.ingest_chunk_size
+    :return: the number of rows inserted
+    """
+    chunk_size = chunk_size or settings.ingest_chunk_size
+    statement = insert(BrokenLinkFileData)
+    count = 0
+    for chunk in chunks(rows, chunk_size):
+        session.execute(statement, chunk)
+        count += len(chunk)
+    return count
+
+
+class FlatWriter(LinkWriter):
+    def write(self, session: Session, rows: List[dict]) -> int:
+        """
+        With settings.bulk_ingest the links bypass the ORM unit of work and are written
+        with an executemany INSERT, otherwise as BrokenLinkFileData objects
+        """
+        if settings.bulk_ingest:
+            return insert_broken_links(session, rows)
+        session.add_all([BrokenLinkFileData(**row) for row in rows])
+        session.flush()
+        return len(rows)
+
+
+class FlatLayout(StorageLayout):
+    name = "flat"
+    models = (BrokenLinkFileData,)
+
+    def links_query(self, report_id: UUID) -> Select:
+        return link_columns(
+            select(BrokenLinkFileData).where(BrokenLinkFileData.report_id == report_id)
+        )
+
+    def diff_queries(self, prev_id: UUID, new_id: UUID) -> Dict[str, Select]:
+        return diff_queries(prev_id, new_id)
+
+    def writer(self, report_id: UUID, report_date: datetime) -> LinkWriter:
+        return FlatWriter(report_id, report_date)
+
+
+__all__ = [
+    "chunks",
+    "LinkWriter",
+    "StorageLayout",
+    "insert_broken_links",
+    "FlatWriter",
+    "FlatLayout",
+]
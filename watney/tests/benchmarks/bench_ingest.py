@@ -0,0 +1,80 @@
+"""
+Compare report ingestion throughput of the ORM path and the bulk INSERT path of persist.
+
+    python -m watney.tests.benchmarks.bench_ingest --links 50000
+    python -m watney.tests.benchmarks.bench_ingest --database-url postgresql://...
+
+Without --database-url each run writes to a fresh SQLite database in a temporary directory.
+"""
+import argparse
+import datetime
+import tempfile
+import time
+
+from sqlmodel import Session
+
+from watney.db.models import create_tables
+from watney.db.session import get_engine
+from watney.helpers import clear_db, persist
+from watney.schema import BrokenLink, BrokenLinkRepo, BrokenLinkReport
+from watney.settings import settings
+
+
+def make_report(num_links: int, links_per_repo: int = 100) -> BrokenLinkReport:
+    num_repos = max(1, num_links // links_per_repo)
+    return BrokenLinkReport(
+        report_date=datetime.datetime.utcnow(),
+        report=[
+            BrokenLinkRepo(
+                repo_name=f"repo-{i}",
+                repo_url=f"https://github.com/org/repo-{i}",
+                broken_links=[
+                    BrokenLink(
+                        file=f"docs/section-{j % 10}/page-{j}.md",
+                        url=f"https://example.com/{i}/{j}",
+                        status_code=404,
+                    )
+                    for j in range(0, links_per_repo)
+                ],
+            )
+            for i in range(0, num_repos)
+        ],
+    )
+
+
+def time_persist(
+    database_url: str, report: BrokenLinkReport, bulk_ingest: bool, chunk_size: int
+) -> float:
+    """
+    Persist the report once and return the elapsed seconds
+    """
+    settings.bulk_ingest = bulk_ingest
+    settings.ingest_chunk_size = chunk_size
+    engine = get_engine(database_url)
+    create_tables(engine)
+    with Session(engine) as session:
+        clear_db(session)
+        start = time.perf_counter()
+        persist(session, report)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url")
+    parser.add_argument("--links", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=settings.ingest_chunk_size)
+    args = parser.parse_args()
+
+    report = make_report(args.links)
+    num_rows = sum(len(repo.broken_links) for repo in report.report)
+    print(f"{'path':>6} {'rows':>8} {'seconds':>8} {'rows/s':>10}")
+    for name, bulk_ingest in (("orm", False), ("bulk", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = args.database_url or f"sqlite:///{tmp}/bench.db"
+            elapsed = time_persist(database_url, report, bulk_ingest, args.chunk_size)
+        print(f"{name:>6} {num_rows:>8} {elapsed:>8.2f} {num_rows / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare the latency of rendering GET /report/{report_id} responses: pydantic models
+through jsonable_encoder (the default), the same models through orjson, and orjson
+straight from the rows (settings.fast_json).
+
+    python -m watney.tests.benchmarks.bench_serialization --links 1000 10000 100000
+
+Each size is stored in a fresh SQLite database in a temporary directory.
+"""
+import argparse
+import tempfile
+import time
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlmodel import Session
+
+from watney.db.models import create_tables
+from watney.db.session import get_engine
+from watney.fastjson import dumps, render_report
+from watney.helpers import get_report_by_id, persist, report_rows
+from watney.settings import settings
+from watney.tests.benchmarks.bench_ingest import make_report
+
+PATHS = {
+    "pydantic": lambda session, report_id: JSONResponse(
+        jsonable_encoder(get_report_by_id(session, report_id))
+    ).body,
+    "orjson": lambda session, report_id: dumps(get_report_by_id(session, report_id)),
+    "rows+orjson": lambda session, report_id: render_report(
+        report_id, *report_rows(session, report_id)
+    ),
+}
+
+
+def best_time(render: Callable[[], bytes], repeat: int) -> float:
+    """
+    The fastest of repeat runs, in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--links", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    settings.materialize_diffs = False
+    settings.maintain_rollups = False
+    print(f"{'links':>8} " + " ".join(f"{name + ' ms':>14}" for name in PATHS))
+    for num_links in args.links:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = get_engine(f"sqlite:///{tmp}/bench.db")
+            create_tables(engine)
+            with Session(engine) as session:
+                report_id = persist(session, make_report(num_links))
+                timings = [
+                    best_time(lambda: render(session, report_id), args.repeat)
+                    for render in PATHS.values()
+                ]
+            engine.dispose()
+        print(f"{num_links:>8} " + " ".join(f"{t * 1000:>14.1f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Cold start benchmark: the time a fresh interpreter takes to import the app.
+
+    python -m watney.tests.benchmarks.bench_startup
+    python -m watney.tests.benchmarks.bench_startup --module watney.main watney.cli \
+        --output startup.json
+    python -m watney.tests.benchmarks.bench_startup --baseline startup.json
+
+Every sample is a new Python process, so nothing is cached in sys.modules: the import of
+each module is timed inside the process, and the whole process, interpreter startup
+included, from outside. An empty interpreter is timed the same way for reference. The
+processes get a database URL in a temporary directory, and the benchmark fails if an
+import creates it: importing the app must not touch the database.
+
+One more process per module runs under -X importtime, and the top-level packages with
+the most import time are listed, to tell which dependency a regression comes from. With
+--baseline, the median of every measurement is compared to an earlier run and the exit
+status is 1 if any of them got slower by more than --tolerance.
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+# Prints the seconds spent importing a module
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def summarize(operation: str, samples: List[float]) -> dict:
+    return dict(
+        operation=operation,
+        samples=len(samples),
+        min_seconds=min(samples),
+        median_seconds=statistics.median(samples),
+        mean_seconds=statistics.fmean(samples),
+    )
+
+
+def run_python(code: str, env: Dict[str, str], *options: str) -> tuple:
+    """
+    Run code in a new interpreter
+    :return: the wall clock seconds of the process, its stdout and its stderr
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, *options, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, process.stdout, process.stderr
+
+
+def import_profile(stderr: str) -> Dict[str, float]:
+    """
+    The seconds spent importing each top-level package, from -X importtime output
+    """
+    packages = collections.Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return dict(packages)
+
+
+def run(modules: List[str], repeat: int, top: int) -> List[dict]:
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "startup.db")
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}")
+        results = [
+            summarize(
+                "process python",
+                [run_python("pass", env)[0] for _ in range(repeat)],
+            )
+        ]
+        for module in modules:
+            code = IMPORT_SCRIPT.format(module=module)
+            process_samples, import_samples = [], []
+            for _ in range(repeat):
+                elapsed, stdout, _ = run_python(code, env)
+                process_samples.append(elapsed)
+                import_samples.append(float(stdout))
+            results.append(summarize(f"import {module}", import_samples))
+            results.append(summarize(f"process {module}", process_samples))
+
+            _, _, stderr = run_python(code, env, "-X", "importtime")
+            packages = sorted(import_profile(stderr).items(), key=lambda item: -item[1])
+            print(f"heaviest imports of {module}:")
+            for package, seconds in packages[:top]:
+                print(f"  {package:<30} {seconds * 1000:>8.1f} ms")
+
+            if os.path.exists(database):
+                raise RuntimeError(f"Importing {module} touched the database")
+    return results
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """
+    The measurements whose median got slower than in the baseline by more than
+    tolerance
+    """
+    baseline = {result["operation"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = baseline.get(result["operation"])
+        if before is None:
+            continue
+        ratio = result["median_seconds"] / before["median_seconds"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{result['operation']}: {ratio:.2f}x slower")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--module", nargs="+", default=["watney.main", "watney.cli"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="packages listed")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.module, args.repeat, args.top)
+    print(f"{'operation':<40} {'min ms':>10} {'median ms':>10}")
+    for r in results:
+        print(
+            f"{r['operation']:<40} {r['min_seconds'] * 1000:>10.1f} "
+            f"{r['median_seconds'] * 1000:>10.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                dict(
+                    created=datetime.datetime.utcnow().isoformat(),
+                    python=platform.python_version(),
+                    results=results,
+                ),
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Compare the flat, the normalized and the link history storage layouts: database size
+after storing a series of reports, and the time to diff the last two of them.
+
+    python -m watney.tests.benchmarks.bench_storage --links 20000 --reports 10 --churn 0.05
+
+Each layout is selected with settings.storage_layout and written through persist to a
+fresh SQLite database in a temporary directory, the size is measured after a VACUUM.
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from watney.db.models import create_tables
+from watney.db.session import get_engine
+from watney.helpers import persist, query_report_diff
+from watney.layouts import LAYOUTS
+from watney.schema import BrokenLink, BrokenLinkRepo, BrokenLinkReport
+from watney.settings import settings
+
+
+def make_reports(
+    num_links: int, num_reports: int, churn: float, links_per_repo: int = 100
+) -> List[BrokenLinkReport]:
+    """
+    A series of daily reports, each replacing a churn fraction of the links of the one
+    before it
+    """
+    rng = random.Random(0)
+    num_repos = max(1, num_links // links_per_repo)
+    links = [(i % num_repos, i) for i in range(num_links)]
+    next_link = num_links
+    start = datetime.datetime(2023, 1, 1)
+    reports = []
+    for day in range(num_reports):
+        for position in rng.sample(range(num_links), int(num_links * churn)):
+            links[position] = (links[position][0], next_link)
+            next_link += 1
+        reports.append(
+            BrokenLinkReport(
+                report_date=start + datetime.timedelta(days=day),
+                report=[
+                    BrokenLinkRepo(
+                        repo_name=f"repo-{i}",
+                        repo_url=f"https://github.com/org/repo-{i}",
+                        broken_links=[
+                            BrokenLink(
+                                file=f"docs/section-{j % 10}/page-{j}.md",
+                                url=f"https://example.com/{i}/{j}",
+                                status_code=404,
+                            )
+                            for repo, j in links
+                            if repo == i
+                        ],
+                    )
+                    for i in range(num_repos)
+                ],
+            )
+        )
+    return reports
+
+
+def measure(
+    database_url: str,
+    reports: List[BrokenLinkReport],
+    repeat: int,
+) -> dict:
+    engine = get_engine(database_url)
+    create_tables(engine)
+    with Session(engine) as session:
+        start = time.perf_counter()
+        report_ids = [persist(session, report) for report in reports]
+        store_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            query_report_diff(session, report_ids[-2], report_ids[-1])
+        diff_seconds = (time.perf_counter() - start) / repeat
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+    engine.dispose()
+    return dict(
+        store_seconds=store_seconds,
+        diff_seconds=diff_seconds,
+        size=os.path.getsize(database_url.removeprefix("sqlite:///")),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--links", type=int, default=20000)
+    parser.add_argument("--reports", type=int, default=10)
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Compare the storage alone, without the diffs materialized by persist
+    settings.materialize_diffs = False
+    reports = make_reports(args.links, max(2, args.reports), args.churn)
+    print(f"{'layout':>10} {'size MiB':>9} {'store s':>8} {'diff ms':>8}")
+    for name in LAYOUTS:
+        settings.storage_layout = name
+        with tempfile.TemporaryDirectory() as tmp:
+            result = measure(f"sqlite:///{tmp}/bench.db", reports, args.repeat)
+        print(
+            f"{name:>10} {result['size'] / 2**20:>9.1f} "
+            f"{result['store_seconds']:>8.2f} {result['diff_seconds'] * 1000:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
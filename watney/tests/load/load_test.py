@@ -0,0 +1,57 @@
+"""
+Measure request throughput against a running watney server as the number of concurrent
+clients grows. Seed some report data first, then run e.g.
+
+    python -m watney.tests.load.load_test --url http://localhost:8000 --path /report-summary
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def run_client(url: str, requests_per_client: int) -> int:
+    failures = 0
+    with requests.Session() as client:
+        for i in range(0, requests_per_client):
+            response = client.get(url)
+            if response.status_code != 200:
+                failures += 1
+    return failures
+
+
+def measure(url: str, clients: int, requests_per_client: int) -> float:
+    """
+    Run the clients concurrently and return the achieved requests per second
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        failures = sum(
+            executor.map(run_client, [url] * clients, [requests_per_client] * clients)
+        )
+    elapsed = time.perf_counter() - start
+    if failures:
+        raise RuntimeError(f"{failures} requests failed against {url}")
+    return clients * requests_per_client / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/report-summary")
+    parser.add_argument("--clients", default="1,2,4,8,16")
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    args = parser.parse_args()
+
+    url = f"{args.url}{args.path}"
+    baseline = None
+    print(f"{'clients':>8} {'req/s':>10} {'speedup':>8}")
+    for clients in [int(x) for x in args.clients.split(",")]:
+        throughput = measure(url, clients, args.requests)
+        baseline = baseline or throughput
+        print(f"{clients:>8} {throughput:>10.1f} {throughput / baseline:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
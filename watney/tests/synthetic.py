@@ -0,0 +1,411 @@
+"""
+Deterministic synthetic report data for tests, benchmarks and load tests.
+
+Names are built from small vocabularies, precomputed once per seed, and indexed by the
+position of each repo and link, so generating a link costs a few string formats and no
+random draw or Faker call. The same arguments always give the same data.
+
+Seed a database, e.g. for a load test, with
+
+    python -m watney.tests.synthetic --reports 100 --repos 100 --links-per-repo 100
+
+The first report is inserted with chunked executemany INSERTs, every following one is a
+clone of the one before it with a --churn fraction of its links moved, see
+clone_report. Both write BrokenLinkFileData rows directly, so they require
+settings.storage_layout to be the flat layout, see watney.storage, and raise
+StorageLayoutError otherwise.
+"""
+import argparse
+import asyncio
+import datetime
+import random
+import uuid
+from typing import Iterator, List, Sequence, Tuple
+
+from sqlalchemy import case, func, insert, literal
+from sqlmodel import Session, select
+
+from watney.cache import invalidate_cache
+from watney.db.migrations import migrate
+from watney.db.models import BrokenLinkFileData, BrokenLinkReportData
+from watney.db.session import get_engine_from_settings
+from watney.errors import StorageLayoutError
+from watney.helpers import derive_report_data
+from watney.schema import BrokenLink, BrokenLinkRepo, BrokenLinkReport
+from watney.settings import settings
+from watney.storage import insert_broken_links
+
+# fmt: off
+WORDS = (
+    "alpha", "api", "atlas", "beacon", "cache", "cargo", "cloud", "comet", "console",
+    "core", "delta", "docs", "engine", "falcon", "flow", "gateway", "guide", "harbor",
+    "insights", "kernel", "ledger", "lumen", "metrics", "nebula", "nova", "operator",
+    "orbit", "pipeline", "platform", "portal", "quartz", "relay", "runtime", "sdk",
+    "signal", "sprout", "stack", "storage", "summit", "tools", "vector", "widget",
+)
+# fmt: on
+ORGS = ("acme", "initech", "globex", "umbrella", "hooli", "vandelay")
+DOMAINS = (
+    "example.com",
+    "docs.example.org",
+    "blog.example.net",
+    "api.example.io",
+    "status.example.dev",
+)
+EXTENSIONS = ("md", "md", "rst", "adoc", "html")
+STATUS_CODES = (404, 404, 404, 410, 403, 500, 502, 503)
+
+# Directories per vocabulary, and how many links of a report share a url on average
+NUM_DIRECTORIES = 256
+LINKS_PER_URL = 4
+
+# Links moved by clone_report(mutate=...): the rows at positions p with
+# (p * CLONE_SPREAD + offset) % CLONE_PERIOD below mutate * CLONE_PERIOD, where the offset
+# depends on the seed. Exactly a mutate fraction of every CLONE_PERIOD consecutive rows.
+CLONE_SPREAD = 7919
+CLONE_PERIOD = 1000
+
+# repo_name, repo_url, file, url, status_code
+LinkValues = Tuple[str, str, str, str, int]
+
+
+class Vocabulary:
+    """
+    The names synthetic data is built from, shuffled by the seed
+    """
+
+    def __init__(self, seed: int = 0, status_codes: Sequence[int] = STATUS_CODES):
+        rng = random.Random(seed)
+        self.status_codes = status_codes
+        words = list(WORDS)
+        rng.shuffle(words)
+        self.words = words
+        self.directories = [
+            f"{rng.choice(WORDS)}/{rng.choice(WORDS)}" for _ in range(NUM_DIRECTORIES)
+        ]
+        self.offset = rng.randrange(1 << 16)
+
+    def repo(self, i: int) -> Tuple[str, str]:
+        words = self.words
+        name = f"{words[i % len(words)]}-{words[(i // len(words)) % len(words)]}-{i}"
+        return name, f"https://github.com/{ORGS[i % len(ORGS)]}/{name}"
+
+    def link(self, j: int, num_urls: int) -> Tuple[str, str, int]:
+        """
+        The file, url and status code of link j, out of num_urls distinct urls
+        """
+        offset = self.offset
+        directory = self.directories[(j + offset) % NUM_DIRECTORIES]
+        k = (j * 7919 + offset) % num_urls
+        domain, word = DOMAINS[k % len(DOMAINS)], self.words[k % len(self.words)]
+        return (
+            f"{directory}/page-{j}.{EXTENSIONS[j % len(EXTENSIONS)]}",
+            f"https://{domain}/{word}/{k}",
+            self.status_codes[(j + offset) % len(self.status_codes)],
+        )
+
+
+def report_links(
+    num_repos: int,
+    links_per_repo: int,
+    seed: int = 0,
+    status_codes: Sequence[int] = STATUS_CODES,
+) -> Iterator[LinkValues]:
+    """
+    The links of a synthetic report, ordered by repo
+    :param num_repos:
+    :param links_per_repo:
+    :param seed:
+    :param status_codes: the status codes to cycle through
+    :return:
+    """
+    vocabulary = Vocabulary(seed, status_codes)
+    num_urls = max(1, num_repos * links_per_repo // LINKS_PER_URL)
+    for i in range(num_repos):
+        repo_name, repo_url = vocabulary.repo(i)
+        for j in range(i * links_per_repo, (i + 1) * links_per_repo):
+            yield (repo_name, repo_url, *vocabulary.link(j, num_urls))
+
+
+def make_report(
+    report_date: datetime.datetime, num_repos: int, links_per_repo: int, seed: int = 0
+) -> BrokenLinkReport:
+    """
+    A synthetic report, with the models built without validation
+    :param report_date:
+    :param num_repos:
+    :param links_per_repo:
+    :param seed:
+    :return:
+    """
+    return next(
+        report_series(
+            num_repos * links_per_repo, 1, 0, links_per_repo, seed, report_date
+        )
+    )
+
+
+def report_series(
+    num_links: int,
+    num_reports: int,
+    churn: float,
+    links_per_repo: int = 100,
+    seed: int = 0,
+    start: datetime.datetime = datetime.datetime(2023, 1, 1),
+) -> Iterator[BrokenLinkReport]:
+    """
+    A series of daily reports of num_links links each, every report replacing a churn
+    fraction of the links of the one before it. Reports are generated one at a time, in
+    time linear in num_links.
+    :param num_links:
+    :param num_reports:
+    :param churn: fraction of the links replaced between consecutive reports
+    :param links_per_repo:
+    :param seed:
+    :param start: date of the first report
+    :return:
+    """
+    rng = random.Random(seed)
+    vocabulary = Vocabulary(seed)
+    num_repos = -(-num_links // links_per_repo)
+    num_urls = max(1, num_links // LINKS_PER_URL)
+    links = list(range(num_links))
+    next_link = num_links
+    for day in range(num_reports):
+        if day:
+            for position in rng.sample(range(num_links), int(num_links * churn)):
+                links[position] = next_link
+                next_link += 1
+        repos = []
+        for i in range(num_repos):
+            repo_name, repo_url = vocabulary.repo(i)
+            broken_links = [
+                BrokenLink.construct(file=file, url=url, status_code=status_code)
+                for file, url, status_code in (
+                    vocabulary.link(j, num_urls)
+                    for j in links[i * links_per_repo : (i + 1) * links_per_repo]
+                )
+            ]
+            repos.append(
+                BrokenLinkRepo.construct(
+                    repo_name=repo_name, repo_url=repo_url, broken_links=broken_links
+                )
+            )
+        yield BrokenLinkReport.construct(
+            report_date=start + datetime.timedelta(days=day),
+            report_id=None,
+            report=repos,
+        )
+
+
+def check_flat_layout():
+    """
+    Raise unless the links are stored in the flat layout, which the synthetic reports
+    are written in
+    """
+    if settings.storage_layout != "flat":
+        raise StorageLayoutError(
+            f"Synthetic reports are written in the flat layout, not in the "
+            f"{settings.storage_layout} layout of the settings"
+        )
+
+
+def clone_report(
+    session: Session,
+    existing_report: uuid.UUID,
+    report_id: uuid.UUID,
+    timestamp: str,
+    add_new_links=False,
+    num_new_links=1,
+    mutate: float = 0.0,
+    seed: int = 0,
+):
+    """
+    Copy a report to a new report with INSERT ... SELECT statements, without loading its
+    rows into Python.
+    :param session:
+    :param existing_report:
+    :param report_id: id of the copy
+    :param timestamp: date of the copy, in ISO format
+    :param add_new_links: add num_new_links links to the copy, or with a negative
+        num_new_links leave that many links out
+    :param num_new_links:
+    :param mutate: fraction of the links moved to another file in the copy, so they are
+        fixed in one report and new in the other
+    :param seed: picks the moved links, the same seed moves the same links
+    :return:
+    """
+    check_flat_layout()
+    valid_timestamp = datetime.datetime.fromisoformat(timestamp)
+    session.execute(
+        insert(BrokenLinkReportData).values(report_id=report_id, date=valid_timestamp)
+    )
+    links = BrokenLinkFileData
+    key = (links.repo_name, links.repo_url, links.file)
+    id_type = BrokenLinkReportData.__table__.c.report_id.type
+    columns = ["report_id", "repo_name", "repo_url", "file", "url", "status_code"]
+    tag = str(report_id)[:8]
+
+    source = (
+        select(
+            links.repo_name,
+            links.repo_url,
+            links.file,
+            links.url,
+            links.status_code,
+            func.row_number().over(order_by=key).label("position"),
+            func.count().over().label("total"),
+        )
+        .where(links.report_id == existing_report)
+        .subquery()
+    )
+    file = source.c.file
+    if mutate:
+        offset = seed * CLONE_SPREAD**2 % CLONE_PERIOD
+        moved = (source.c.position * CLONE_SPREAD + offset) % CLONE_PERIOD < round(
+            mutate * CLONE_PERIOD
+        )
+        file = case((moved, source.c.file + f"~{tag}"), else_=source.c.file)
+    copy = select(
+        literal(report_id, id_type),
+        source.c.repo_name,
+        source.c.repo_url,
+        file,
+        source.c.url,
+        source.c.status_code,
+    )
+    if add_new_links and num_new_links < 0:
+        copy = copy.where(source.c.position <= source.c.total + num_new_links)
+    session.execute(insert(links).from_select(columns, copy))
+
+    if add_new_links and num_new_links > 0:
+        new_links = (
+            select(
+                literal(report_id, id_type),
+                links.repo_name,
+                links.repo_url,
+                links.file + f"+{tag}",
+                links.url,
+                links.status_code,
+            )
+            .where(links.report_id == existing_report)
+            .order_by(*key)
+            .limit(num_new_links)
+        )
+        session.execute(insert(links).from_select(columns, new_links))
+    derive_report_data(session, report_id, valid_timestamp)
+    session.commit()
+
+
+def insert_report(
+    session: Session,
+    report_id: uuid.UUID,
+    report_date: datetime.datetime,
+    num_repos: int,
+    links_per_repo: int,
+    seed: int = 0,
+    derive: bool = False,
+    status_codes: Sequence[int] = STATUS_CODES,
+):
+    """
+    Insert a synthetic report with chunked executemany INSERTs and commit
+    :param session:
+    :param report_id:
+    :param report_date:
+    :param num_repos:
+    :param links_per_repo:
+    :param seed:
+    :param derive: also compute the diffs and rollups of the report, see
+        watney.helpers.derive_report_data
+    :param status_codes: the status codes to cycle through
+    :return:
+    """
+    check_flat_layout()
+    session.execute(
+        insert(BrokenLinkReportData).values(report_id=report_id, date=report_date)
+    )
+    insert_broken_links(
+        session,
+        (
+            dict(
+                report_id=report_id,
+                repo_name=repo_name,
+                repo_url=repo_url,
+                file=file,
+                url=url,
+                status_code=status_code,
+            )
+            for repo_name, repo_url, file, url, status_code in report_links(
+                num_repos, links_per_repo, seed, status_codes
+            )
+        ),
+    )
+    if derive:
+        derive_report_data(session, report_id, report_date)
+    session.commit()
+
+
+def seed_reports(
+    session: Session,
+    num_reports: int,
+    num_repos: int,
+    links_per_repo: int,
+    churn: float = 0.05,
+    seed: int = 0,
+    start: datetime.datetime = datetime.datetime(2023, 1, 1),
+) -> List[uuid.UUID]:
+    """
+    Store a series of daily synthetic reports, each a clone of the one before it with a
+    churn fraction of its links moved
+    :param session:
+    :param num_reports:
+    :param num_repos:
+    :param links_per_repo:
+    :param churn:
+    :param seed:
+    :param start: date of the first report
+    :return: the ids of the reports, oldest first
+    """
+    report_ids = [uuid.uuid4()]
+    insert_report(session, report_ids[0], start, num_repos, links_per_repo, seed, True)
+    for day in range(1, num_reports):
+        report_ids.append(uuid.uuid4())
+        clone_report(
+            session,
+            report_ids[-2],
+            report_ids[-1],
+            (start + datetime.timedelta(days=day)).isoformat(),
+            mutate=churn,
+            seed=seed + day,
+        )
+    return report_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--reports", type=int, default=100)
+    parser.add_argument("--repos", type=int, default=100)
+    parser.add_argument("--links-per-repo", type=int, default=100)
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine = get_engine_from_settings()
+    migrate(engine)
+    with Session(engine) as session:
+        report_ids = seed_reports(
+            session,
+            args.reports,
+            args.repos,
+            args.links_per_repo,
+            args.churn,
+            args.seed,
+        )
+    asyncio.run(invalidate_cache())
+    print(f"Stored {len(report_ids)} reports, the latest is {report_ids[-1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
+import csv
 import datetime
+import json
+import uuid
 from uuid import UUID
 
 import pytest
 import requests
+from sqlmodel import select
 
-from watney.helpers import clone_report
+from watney.db.models import ReportDiffData
+from watney.tests.synthetic import clone_report
 from watney.tests.test_fixtures import (
     empty_db,
     fake_report,
@@ -12,6 +17,11 @@ from watney.tests.test_fixtures import (
     new_report_empty,
     MAX_BROKEN_LINKS,
     MAX_REPOS,
+    FAKE_EMPTY_REPORT_DATE,
+    FAKE_REPORT_DATE,
+    FAKE_REPORT_UUID,
+    make_report,
+    session,
 )
 from faker import Faker
 
@@ -22,6 +32,9 @@ TEST_HOST = "localhost:8000"
 URL_ANCHOR = f"{TEST_PROTO}://{TEST_HOST}"
 REPORT_URL = f"{URL_ANCHOR}/report"
 BROKEN_LINKS_URL = f"{URL_ANCHOR}/broken-links"
+REPORT_STREAM_URL = f"{URL_ANCHOR}/report-stream"
+REPORT_SUMMARY_URL = f"{URL_ANCHOR}/report-summary"
+STATS_URL = f"{URL_ANCHOR}/stats"
 
 
 def create_broken_links(url: str) -> list:
@@ -88,6 +101,47 @@ def test_report():
     assert response.json()["report_date"] == test_report_data["report_date"]
 
 
+def test_report_stream(empty_db):
+    """
+    Post a report as newline-delimited JSON, one repo per line
+    :return:
+    """
+    test_report_data = report_data()
+
+    def lines():
+        yield json.dumps({"report_date": test_report_data["report_date"]}) + "\n"
+        for repo in test_report_data["report"]:
+            yield json.dumps(repo) + "\n"
+
+    headers = {"Content-type": "application/x-ndjson"}
+    response = requests.post(REPORT_STREAM_URL, headers=headers, data=lines())
+    assert response.status_code == 201, str(response.content)
+    report_id = response.json()["report_id"]
+
+    # The duplicate date check applies to streamed reports too
+    response = requests.post(REPORT_STREAM_URL, headers=headers, data=lines())
+    assert response.status_code == 409
+
+    response = requests.get(f"{REPORT_URL}/{report_id}")
+    assert response.status_code == 200
+    assert len(response.json()["report"]) == MAX_REPOS
+
+
+def test_post_bad_report_stream(empty_db):
+    response = requests.post(REPORT_STREAM_URL, data='{"report_date": "2023"}\n{}')
+    assert response.status_code == 422
+
+    link = json.dumps(
+        dict(
+            repo_name="r", repo_url="u", file="a.md", url="https://a.b", status_code=404
+        )
+    )
+    body = "\n".join(['{"report_date": "2023-05-01T00:00:00"}', link, link])
+    response = requests.post(REPORT_STREAM_URL, data=body)
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("line 3")
+
+
 def test_post_bad_report():
     """
     Post an invalid report, confirm a 400
@@ -127,7 +181,7 @@ def test_broken_links_no_new_data(new_report_empty):
     assert not response.json()["new_broken_links"]
 
 
-def test_newly_broken_links(fake_report):
+def test_newly_broken_links(fake_report, session):
     """
     Submit two reports where the broken links are the same.
     On the second report everything should be considered "existing".
@@ -138,7 +192,7 @@ def test_newly_broken_links(fake_report):
 
     new_uuid = uuid.uuid4()
     new_ts = "2023-03-14T14:15:34.726727"
-    clone_report(fake_report, new_uuid, new_ts)
+    clone_report(session, fake_report, new_uuid, new_ts)
 
     response = requests.get(f"{REPORT_URL}/{new_uuid}")
     assert response.status_code == 200, str(response.content)
@@ -152,14 +206,14 @@ def test_newly_broken_links(fake_report):
     # Third report, add 1 broken link
     third_uuid = uuid.uuid4()
     third_date = "2023-04-15T14:15:34.726727"
-    clone_report(fake_report, third_uuid, third_date, add_new_links=True)
+    clone_report(session, fake_report, third_uuid, third_date, add_new_links=True)
     response = requests.get(BROKEN_LINKS_URL)
     assert response.status_code == 200, str(response.content)
     assert len(response.json()["existing_broken_links"]) == MAX_BROKEN_LINKS * MAX_REPOS
     assert len(response.json()["new_broken_links"]) == 1
 
 
-def test_newly_fixed_links(fake_report):
+def test_newly_fixed_links(fake_report, session):
     """
     In this scenario, no new links have been broken, but some have been fixed.
     :return:
@@ -168,7 +222,12 @@ def test_newly_fixed_links(fake_report):
 
     new_date = "2023-04-15T14:15:34.726727"
     clone_report(
-        fake_report, uuid.uuid4(), new_date, add_new_links=True, num_new_links=-1
+        session,
+        fake_report,
+        uuid.uuid4(),
+        new_date,
+        add_new_links=True,
+        num_new_links=-1,
     )
     response = requests.get(BROKEN_LINKS_URL)
     assert response.status_code == 200, str(response.content)
@@ -200,3 +259,205 @@ def test_broken_links_all_new_broken(two_reports_one_empty):
     assert response.status_code == 200
     assert len(response.json()["existing_broken_links"]) == 0
     assert len(response.json()["new_broken_links"]) == MAX_BROKEN_LINKS * MAX_REPOS
+
+
+def read_csv(response) -> list:
+    return list(csv.reader(response.text.splitlines(), delimiter=" ", quotechar="|"))
+
+
+def test_get_report_csv(fake_report):
+    response = requests.get(f"{REPORT_URL}/{fake_report}", params={"csv": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = read_csv(response)
+    assert rows[0] == ["repo name", "repo url", "file path", "full url", "status code"]
+    assert len(rows) == MAX_BROKEN_LINKS * MAX_REPOS + 1
+    assert all(row[4] == "404" for row in rows[1:])
+
+    import uuid
+
+    response = requests.get(f"{REPORT_URL}/{uuid.uuid4()}", params={"csv": True})
+    assert response.status_code == 404
+
+
+def test_broken_links_csv(fake_report, session):
+    import uuid
+
+    clone_report(
+        session,
+        fake_report,
+        uuid.uuid4(),
+        "2023-04-15T14:15:34.726727",
+        add_new_links=True,
+        num_new_links=2,
+    )
+    response = requests.get(BROKEN_LINKS_URL, params={"csv": True})
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == "attachment; filename=export.csv"
+    rows = read_csv(response)
+    assert rows[0] == ["file path", "full url", "status code", "new or existing"]
+    labels = [row[3] for row in rows[1:]]
+    assert labels.count("existing/known") == MAX_BROKEN_LINKS * MAX_REPOS
+    assert labels.count("new") == 2
+
+
+def test_report_summary_pages(two_reports_one_empty):
+    response = requests.get(REPORT_SUMMARY_URL, params={"limit": 1})
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page["reports"]) == 1
+    assert page["reports"][0]["report_date"] == FAKE_REPORT_DATE.isoformat()
+
+    response = requests.get(
+        REPORT_SUMMARY_URL,
+        params={
+            "limit": 1,
+            "before": page["next_cursor"],
+            "before_id": page["next_cursor_id"],
+        },
+    )
+    page = response.json()
+    assert page["reports"][0]["report_date"] == FAKE_EMPTY_REPORT_DATE.isoformat()
+
+    response = requests.get(REPORT_SUMMARY_URL, params={"limit": 0})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "path", ["/report/{report_id}", "/report-summary", "/broken-links"]
+)
+def test_etag_not_modified(two_reports_one_empty, path):
+    url = URL_ANCHOR + path.format(report_id=two_reports_one_empty[1])
+    response = requests.get(url)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = requests.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert not response.content
+
+    response = requests.get(url, headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+
+def test_broken_links_last_report(two_reports_one_empty):
+    response = requests.get(BROKEN_LINKS_URL)
+    assert response.json()["last_report_id"] == str(two_reports_one_empty[1])
+    assert response.json()["last_report_date"] == FAKE_REPORT_DATE.isoformat()
+
+
+def test_stats(empty_db):
+    response = requests.get(f"{STATS_URL}/top-urls")
+    assert response.status_code == 409
+
+    report_ids = []
+    for day in (1, 2):
+        report = make_report(f"2023-05-0{day}T00:00:00", 2, day + 1)
+        response = requests.post(REPORT_URL, data=report.json())
+        report_ids.append(response.json()["report_id"])
+
+    response = requests.get(f"{STATS_URL}/repos", params={"repo_name": "repo-0"})
+    assert response.status_code == 200
+    (trend,) = response.json()["repos"]
+    assert [point["count"] for point in trend["counts"]] == [2, 3]
+    assert [point["report_id"] for point in trend["counts"]] == report_ids
+
+    response = requests.get(f"{STATS_URL}/top-urls", params={"limit": 1})
+    assert response.json() == {
+        "report_id": report_ids[1],
+        "urls": [{"url": "https://a.b/0", "count": 2}],
+    }
+
+    response = requests.get(
+        f"{STATS_URL}/status-codes", params={"report_id": report_ids[0]}
+    )
+    assert response.json()["status_codes"] == [{"status_code": 404, "count": 4}]
+    response = requests.get(f"{STATS_URL}/status-codes", params={"report_id": "x"})
+    assert response.status_code == 400
+
+    response = requests.get(f"{STATS_URL}/time-to-fix")
+    assert response.json() == {"fixed_links": 0, "mean_time_to_fix": None}
+
+
+def test_diff(empty_db, session):
+    report_ids = []
+    for day, num_links in ((1, 2), (2, 3), (3, 1)):
+        report = make_report(f"2023-05-0{day}T00:00:00", 2, num_links)
+        response = requests.post(REPORT_URL, data=report.json())
+        report_ids.append(response.json()["report_id"])
+
+    params = {"from": report_ids[1], "to": report_ids[2]}
+    response = requests.get(f"{URL_ANCHOR}/diff", params=params)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    links = [json.loads(line) for line in response.text.splitlines()]
+    assert [link["state"] for link in links] == ["existing"] * 2 + ["fixed"] * 4
+    assert links[0] == {
+        "repo_name": links[0]["repo_name"],
+        "repo_url": links[0]["repo_url"],
+        "file": "docs/0.md",
+        "url": "https://a.b/0",
+        "status_code": 404,
+        "state": "existing",
+    }
+
+    params = {"from": report_ids[0], "to": report_ids[1], "repo": "repo-1"}
+    response = requests.get(f"{URL_ANCHOR}/diff", params=params)
+    links = [json.loads(line) for line in response.text.splitlines()]
+    assert {link["repo_name"] for link in links} == {"repo-1"}
+    assert [link["state"] for link in links] == ["new", "existing", "existing"]
+
+    params.update(state="new", format="csv")
+    response = requests.get(f"{URL_ANCHOR}/diff", params=params)
+    assert response.headers["content-type"].startswith("text/csv")
+    assert read_csv(response) == [
+        [
+            "repo name",
+            "repo url",
+            "file path",
+            "full url",
+            "status code",
+            "new, existing or fixed",
+        ],
+        [
+            "repo-1",
+            "https://github.com/repo-1",
+            "docs/2.md",
+            "https://a.b/2",
+            "404",
+            "new",
+        ],
+    ]
+
+    params = {"from": report_ids[0], "to": report_ids[1], "status": 500}
+    assert requests.get(f"{URL_ANCHOR}/diff", params=params).text == ""
+
+    # Reports that are not consecutive are compared live, without storing their diff
+    params = {"from": report_ids[0], "to": report_ids[2]}
+    response = requests.get(f"{URL_ANCHOR}/diff", params=params)
+    links = [json.loads(line) for line in response.text.splitlines()]
+    assert [link["state"] for link in links] == ["existing"] * 2 + ["fixed"] * 2
+    query = select(ReportDiffData.prev_report_id, ReportDiffData.new_report_id)
+    assert len(session.exec(query).fetchall()) == 2
+
+
+@pytest.mark.parametrize(
+    "params, status_code",
+    [
+        ({"from": "x", "to": "y"}, 400),
+        ({"from": str(FAKE_REPORT_UUID), "to": str(uuid.uuid4())}, 404),
+        (
+            {
+                "from": str(FAKE_REPORT_UUID),
+                "to": str(FAKE_REPORT_UUID),
+                "state": "gone",
+            },
+            422,
+        ),
+        ({"from": str(FAKE_REPORT_UUID)}, 422),
+    ],
+)
+def test_diff_bad_request(fake_report, params, status_code):
+    response = requests.get(f"{URL_ANCHOR}/diff", params=params)
+    assert response.status_code == status_code
@@ -0,0 +1,111 @@
+import asyncio
+import datetime
+import threading
+import uuid
+
+from watney import async_helpers, fastjson, helpers
+from watney.db.session import get_async_engine_from_settings, get_async_session
+from watney.helpers import get_report_by_id, get_report_list
+from watney.schema import BrokenLink, BrokenLinkRepo, BrokenLinkReport
+from watney.tests.synthetic import clone_report
+from watney.tests.test_fixtures import (
+    fake_report,
+    MAX_BROKEN_LINKS,
+    MAX_REPOS,
+    session,
+)
+
+
+def run(coroutine_function, *args):
+    """
+    Run a helper coroutine with a fresh async session on its own event loop
+    """
+
+    async def with_session():
+        try:
+            async with get_async_session() as async_session:
+                return await coroutine_function(async_session, *args)
+        finally:
+            # Pooled connections belong to the event loop that created them
+            await get_async_engine_from_settings().dispose()
+
+    return asyncio.run(with_session())
+
+
+def test_async_persist(fake_report, session):
+    report_id = run(
+        async_helpers.persist,
+        BrokenLinkReport(
+            report_date=datetime.datetime.fromisoformat("2023-05-01T00:00:00"),
+            report=[
+                BrokenLinkRepo(
+                    repo_name="watney",
+                    repo_url="https://github.com/watney",
+                    broken_links=[
+                        BrokenLink(file="README.md", url="https://a.b", status_code=404)
+                    ],
+                )
+            ],
+        ),
+    )
+    report = get_report_by_id(session, report_id)
+    assert report.report[0].broken_links[0].file == "README.md"
+
+
+def test_async_get_report_by_id(fake_report, session):
+    assert run(async_helpers.get_report_by_id, fake_report) == get_report_by_id(
+        session, fake_report
+    )
+    assert run(async_helpers.get_report_by_id, uuid.uuid4()) is None
+
+
+def test_async_report_models_are_built_off_the_event_loop(
+    fake_report, session, monkeypatch
+):
+    threads = []
+
+    def recording(function):
+        def wrapper(*args):
+            threads.append(threading.get_ident())
+            return function(*args)
+
+        return wrapper
+
+    monkeypatch.setattr(helpers, "build_report", recording(helpers.build_report))
+    monkeypatch.setattr(helpers, "report_rows", recording(helpers.report_rows))
+    monkeypatch.setattr(helpers, "broken_links", recording(helpers.broken_links))
+    monkeypatch.setattr(fastjson, "render_report", recording(fastjson.render_report))
+
+    async def both(session):
+        loop_thread = threading.get_ident()
+        await async_helpers.get_report_by_id(session, fake_report)
+        await async_helpers.report_json(session, fake_report)
+        await async_helpers.get_report_diff(session, None, fake_report)
+        return loop_thread
+
+    loop_thread = run(both)
+    fetch, build, fetch_json, render, *diff = threads
+    assert fetch == fetch_json == loop_thread
+    assert loop_thread not in (build, render, *diff)
+
+
+def test_async_get_report_list(fake_report, session):
+    assert run(async_helpers.get_report_list) == get_report_list(session)
+
+
+def test_async_get_report_diff(fake_report, session):
+    new_uuid = uuid.uuid4()
+    clone_report(
+        session,
+        fake_report,
+        new_uuid,
+        "2023-04-15T14:15:34.726727",
+        add_new_links=True,
+        num_new_links=2,
+    )
+    assert run(async_helpers.get_last_two_reports) == (fake_report, new_uuid)
+    existing_broken, newly_broken = run(
+        async_helpers.get_report_diff, fake_report, new_uuid
+    )
+    assert len(existing_broken) == MAX_BROKEN_LINKS * MAX_REPOS
+    assert len(newly_broken) == 2
@@ -0,0 +1,226 @@
+import asyncio
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from watney import cache as cache_module
+from watney.cache import (
+    CacheBackend,
+    LRUCache,
+    RedisCache,
+    cached_response,
+    create_cache_backend,
+    invalidate_cache,
+)
+from watney.main import app
+from watney.tests.test_fixtures import empty_db, make_report
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    cache = LRUCache(max_entries=10, ttl=60)
+    monkeypatch.setattr(cache_module, "get_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def redis_server():
+    fakeredis = pytest.importorskip("fakeredis")
+    # fakeredis runs the Lua scripts of RedisCache with lupa
+    pytest.importorskip("lupa")
+    return fakeredis.FakeServer()
+
+
+def redis_cache_on(server) -> RedisCache:
+    import fakeredis
+
+    return RedisCache(fakeredis.FakeAsyncRedis(server=server), ttl=60)
+
+
+@pytest.fixture
+def redis_cache(redis_server):
+    return redis_cache_on(redis_server)
+
+
+def get(cache, key):
+    value, generation = asyncio.run(cache.get(key))
+    return value
+
+
+def set_(cache, key, value, generation=0):
+    asyncio.run(cache.set(key, value, generation))
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, ttl=60)
+    set_(cache, "a", 1)
+    set_(cache, "b", 2)
+    assert get(cache, "a") == 1
+    set_(cache, "c", 3)
+    assert get(cache, "b") is None
+    assert get(cache, "a") == 1
+    assert get(cache, "c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_expires_entries():
+    clock = FakeClock()
+    cache = LRUCache(max_entries=2, ttl=60, clock=clock)
+    set_(cache, "a", 1)
+    clock.now = 59
+    assert get(cache, "a") == 1
+    clock.now = 60
+    assert get(cache, "a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(max_entries=0, ttl=60)
+    set_(cache, "a", 1)
+    assert get(cache, "a") is None
+
+
+def test_lru_cache_drops_values_loaded_before_clear():
+    cache = LRUCache(max_entries=10, ttl=60)
+    value, epoch = asyncio.run(cache.get("a"))
+    asyncio.run(cache.clear())
+    set_(cache, "a", b"stale", epoch)
+    assert get(cache, "a") is None
+    set_(cache, "a", b"fresh", epoch + 1)
+    assert get(cache, "a") == b"fresh"
+
+
+def test_cache_counts_hits_and_misses():
+    cache = LRUCache(max_entries=10, ttl=60)
+    assert get(cache, "a") is None
+    set_(cache, "a", b"1")
+    assert get(cache, "a") == b"1"
+    assert get(cache, "a") == b"1"
+    assert cache.stats() == dict(backend="memory", hits=2, misses=1, hit_ratio=2 / 3)
+
+
+def test_redis_cache(redis_cache, redis_server):
+    import fakeredis
+
+    assert get(redis_cache, "a") is None
+    set_(redis_cache, "a", b"1")
+    assert get(redis_cache, "a") == b"1"
+    assert fakeredis.FakeRedis(server=redis_server).ttl("watney:0:a") == 60
+    assert (redis_cache.hits, redis_cache.misses) == (1, 1)
+
+
+def test_redis_cache_is_shared(redis_cache, redis_server):
+    other_worker = redis_cache_on(redis_server)
+    set_(redis_cache, "a", b"1")
+    assert get(other_worker, "a") == b"1"
+    asyncio.run(other_worker.clear())
+    assert get(redis_cache, "a") is None
+
+
+def test_redis_cache_drops_values_loaded_before_clear(redis_cache):
+    set_(redis_cache, "a", b"1")
+    asyncio.run(redis_cache.clear())
+    value, generation = asyncio.run(redis_cache.get("a"))
+    assert (value, generation) == (None, 1)
+    # Another worker stores what it loaded, then the cache is cleared again
+    asyncio.run(redis_cache.clear())
+    set_(redis_cache, "a", b"stale", generation)
+    assert get(redis_cache, "a") is None
+    set_(redis_cache, "a", b"fresh", 2)
+    assert get(redis_cache, "a") == b"fresh"
+
+
+def test_redis_outage_is_a_miss(redis_cache, redis_server):
+    set_(redis_cache, "a", b"1")
+    redis_server.connected = False
+    assert get(redis_cache, "a") is None
+    set_(redis_cache, "b", b"2")
+    asyncio.run(redis_cache.clear())
+    assert redis_cache.misses == 1
+
+    redis_server.connected = True
+    assert get(redis_cache, "a") == b"1"
+    assert get(redis_cache, "b") is None
+
+
+def test_create_cache_backend():
+    assert type(create_cache_backend("none", 10, 60, "")) is CacheBackend
+    assert isinstance(create_cache_backend("memory", 10, 60, ""), LRUCache)
+    with pytest.raises(ValueError):
+        create_cache_backend("memcached", 10, 60, "")
+
+
+def test_create_redis_cache_backend():
+    pytest.importorskip("redis")
+    cache = create_cache_backend("redis", 10, 60, "redis://localhost:6379/0", 0.5)
+    connection = cache.client.connection_pool.connection_kwargs
+    assert connection["socket_timeout"] == 0.5
+    assert connection["socket_connect_timeout"] == 0.5
+
+
+def test_stored_reports_invalidate_cache(empty_db, memory_cache):
+    client = TestClient(app)
+    set_(memory_cache, "key", b"stale")
+    report = make_report("2023-05-01T00:00:00", 1, 1)
+    response = client.post("/report", content=report.json())
+    assert response.status_code == 201
+    assert get(memory_cache, "key") is None
+
+    value, epoch = asyncio.run(memory_cache.get("key"))
+    set_(memory_cache, "key", b"stale", epoch)
+    response = client.post("/report", content=report.json())
+    assert response.status_code == 409
+    assert get(memory_cache, "key") == b"stale"
+
+
+@pytest.mark.parametrize("backend", ["memory_cache", "redis_cache"])
+def test_cached_response(backend, request, monkeypatch):
+    cache = request.getfixturevalue(backend)
+    monkeypatch.setattr(cache_module, "get_cache", lambda: cache)
+    asyncio.run(invalidate_cache())
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return {"reports": []}
+
+    def get(headers=()):
+        request = Request({"type": "http", "headers": list(headers)})
+        return asyncio.run(cached_response(request, ("test",), load))
+
+    response = get()
+    assert response.body == b'{"reports":[]}'
+    etag = response.headers["etag"]
+    assert get().headers["etag"] == etag
+    assert get([(b"if-none-match", etag.encode())]).status_code == 304
+    assert len(loads) == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+@pytest.mark.parametrize("backend", ["memory_cache", "redis_cache"])
+def test_cached_response_invalidated_while_loading(backend, request, monkeypatch):
+    cache = request.getfixturevalue(backend)
+    monkeypatch.setattr(cache_module, "get_cache", lambda: cache)
+    contents = iter([{"reports": []}, {"reports": ["new"]}])
+
+    async def load():
+        content = next(contents)
+        # A report is stored while the response is loaded
+        await invalidate_cache()
+        return content
+
+    def get():
+        request = Request({"type": "http", "headers": []})
+        return asyncio.run(cached_response(request, ("test",), load))
+
+    assert get().body == b'{"reports":[]}'
+    assert get().body == b'{"reports":["new"]}'
@@ -0,0 +1,263 @@
+import copy
+import uuid
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import select
+
+from watney.cli import main
+from watney.db.models import BrokenLinkFileData, ReportDiffData
+from watney.diff import (
+    LinkRow,
+    diff_links,
+    existing_links_query,
+    fixed_links_query,
+    link_key,
+    new_links_query,
+)
+from watney.helpers import (
+    broken_links_from_report,
+    delete_report_data,
+    delete_report_diffs,
+    get_report_diff,
+    persist,
+    query_report_diff,
+)
+from watney.settings import settings
+from watney.tests.synthetic import clone_report
+from watney.tests.test_fixtures import (
+    empty_db,
+    fake_report,
+    make_report,
+    MAX_BROKEN_LINKS,
+    MAX_REPOS,
+    session,
+)
+
+
+def materialized_diffs(session) -> list:
+    return session.exec(
+        select(ReportDiffData.prev_report_id, ReportDiffData.new_report_id)
+    ).fetchall()
+
+
+def make_row(report_id, repo_name, file, url="https://example.com", status_code=404):
+    return BrokenLinkFileData(
+        report_id=report_id,
+        repo_name=repo_name,
+        repo_url=f"https://github.com/{repo_name}",
+        file=file,
+        url=url,
+        status_code=status_code,
+    )
+
+
+def nested_loop_diff(prev_rows, new_rows):
+    """
+    The original quadratic implementation of get_report_diff, kept as a reference
+    """
+    existing_broken = []
+    for prev_row in prev_rows:
+        for new_row in new_rows:
+            if (
+                prev_row.file == new_row.file
+                and prev_row.repo_name == new_row.repo_name
+                and prev_row.repo_url == new_row.repo_url
+            ):
+                existing_broken.append(new_row)
+                break
+    newly_broken = copy.deepcopy(new_rows)
+    for row in existing_broken:
+        try:
+            newly_broken.remove(row)
+        except ValueError:
+            pass
+    return existing_broken, newly_broken
+
+
+def keys(rows):
+    return sorted(link_key(row) for row in rows)
+
+
+def test_diff_links_classification():
+    prev_id, new_id = uuid.uuid4(), uuid.uuid4()
+    prev_rows = [
+        make_row(prev_id, "alpha", "docs/a.md"),
+        make_row(prev_id, "alpha", "docs/b.md"),
+        make_row(prev_id, "beta", "README.md"),
+    ]
+    new_rows = [
+        make_row(new_id, "alpha", "docs/a.md", status_code=500),
+        make_row(new_id, "beta", "README.md"),
+        make_row(new_id, "beta", "docs/new.md"),
+    ]
+    result = diff_links(prev_rows, new_rows)
+    assert keys(result.existing) == keys(new_rows[:2])
+    assert keys(result.new) == keys(new_rows[2:])
+    assert keys(result.fixed) == keys(prev_rows[1:2])
+    # Existing links are reported with the data from the new report
+    assert result.existing[0] is new_rows[0]
+
+
+def test_diff_links_matches_on_repo_url():
+    prev_id, new_id = uuid.uuid4(), uuid.uuid4()
+    prev_row = make_row(prev_id, "alpha", "docs/a.md")
+    new_row = make_row(new_id, "alpha", "docs/a.md")
+    new_row.repo_url = "https://gitlab.com/alpha"
+    result = diff_links([prev_row], [new_row])
+    assert result.new == [new_row]
+    assert result.existing == []
+    assert result.fixed == [prev_row]
+
+
+def test_diff_links_empty_reports():
+    row = make_row(uuid.uuid4(), "alpha", "docs/a.md")
+    assert diff_links([], []) == ([], [], [])
+    assert diff_links([], [row]).new == [row]
+    assert diff_links([row], []).fixed == [row]
+
+
+def test_diff_links_matches_nested_loop(fake_report, session):
+    new_uuid = uuid.uuid4()
+    clone_report(
+        session,
+        fake_report,
+        new_uuid,
+        "2023-04-15T14:15:34.726727",
+        add_new_links=True,
+        num_new_links=3,
+    )
+    prev_rows = broken_links_from_report(session, fake_report)
+    new_rows = broken_links_from_report(session, new_uuid)
+
+    result = diff_links(prev_rows, new_rows)
+    existing_broken, newly_broken = nested_loop_diff(prev_rows, new_rows)
+    assert keys(result.existing) == keys(existing_broken)
+    assert keys(result.new) == keys(newly_broken)
+    assert len(result.existing) == MAX_BROKEN_LINKS * MAX_REPOS
+    assert len(result.new) == 3
+    assert result.fixed == []
+
+
+def test_get_report_diff_fixed_links(fake_report, session):
+    new_uuid = uuid.uuid4()
+    clone_report(
+        session,
+        fake_report,
+        new_uuid,
+        "2023-04-15T14:15:34.726727",
+        add_new_links=True,
+        num_new_links=-1,
+    )
+    existing_broken, newly_broken = get_report_diff(session, fake_report, new_uuid)
+    assert len(existing_broken) == MAX_BROKEN_LINKS * MAX_REPOS - 1
+    assert len(newly_broken) == 0
+
+
+def test_query_report_diff_matches_in_python_diff(fake_report, session):
+    new_uuid = uuid.uuid4()
+    clone_report(
+        session,
+        fake_report,
+        new_uuid,
+        "2023-04-15T14:15:34.726727",
+        add_new_links=True,
+        num_new_links=-5,
+    )
+    third_uuid = uuid.uuid4()
+    clone_report(
+        session,
+        new_uuid,
+        third_uuid,
+        "2023-04-16T14:15:34.726727",
+        add_new_links=True,
+        num_new_links=2,
+    )
+    in_python = diff_links(
+        broken_links_from_report(session, fake_report),
+        broken_links_from_report(session, third_uuid),
+    )
+    in_database = query_report_diff(session, fake_report, third_uuid)
+    assert keys(in_database.new) == keys(in_python.new)
+    assert keys(in_database.existing) == keys(in_python.existing)
+    assert keys(in_database.fixed) == keys(in_python.fixed)
+    assert len(in_database.new) == 2
+    assert len(in_database.fixed) == 5
+
+
+def test_query_report_diff_in_python(fake_report, session, monkeypatch):
+    monkeypatch.setattr(settings, "diff_in_database", False)
+    new_uuid = uuid.uuid4()
+    clone_report(session, fake_report, new_uuid, "2023-04-15T14:15:34.726727")
+    result = query_report_diff(session, fake_report, new_uuid)
+    assert len(result.existing) == MAX_BROKEN_LINKS * MAX_REPOS
+    assert result.new == []
+    assert result.fixed == []
+
+
+def test_diff_queries_compile_for_supported_dialects():
+    prev_id, new_id = uuid.uuid4(), uuid.uuid4()
+    for build_query in (new_links_query, existing_links_query, fixed_links_query):
+        for dialect in (sqlite.dialect(), postgresql.dialect()):
+            sql = str(build_query(prev_id, new_id).compile(dialect=dialect))
+            assert "EXISTS" in sql
+
+
+def test_persist_materializes_adjacent_diffs(empty_db, session):
+    first = persist(session, make_report("2023-05-01T00:00:00", 2, 5))
+    third = persist(session, make_report("2023-05-03T00:00:00", 3, 5))
+    assert materialized_diffs(session) == [(first, third)]
+
+    # A report stored out of order is diffed against both of its neighbours
+    second = persist(session, make_report("2023-05-02T00:00:00", 1, 5))
+    assert set(materialized_diffs(session)) == {
+        (first, third),
+        (first, second),
+        (second, third),
+    }
+
+    result = query_report_diff(session, first, third)
+    assert all(isinstance(row, LinkRow) for row in result.new)
+    assert keys(result.existing) == keys(broken_links_from_report(session, first))
+    assert len(result.new) == 5
+    assert result.fixed == []
+
+    delete_report_data(session, second)
+    assert materialized_diffs(session) == [(first, third)]
+
+
+def test_query_report_diff_reads_missing_diff_live(fake_report, session):
+    new_uuid = uuid.uuid4()
+    clone_report(
+        session,
+        fake_report,
+        new_uuid,
+        "2023-04-15T14:15:34.726727",
+        add_new_links=True,
+        num_new_links=-3,
+    )
+    assert materialized_diffs(session) == [(fake_report, new_uuid)]
+    materialized = query_report_diff(session, fake_report, new_uuid)
+
+    # A diff that was not materialized at ingestion is compared live, and stays so
+    delete_report_diffs(session, new_uuid)
+    session.commit()
+    live = query_report_diff(session, fake_report, new_uuid)
+    assert materialized_diffs(session) == []
+    assert len(live.fixed) == 3
+    assert len(live.existing) == MAX_BROKEN_LINKS * MAX_REPOS - 3
+    assert keys(live.existing) == keys(materialized.existing)
+    assert keys(live.fixed) == keys(materialized.fixed)
+
+
+def test_backfill_diffs(fake_report, session, capsys, monkeypatch):
+    second, third = uuid.uuid4(), uuid.uuid4()
+    # Reports stored before diffs were materialized
+    monkeypatch.setattr(settings, "materialize_diffs", False)
+    clone_report(session, fake_report, second, "2023-04-15T14:15:34.726727")
+    clone_report(session, fake_report, third, "2023-04-16T14:15:34.726727")
+    monkeypatch.setattr(settings, "materialize_diffs", True)
+    main(["backfill-diffs"])
+    assert "Materialized 2 report diffs" in capsys.readouterr().out
+    assert set(materialized_diffs(session)) == {(fake_report, second), (second, third)}
+    main(["backfill-diffs"])
+    assert "Materialized 0 report diffs" in capsys.readouterr().out
@@ -0,0 +1,40 @@
+import pytest
+
+from watney.cache import render
+from watney.fastjson import dumps, render_report
+from watney.helpers import (
+    get_report_by_id,
+    get_report_diff,
+    get_report_date,
+    report_rows,
+)
+from watney.schema import BrokenLinksResponse
+from watney.settings import settings
+from watney.tests.test_fixtures import fake_report, session, two_reports_one_empty
+
+orjson = pytest.importorskip("orjson")
+
+
+def test_render_report_matches_default_rendering(fake_report, session):
+    expected = render(get_report_by_id(session, fake_report)).body
+    assert render_report(fake_report, *report_rows(session, fake_report)) == expected
+
+
+def test_dumps_matches_default_rendering(two_reports_one_empty, session, monkeypatch):
+    prev_id, new_id = two_reports_one_empty
+    existing, new = get_report_diff(session, prev_id, new_id)
+    content = BrokenLinksResponse(
+        new_broken_links=new,
+        existing_broken_links=[],
+        last_report_id=new_id,
+        last_report_date=get_report_date(session, new_id),
+    )
+    expected = render(content)
+    monkeypatch.setattr(settings, "fast_json", True)
+    assert render(content) == expected
+    assert dumps(content) == expected.body
+
+
+def test_dumps_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        dumps({"value": object()})
@@ -1,19 +1,17 @@
-from typing import List
+from contextlib import contextmanager
 
 import pytest
 import datetime
 import uuid
 
+from sqlalchemy import event
 from sqlalchemy.orm.exc import ObjectDeletedError
 
-from watney.db.models import BrokenLinkReportData, create_tables, BrokenLinkFileData
+from watney.db.models import BrokenLinkReportData, create_tables
 from watney.db.session import get_session, get_engine_from_settings
 from watney.helpers import create_data, clear_db, delete_report_data
-from watney.schema import BrokenLink, BrokenLinkRepo
-
-from faker import Faker
-
-fake = Faker()
+from watney.schema import BrokenLink, BrokenLinkRepo, BrokenLinkReport
+from watney.tests.synthetic import insert_report
 
 FAKE_REPORT_DATE = datetime.datetime.fromisoformat("2023-03-14T14:15:34.726727")
 FAKE_EMPTY_REPORT_DATE = datetime.datetime.fromisoformat("2023-03-11T22:33:32.87")
@@ -23,30 +21,44 @@ MAX_BROKEN_LINKS = 20
 MAX_REPOS = 20
 
 
-def create_fake_link_data(url) -> List[BrokenLink]:
-    result = []
-    for i in range(0, MAX_BROKEN_LINKS):
-        file_path = fake.file_path()
-        result.append(BrokenLink(file=file_path, url=url + file_path, status_code=404))
-    return result
+@contextmanager
+def count_queries():
+    """
+    Count the statements sent to the database while the context is active
+    :return: a list that collects the SQL and parameters of every executed statement
+    """
+    statements = []
 
+    def before_cursor_execute(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
 
-def create_fake_repo() -> BrokenLinkRepo:
-    url = fake.url()
-    return BrokenLinkRepo(
-        repo_name=fake.domain_word(),
-        repo_url=url,
-        broken_links=create_fake_link_data(url),
+    engine = get_engine_from_settings()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def make_report(report_date: str, num_repos: int, num_links: int) -> BrokenLinkReport:
+    return BrokenLinkReport(
+        report_date=datetime.datetime.fromisoformat(report_date),
+        report=[
+            BrokenLinkRepo(
+                repo_name=f"repo-{i}",
+                repo_url=f"https://github.com/repo-{i}",
+                broken_links=[
+                    BrokenLink(
+                        file=f"docs/{j}.md", url=f"https://a.b/{j}", status_code=404
+                    )
+                    for j in range(0, num_links)
+                ],
+            )
+            for i in range(0, num_repos)
+        ],
     )
 
 
-def create_fake_repos() -> List[BrokenLinkRepo]:
-    result = []
-    for i in range(0, MAX_REPOS):
-        result.append(create_fake_repo())
-    return result
-
-
 def create_fake_empty_report(report_id: uuid.UUID, report_ts: datetime):
     """
     Create a report with no broken links
@@ -59,34 +71,37 @@ def create_fake_empty_report(report_id: uuid.UUID, report_ts: datetime):
         session.commit()
 
 
-def create_fake_report(report_id: uuid.UUID, report_ts: datetime):
+def create_fake_report(report_id: uuid.UUID, report_ts: datetime, seed: int = 0):
     """
     Models and persists fake report data to the db.
     :param report_id:
     :param report_ts:
+    :param seed: varies the generated repos and links, see watney.tests.synthetic
     :return:
     """
-    fake_repos = create_fake_repos()
     with get_session() as session:
-        session.add(BrokenLinkReportData(report_id=report_id, date=report_ts))
-        for fake_repo in fake_repos:
-            for broken_link in fake_repo.broken_links:
-                broken_link_data = BrokenLinkFileData(
-                    report_id=report_id,
-                    repo_name=fake_repo.repo_name,
-                    repo_url=fake_repo.repo_url,
-                    file=broken_link.file,
-                    url=broken_link.url,
-                    status_code=broken_link.status_code,
-                )
-                session.add(broken_link_data)
-        session.commit()
+        insert_report(
+            session,
+            report_id,
+            report_ts,
+            MAX_REPOS,
+            MAX_BROKEN_LINKS,
+            seed,
+            status_codes=(404,),
+        )
+
+
+@pytest.fixture
+def session():
+    with get_session() as session:
+        yield session
 
 
 @pytest.fixture
 def fake_report():
     create_tables(get_engine_from_settings())
-    clear_db()
+    with get_session() as session:
+        clear_db(session)
     create_fake_report(FAKE_REPORT_UUID, FAKE_REPORT_DATE)
     yield FAKE_REPORT_UUID
     try:
@@ -105,13 +120,15 @@ def two_reports_one_empty():
     :return:
     """
     create_tables(get_engine_from_settings())
-    clear_db()
+    with get_session() as session:
+        clear_db(session)
     create_fake_empty_report(FAKE_EMPTY_REPORT_UUID, FAKE_EMPTY_REPORT_DATE)
     create_fake_report(FAKE_REPORT_UUID, FAKE_REPORT_DATE)
     yield FAKE_EMPTY_REPORT_UUID, FAKE_REPORT_UUID
     try:
-        delete_report_data(FAKE_EMPTY_REPORT_UUID)
-        delete_report_data(FAKE_REPORT_UUID)
+        with get_session() as session:
+            delete_report_data(session, FAKE_EMPTY_REPORT_UUID)
+            delete_report_data(session, FAKE_REPORT_UUID)
     except ObjectDeletedError:
         pass
 
@@ -125,17 +142,19 @@ def new_report_empty():
     :return:
     """
     create_tables(get_engine_from_settings())
-    clear_db()
+    with get_session() as session:
+        clear_db(session)
     prev_report_uuid = uuid.uuid4()
-    prev_report_ts = "2023-03-14T14:15:34.726727"
+    prev_report_ts = datetime.datetime.fromisoformat("2023-03-14T14:15:34.726727")
     new_empty_report_uuid = uuid.uuid4()
     new_empty_report_ts = "2023-03-20T14:20:38.23"
     create_fake_report(prev_report_uuid, prev_report_ts)
     create_fake_empty_report(new_empty_report_uuid, new_empty_report_ts)
     yield prev_report_uuid, new_empty_report_uuid
     try:
-        delete_report_data(prev_report_uuid)
-        delete_report_data(new_empty_report_uuid)
+        with get_session() as session:
+            delete_report_data(session, prev_report_uuid)
+            delete_report_data(session, new_empty_report_uuid)
     except ObjectDeletedError:
         pass
 
@@ -148,14 +167,16 @@ def multiple_reports():
     for i in range(0, 100):
         last_id = uuid.uuid4()
         last_date = datetime.datetime.utcnow()
-        create_fake_report(last_id, last_date)
+        create_fake_report(last_id, last_date, seed=i)
         all_data.append(last_id)
     yield last_id, last_date
-    for data in all_data:
-        delete_report_data(data)
+    with get_session() as session:
+        for data in all_data:
+            delete_report_data(session, data)
 
 
 @pytest.fixture
 def empty_db():
     create_tables(get_engine_from_settings())
-    clear_db()
+    with get_session() as session:
+        clear_db(session)
@@ -1,11 +1,210 @@
-from watney.helpers import clear_db, get_report_by_id
-from watney.tests.test_fixtures import fake_report
+import datetime
+import gc
+import tracemalloc
+import uuid
 
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
 
-def test_clear_db(fake_report):
+from watney.db.models import BrokenLinkFileData, create_tables
+from watney.db.session import get_engine, get_session
+from watney.helpers import (
+    broken_links_from_report,
+    clear_db,
+    get_report_by_id,
+    get_report_list,
+    persist,
+    report_exists_for_date,
+)
+from watney.storage import insert_broken_links
+from watney.tests.synthetic import clone_report
+from watney.tests.test_fixtures import (
+    count_queries,
+    empty_db,
+    fake_report,
+    make_report,
+    MAX_BROKEN_LINKS,
+    MAX_REPOS,
+    session,
+)
+from watney.settings import settings
+
+
+def test_clear_db(fake_report, session):
     """
     Confirm that we can clear the table in the db between tests
     :return:
     """
-    clear_db()
-    assert not get_report_by_id(fake_report)
+    clear_db(session)
+    assert not get_report_by_id(session, fake_report)
+
+
+def test_get_report_by_id(fake_report, session):
+    report = get_report_by_id(session, fake_report)
+    assert report.report_id == fake_report
+    assert len(report.report) == MAX_REPOS
+    for repo in report.report:
+        assert len(repo.broken_links) == MAX_BROKEN_LINKS
+
+
+def test_get_report_by_id_query_count(fake_report, session):
+    """
+    Reconstructing a report costs the same number of queries regardless of its size
+    """
+    small_report_id = persist(session, make_report("2023-05-01T00:00:00", 1, 1))
+    with count_queries() as small_report_queries:
+        assert len(get_report_by_id(session, small_report_id).report) == 1
+    with count_queries() as large_report_queries:
+        assert len(get_report_by_id(session, fake_report).report) == MAX_REPOS
+    assert len(small_report_queries) == 2
+    assert len(large_report_queries) == len(small_report_queries)
+
+
+@pytest.mark.parametrize("bulk_ingest", [True, False])
+def test_persist(fake_report, session, monkeypatch, bulk_ingest):
+    monkeypatch.setattr(settings, "bulk_ingest", bulk_ingest)
+    monkeypatch.setattr(settings, "ingest_chunk_size", 7)
+    broken_link_report = make_report("2023-05-01T00:00:00", 3, 10)
+    report_id = persist(session, broken_link_report)
+    report = get_report_by_id(session, report_id)
+    assert report.report == broken_link_report.report
+
+
+def test_insert_broken_links_chunks(fake_report, session):
+    broken_link_report = make_report("2023-05-01T00:00:00", 1, 10)
+    report_id = persist(session, broken_link_report)
+    rows = [
+        dict(
+            report_id=report_id,
+            repo_name="other",
+            repo_url="https://github.com/other",
+            file=f"{i}.md",
+            url="https://a.b",
+            status_code=500,
+        )
+        for i in range(0, 25)
+    ]
+    with count_queries() as statements:
+        assert insert_broken_links(session, rows, chunk_size=10) == 25
+    assert len(statements) == 3
+    session.commit()
+    assert len(get_report_by_id(session, report_id).report) == 2
+
+
+def test_persist_bulk_ingest_is_atomic(fake_report, session, monkeypatch):
+    monkeypatch.setattr(settings, "ingest_chunk_size", 5)
+    broken_link_report = make_report("2023-05-01T00:00:00", 2, 10)
+    # A duplicate link in the last chunk violates the primary key
+    broken_link_report.report[1].broken_links[9].file = "docs/0.md"
+    with pytest.raises(IntegrityError):
+        persist(session, broken_link_report)
+    with get_session() as other_session:
+        assert not report_exists_for_date(other_session, broken_link_report.report_date)
+
+
+def test_get_report_list_pages(empty_db, session):
+    dates = [datetime.datetime(2023, 5, day) for day in range(1, 8)]
+    for date in dates:
+        persist(session, make_report(date.isoformat(), 1, 1))
+    newest_first = list(reversed(dates))
+
+    page = get_report_list(session, limit=3)
+    assert [x.report_date for x in page.reports] == newest_first[0:3]
+    assert page.next_cursor == dates[4]
+    page = get_report_list(session, limit=3, before=page.next_cursor)
+    assert [x.report_date for x in page.reports] == newest_first[3:6]
+    page = get_report_list(session, limit=3, before=page.next_cursor)
+    assert [x.report_date for x in page.reports] == newest_first[6:]
+    assert page.next_cursor is None
+
+    # Paging forward in time, pages are still listed newest first
+    page = get_report_list(session, limit=3, after=dates[0])
+    assert [x.report_date for x in page.reports] == [dates[3], dates[2], dates[1]]
+    assert page.next_cursor == dates[3]
+    page = get_report_list(session, after=dates[3], before=dates[6])
+    assert [x.report_date for x in page.reports] == [dates[5], dates[4]]
+    assert page.next_cursor is None
+
+
+def test_get_report_list_pages_through_shared_dates(empty_db, session):
+    date = datetime.datetime(2023, 5, 1)
+    persist(session, make_report(date.isoformat(), 1, 1))
+    first = get_report_list(session).reports[0].report_id
+    # clone_report skips the duplicate date check of persist
+    for _ in range(4):
+        clone_report(session, uuid.UUID(first), uuid.uuid4(), date.isoformat())
+    persist(session, make_report("2023-05-02T00:00:00", 1, 1))
+
+    def all_pages(**cursor):
+        report_ids = []
+        while True:
+            page = get_report_list(session, limit=2, **cursor)
+            report_ids += [x.report_id for x in page.reports]
+            if page.next_cursor is None:
+                return report_ids
+            if "after" in cursor:
+                cursor = dict(after=page.next_cursor, after_id=page.next_cursor_id)
+            else:
+                cursor = dict(before=page.next_cursor, before_id=page.next_cursor_id)
+
+    newest_first = all_pages()
+    assert len(newest_first) == len(set(newest_first)) == 6
+    assert newest_first == [x.report_id for x in get_report_list(session).reports]
+    forward = all_pages(after=datetime.datetime(2023, 4, 1))
+    assert sorted(forward) == sorted(newest_first)
+
+
+def test_create_tables_adds_missing_indexes(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path}/watney.db")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE brokenlinkreportdata (report_id CHAR(32) NOT NULL, "
+            "date DATETIME NOT NULL, PRIMARY KEY (report_id))"
+        )
+    create_tables(engine)
+    indexes = inspect(engine).get_indexes("brokenlinkreportdata")
+    assert [index["column_names"] for index in indexes] == [["date", "report_id"]]
+
+
+def traced(load) -> (int, int):
+    """
+    The peak traced memory while calling load, and the number of memory blocks still
+    allocated while its result is held
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = load()
+        _, peak = tracemalloc.get_traced_memory()
+        blocks = sum(
+            stat.count for stat in tracemalloc.take_snapshot().statistics("filename")
+        )
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, blocks
+
+
+def test_link_rows_use_less_memory_than_orm_objects(empty_db):
+    with get_session() as session:
+        report_id = persist(session, make_report("2023-05-01T00:00:00", 20, 200))
+
+    def orm_objects():
+        with get_session() as session:
+            query = select(BrokenLinkFileData).where(
+                BrokenLinkFileData.report_id == report_id
+            )
+            return session.exec(query).fetchall()
+
+    def link_rows():
+        with get_session() as session:
+            return broken_links_from_report(session, report_id)
+
+    # Warm up the statement caches of both queries first
+    assert len(orm_objects()) == len(link_rows()) == 4000
+    orm_peak, orm_blocks = traced(orm_objects)
+    rows_peak, rows_blocks = traced(link_rows)
+    assert rows_peak < orm_peak / 2
+    assert rows_blocks < orm_blocks / 2
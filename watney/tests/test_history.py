@@ -0,0 +1,159 @@
+import copy
+import datetime
+import threading
+import time
+
+import pytest
+from sqlalchemy import func
+from sqlmodel import select
+
+from watney.cli import main
+from watney.db.session import get_session
+from watney.db.models import BrokenLinkFileData, LinkHistoryData, RepoStatusCountData
+from watney.diff import link_key
+from watney.errors import OutOfOrderReportError
+from watney.history import HistoryLayout
+from watney.helpers import (
+    clear_db,
+    delete_report_data,
+    get_report_by_id,
+    persist,
+    query_report_diff,
+)
+from watney.schema import BrokenLink
+from watney.settings import settings
+from watney.tests.test_fixtures import empty_db, make_report, session
+
+
+@pytest.fixture
+def history(monkeypatch):
+    monkeypatch.setattr(settings, "storage_layout", "history")
+
+
+def count_intervals(session) -> int:
+    return session.exec(select(func.count()).select_from(LinkHistoryData)).one()
+
+
+def keys(rows):
+    return sorted(link_key(row) for row in rows)
+
+
+def churned_reports():
+    """
+    Four reports: a link fixed, a link added, a status code changed and a link that comes
+    back after it was fixed
+    """
+    first = make_report("2023-05-01T00:00:00", 2, 3)
+    second = copy.deepcopy(first)
+    second.report_date = first.report_date.replace(day=2)
+    del second.report[0].broken_links[0]
+    third = copy.deepcopy(second)
+    third.report_date = first.report_date.replace(day=3)
+    third.report[1].broken_links.append(
+        BrokenLink(file="docs/new.md", url="https://a.b/new", status_code=404)
+    )
+    third.report[1].broken_links[0].status_code = 500
+    fourth = copy.deepcopy(third)
+    fourth.report_date = first.report_date.replace(day=4)
+    fourth.report[0].broken_links.insert(0, first.report[0].broken_links[0])
+    return [first, second, third, fourth]
+
+
+def test_history_round_trip(empty_db, history, session):
+    reports = churned_reports()
+    report_ids = [persist(session, report) for report in reports]
+    for report_id, report in zip(report_ids, reports):
+        result = get_report_by_id(session, report_id)
+        assert result.report_date == report.report_date
+        assert result.report == report.report
+    # 6 links at first, then one new link, one changed and one back
+    assert count_intervals(session) == 6 + 1 + 1 + 1
+    assert session.exec(select(func.count()).select_from(BrokenLinkFileData)).one() == 0
+
+
+def test_unchanged_reports_add_no_intervals(empty_db, history, session):
+    for day in range(1, 6):
+        persist(session, make_report(f"2023-05-0{day}T00:00:00", 2, 3))
+    assert count_intervals(session) == 6
+
+
+def test_history_out_of_order(empty_db, history, session):
+    persist(session, make_report("2023-05-02T00:00:00", 1, 1))
+    with pytest.raises(OutOfOrderReportError):
+        persist(session, make_report("2023-05-01T00:00:00", 1, 1))
+
+
+def diffs_and_rollups(session, report_ids) -> list:
+    diffs = [
+        [keys(rows) for rows in query_report_diff(session, prev, new)]
+        for i, prev in enumerate(report_ids)
+        for new in report_ids[i + 1 :]
+    ]
+    rollups = session.exec(
+        select(
+            RepoStatusCountData.repo_name,
+            RepoStatusCountData.status_code,
+            RepoStatusCountData.count,
+        ).order_by(RepoStatusCountData.repo_name, RepoStatusCountData.count)
+    ).all()
+    return [diffs, rollups]
+
+
+def test_history_diffs_and_rollups_match_flat(empty_db, session, monkeypatch):
+    flat_ids = [persist(session, report) for report in churned_reports()]
+    flat = diffs_and_rollups(session, flat_ids)
+    clear_db(session)
+    monkeypatch.setattr(settings, "storage_layout", "history")
+    report_ids = [persist(session, report) for report in churned_reports()]
+    assert diffs_and_rollups(session, report_ids) == flat
+    monkeypatch.setattr(settings, "materialize_diffs", False)
+    clear_db(session)
+    report_ids = [persist(session, report) for report in churned_reports()]
+    assert diffs_and_rollups(session, report_ids)[0] == flat[0]
+
+
+def test_convert_to_history(empty_db, session, monkeypatch, capsys):
+    report_ids = [persist(session, report) for report in churned_reports()]
+    reports = [get_report_by_id(session, report_id) for report_id in report_ids]
+    monkeypatch.setattr(settings, "storage_layout", "history")
+    main(["convert-layout"])
+    assert "Moved 24 broken links to the history layout" in capsys.readouterr().out
+    assert count_intervals(session) == 9
+    assert [get_report_by_id(session, id_) for id_ in report_ids] == reports
+
+    monkeypatch.setattr(settings, "storage_layout", "flat")
+    main(["convert-layout"])
+    assert "Moved 24 broken links to the flat layout" in capsys.readouterr().out
+    assert count_intervals(session) == 0
+    assert [get_report_by_id(session, id_) for id_ in report_ids] == reports
+
+
+@pytest.mark.parametrize("deleted", [0, 1, 3])
+def test_delete_report_data_shrinks_intervals(empty_db, history, session, deleted):
+    reports = churned_reports()
+    report_ids = [persist(session, report) for report in reports]
+    delete_report_data(session, report_ids[deleted])
+    assert get_report_by_id(session, report_ids[deleted]) is None
+    for report_id, report in zip(report_ids, reports):
+        if report_id != report_ids[deleted]:
+            assert get_report_by_id(session, report_id).report == report.report
+
+
+def test_history_ingestion_is_serialized(empty_db, session, history):
+    # A report being stored holds the lock until it commits
+    HistoryLayout().check_new_report(session, datetime.datetime(2023, 6, 1))
+    committed = []
+
+    def store():
+        with get_session() as other:
+            HistoryLayout().check_new_report(other, datetime.datetime(2023, 6, 2))
+            committed.append(True)
+            other.rollback()
+
+    thread = threading.Thread(target=store)
+    thread.start()
+    time.sleep(0.5)
+    assert not committed
+    session.commit()
+    thread.join()
+    assert len(committed) == 1
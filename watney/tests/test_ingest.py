@@ -0,0 +1,145 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from watney.db.session import get_async_engine_from_settings, get_async_session
+from watney.errors import DuplicateReportError, InvalidReportDataError
+from watney.helpers import get_report_by_id, report_exists_for_date
+from watney.ingest import ndjson_lines, parse_link_rows, persist_ndjson
+from watney.settings import settings
+from watney.tests.test_fixtures import FAKE_REPORT_DATE, empty_db, fake_report, session
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(lines):
+    return [line async for line in lines]
+
+
+def ingest(*chunks: bytes) -> uuid.UUID:
+    async def run():
+        try:
+            async with get_async_session() as async_session:
+                return await persist_ndjson(async_session, stream(*chunks))
+        finally:
+            await get_async_engine_from_settings().dispose()
+
+    return asyncio.run(run())
+
+
+def ndjson(*objects) -> bytes:
+    return b"\n".join(json.dumps(obj).encode() for obj in objects) + b"\n"
+
+
+def test_ndjson_lines_split_across_chunks():
+    chunks = [b'{"a"', b": 1}\n\n{", b'"b": 2}\n{"c"', b": 3}"]
+    lines = asyncio.run(collect(ndjson_lines(stream(*chunks))))
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+def test_parse_link_rows():
+    report_id = uuid.uuid4()
+    repo = {
+        "repo_name": "watney",
+        "repo_url": "https://github.com/watney",
+        "broken_links": [
+            {"file": "a.md", "url": "https://a.b", "status_code": 404},
+            {"file": "b.md", "url": "https://b.c", "status_code": 500},
+        ],
+    }
+    rows = parse_link_rows(report_id, json.dumps(repo).encode(), 2)
+    assert [row["file"] for row in rows] == ["a.md", "b.md"]
+    assert all(row["repo_name"] == "watney" for row in rows)
+
+    link = dict(repo_name="watney", repo_url="https://github.com/watney")
+    link.update(repo["broken_links"][0])
+    assert parse_link_rows(report_id, json.dumps(link).encode(), 3) == [
+        dict(report_id=report_id, **link)
+    ]
+
+    with pytest.raises(InvalidReportDataError, match="line 4"):
+        parse_link_rows(report_id, b'{"file": "a.md"}', 4)
+    with pytest.raises(InvalidReportDataError, match="line 5"):
+        parse_link_rows(report_id, b"not json", 5)
+
+
+@pytest.mark.parametrize("layout", ["flat", "normalized", "history"])
+def test_persist_ndjson(empty_db, session, monkeypatch, layout):
+    monkeypatch.setattr(settings, "storage_layout", layout)
+    monkeypatch.setattr(settings, "ingest_chunk_size", 3)
+    links = [
+        {
+            "repo_name": f"repo-{i % 2}",
+            "repo_url": f"https://github.com/repo-{i % 2}",
+            "file": f"{i}.md",
+            "url": "https://a.b",
+            "status_code": 404,
+        }
+        for i in range(0, 10)
+    ]
+    body = ndjson({"report_date": "2023-05-01T00:00:00"}, *links)
+    report_id = ingest(body[:50], body[50:])
+    report = get_report_by_id(session, report_id)
+    assert [len(repo.broken_links) for repo in report.report] == [5, 5]
+
+
+def test_persist_ndjson_writes_after_the_body(empty_db, session):
+    link = dict(repo_name="r", repo_url="u", file="a.md", url="https://a.b")
+    body = ndjson({"report_date": "2023-05-01T00:00:00"}, dict(link, status_code=404))
+
+    async def run():
+        try:
+            async with get_async_session() as async_session:
+
+                async def chunks():
+                    for line in body.splitlines(keepends=True):
+                        # No transaction is held open while the client uploads
+                        assert not async_session.in_transaction()
+                        yield line
+
+                return await persist_ndjson(async_session, chunks())
+        finally:
+            await get_async_engine_from_settings().dispose()
+
+    report_id = asyncio.run(run())
+    assert len(get_report_by_id(session, report_id).report) == 1
+
+
+@pytest.mark.parametrize("layout", ["flat", "normalized"])
+@pytest.mark.parametrize("bulk_ingest", [True, False])
+def test_persist_ndjson_duplicate_link(
+    empty_db, session, monkeypatch, layout, bulk_ingest
+):
+    monkeypatch.setattr(settings, "storage_layout", layout)
+    monkeypatch.setattr(settings, "bulk_ingest", bulk_ingest)
+    monkeypatch.setattr(settings, "ingest_chunk_size", 2)
+    link = dict(repo_name="r", repo_url="u", url="https://a.b", status_code=404)
+    body = ndjson(
+        {"report_date": "2023-05-01T00:00:00"},
+        dict(link, file="a.md"),
+        dict(link, file="b.md"),
+        dict(link, file="c.md"),
+        dict(link, file="a.md"),
+    )
+    with pytest.raises(InvalidReportDataError, match="line 5: .* line 2"):
+        ingest(body)
+    assert not report_exists_for_date(session, "2023-05-01T00:00:00")
+
+
+def test_persist_ndjson_duplicate_date(fake_report):
+    with pytest.raises(DuplicateReportError):
+        ingest(ndjson({"report_date": FAKE_REPORT_DATE.isoformat()}))
+
+
+def test_persist_ndjson_invalid_line(empty_db, session):
+    body = ndjson({"report_date": "2023-05-01T00:00:00"}) + b"{}\n"
+    with pytest.raises(InvalidReportDataError, match="line 2"):
+        ingest(body)
+    assert not report_exists_for_date(session, "2023-05-01T00:00:00")
+    with pytest.raises(InvalidReportDataError):
+        ingest(b"")
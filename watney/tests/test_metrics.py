@@ -0,0 +1,135 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+from watney.db.session import get_async_engine_from_settings, get_engine_from_settings
+from watney.helpers import get_report_diff, persist
+from watney.main import app
+from watney.metrics import get_metrics, instrument_engine, statement_name
+from watney.settings import settings
+from watney.tests.synthetic import clone_report
+from watney.tests.test_fixtures import (
+    fake_report,
+    make_report,
+    MAX_BROKEN_LINKS,
+    MAX_REPOS,
+    session,
+)
+
+pytest.importorskip("prometheus_client")
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    monkeypatch.setattr(settings, "metrics", True)
+    instrument_engine(get_engine_from_settings())
+    instrument_engine(get_async_engine_from_settings().sync_engine)
+    return get_metrics()
+
+
+def sample(metrics, name: str, **labels) -> float:
+    return metrics.registry.get_sample_value(name, labels) or 0
+
+
+def get(*paths: str) -> list:
+    async def requests():
+        try:
+            async with httpx.AsyncClient(app=app, base_url="http://watney") as client:
+                return [await client.get(path) for path in paths]
+        finally:
+            await get_async_engine_from_settings().dispose()
+
+    return asyncio.run(requests())
+
+
+def test_statement_name():
+    assert (
+        statement_name("SELECT a.x \nFROM brokenlinkfiledata AS a WHERE a.y = ?")
+        == "SELECT brokenlinkfiledata"
+    )
+    assert (
+        statement_name("SELECT count(*) FROM (SELECT x FROM urlcountdata) AS anon_1")
+        == "SELECT urlcountdata"
+    )
+    assert (
+        statement_name('INSERT INTO "BrokenLinkReportData" (report_id) VALUES (?)')
+        == "INSERT brokenlinkreportdata"
+    )
+    assert statement_name("UPDATE linkhistorydata SET x=?") == "UPDATE linkhistorydata"
+    assert statement_name("  commit") == "COMMIT"
+    assert statement_name("") == ""
+
+
+def test_metrics_disabled():
+    (response,) = get("/metrics")
+    assert response.status_code == 404
+
+
+def test_request_metrics(fake_report, metrics):
+    route = "/report/{report_id}"
+    labels = dict(method="GET", route=route)
+    before = sample(
+        metrics, "watney_http_request_duration_seconds_count", **labels, status="200"
+    )
+    statements_before = sample(
+        metrics,
+        "watney_db_statement_duration_seconds_count",
+        statement="SELECT brokenlinkfiledata",
+        route=route,
+    )
+
+    report, missing, scrape = get(
+        f"/report/{fake_report}", f"/report/{uuid.uuid4()}", "/metrics"
+    )
+    assert report.status_code == 200
+    assert missing.status_code == 404
+    assert (
+        sample(
+            metrics,
+            "watney_http_request_duration_seconds_count",
+            **labels,
+            status="200",
+        )
+        == before + 1
+    )
+    assert sample(
+        metrics, "watney_http_request_duration_seconds_count", **labels, status="404"
+    )
+    assert sample(metrics, "watney_http_response_size_bytes_sum", **labels) >= len(
+        report.content
+    )
+    assert sample(metrics, "watney_http_request_db_statements_count", **labels)
+    assert (
+        sample(
+            metrics,
+            "watney_db_statement_duration_seconds_count",
+            statement="SELECT brokenlinkfiledata",
+            route=route,
+        )
+        == statements_before + 1
+    )
+
+    assert scrape.status_code == 200
+    assert scrape.headers["content-type"].startswith("text/plain")
+    assert 'route="/report/{report_id}"' in scrape.text
+
+
+def test_ingest_and_diff_metrics(fake_report, session, metrics):
+    ingested = sample(metrics, "watney_ingested_rows_sum", source="json")
+    persist(session, make_report("2023-05-01T00:00:00", 2, 3))
+    assert sample(metrics, "watney_ingested_rows_sum", source="json") == ingested + 6
+
+    new_uuid = uuid.uuid4()
+    clone_report(
+        session, fake_report, new_uuid, "2023-04-15T00:00:00", add_new_links=True
+    )
+    new = sample(metrics, "watney_diff_links_sum", state="new")
+    existing = sample(metrics, "watney_diff_links_sum", state="existing")
+    get_report_diff(session, fake_report, new_uuid)
+    assert sample(metrics, "watney_diff_links_sum", state="new") == new + 1
+    assert (
+        sample(metrics, "watney_diff_links_sum", state="existing")
+        == existing + MAX_REPOS * MAX_BROKEN_LINKS
+    )
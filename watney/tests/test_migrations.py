@@ -0,0 +1,179 @@
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import inspect, text
+
+import watney
+from watney.cli import main
+from watney.db.migrations import (
+    MIGRATIONS,
+    SCHEMA_VERSION,
+    bootstrap,
+    migrate,
+    schema_is_current,
+    schema_version,
+    set_schema_version,
+)
+from watney.db.models import create_tables
+from watney.db.session import get_engine, get_engine_from_settings
+from watney.errors import SchemaVersionError
+from watney.main import check_schema
+from watney.settings import settings
+
+
+@pytest.fixture
+def new_engine(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path}/migrations.db")
+    yield engine
+    engine.dispose()
+
+
+def test_migrate(new_engine):
+    assert schema_version(new_engine) == 0
+    assert not schema_is_current(new_engine)
+    assert migrate(new_engine) == SCHEMA_VERSION
+    assert schema_is_current(new_engine)
+    assert "brokenlinkfiledata" in inspect(new_engine).get_table_names()
+    assert migrate(new_engine) == 0
+
+
+def schema_of(engine) -> dict:
+    inspector = inspect(engine)
+    return {
+        table: (
+            [
+                (column["name"], column["nullable"])
+                for column in inspector.get_columns(table)
+            ],
+            inspector.get_pk_constraint(table)["constrained_columns"],
+            sorted(
+                (index["name"], index["column_names"])
+                for index in inspector.get_indexes(table)
+            ),
+            sorted(
+                constraint["column_names"]
+                for constraint in inspector.get_unique_constraints(table)
+            ),
+        )
+        for table in inspector.get_table_names()
+    }
+
+
+def test_migrations_match_models(new_engine, tmp_path):
+    migrate(new_engine)
+    models_engine = get_engine(f"sqlite:///{tmp_path}/models.db")
+    create_tables(models_engine)
+    assert schema_of(new_engine) == schema_of(models_engine)
+    models_engine.dispose()
+
+
+def test_migrate_unversioned_database(new_engine):
+    create_tables(new_engine)
+    assert schema_version(new_engine) == 0
+    assert migrate(new_engine) == SCHEMA_VERSION
+    assert schema_is_current(new_engine)
+
+
+def test_migrate_replaces_report_date_index(new_engine):
+    create_tables(new_engine)
+    with new_engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE INDEX ix_brokenlinkreportdata_date ON brokenlinkreportdata (date)"
+            )
+        )
+    set_schema_version(new_engine, 1)
+    assert migrate(new_engine) == SCHEMA_VERSION - 1
+    indexes = inspect(new_engine).get_indexes("brokenlinkreportdata")
+    assert [index["name"] for index in indexes] == [
+        "ix_brokenlinkreportdata_date_report_id"
+    ]
+
+
+def test_migrate_moves_report_date_into_rollups(new_engine):
+    for migration in MIGRATIONS[:2]:
+        migration(new_engine)
+    set_schema_version(new_engine, 2)
+    with new_engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO brokenlinkreportdata (report_id, date) "
+                "VALUES ('a', '2023-05-01 00:00:00.000000')"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO repostatuscountdata "
+                "(report_id, repo_name, repo_url, status_code, count) "
+                "VALUES ('a', 'repo', 'url', 404, 3)"
+            )
+        )
+    migrate(new_engine)
+    with new_engine.connect() as connection:
+        rows = connection.execute(
+            text("SELECT report_id, count, report_date FROM repostatuscountdata")
+        ).fetchall()
+    assert rows == [("a", 3, "2023-05-01 00:00:00.000000")]
+
+
+def test_migrate_refuses_newer_schema(new_engine):
+    migrate(new_engine)
+    set_schema_version(new_engine, SCHEMA_VERSION + 1)
+    with pytest.raises(SchemaVersionError):
+        migrate(new_engine)
+
+
+def test_bootstrap_without_auto_migrate(new_engine, monkeypatch):
+    monkeypatch.setattr(settings, "auto_migrate", False)
+    with pytest.raises(SchemaVersionError):
+        bootstrap(new_engine)
+    migrate(new_engine)
+    bootstrap(new_engine)
+
+
+def test_set_schema_version(new_engine):
+    migrate(new_engine)
+    set_schema_version(new_engine, 1)
+    set_schema_version(new_engine, 1)
+    assert schema_version(new_engine) == 1
+
+
+def test_app_startup_checks_schema(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "database_url", f"sqlite:///{tmp_path}/startup.db")
+    with pytest.raises(SchemaVersionError):
+        check_schema()
+    monkeypatch.setattr(settings, "auto_migrate", True)
+    check_schema()
+    assert schema_is_current(get_engine_from_settings())
+    get_engine_from_settings().dispose()
+
+
+def test_cli_migrate(capsys):
+    main(["migrate"])
+    assert f"version {SCHEMA_VERSION}" in capsys.readouterr().out
+    assert schema_is_current(get_engine_from_settings())
+
+
+def test_import_has_no_side_effects(tmp_path):
+    database = tmp_path / "import.db"
+    code = (
+        "import json, sys; import watney.main, watney.cli; "
+        "print(json.dumps(sorted(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=pathlib.Path(watney.__file__).parents[1],
+        env=dict(os.environ, DATABASE_URL=f"sqlite:///{database}"),
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    modules = set(json.loads(output))
+    assert not database.exists()
+    assert "faker" not in modules
+    assert "prometheus_client" not in modules
+    assert not any(module.startswith("watney.tests") for module in modules)
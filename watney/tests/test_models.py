@@ -11,20 +11,21 @@ from watney.tests.test_fixtures import (
     FAKE_REPORT_DATE,
     fake_report,
     multiple_reports,
+    session,
 )
 
 
-def test_report_exists(fake_report):
-    assert report_exists(FAKE_REPORT_UUID)
-    assert not report_exists(uuid.uuid4())
+def test_report_exists(fake_report, session):
+    assert report_exists(session, FAKE_REPORT_UUID)
+    assert not report_exists(session, uuid.uuid4())
 
 
-def test_report_exists_for_date(fake_report):
-    assert report_exists_for_date(FAKE_REPORT_DATE)
-    assert not report_exists_for_date(datetime.datetime.now())
+def test_report_exists_for_date(fake_report, session):
+    assert report_exists_for_date(session, FAKE_REPORT_DATE)
+    assert not report_exists_for_date(session, datetime.datetime.now())
 
 
-def test_get_last_report_id_and_datestamp(multiple_reports):
-    result = get_last_report_id_and_datestamp()
+def test_get_last_report_id_and_datestamp(multiple_reports, session):
+    result = get_last_report_id_and_datestamp(session)
     assert result[0] == multiple_reports[0]
     assert result[1] == multiple_reports[1]
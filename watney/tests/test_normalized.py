@@ -0,0 +1,173 @@
+import json
+
+import pytest
+from sqlalchemy import event, func
+from sqlmodel import select
+
+from watney.cli import main
+from watney.db.migrations import bootstrap
+from watney.db.models import (
+    BrokenLinkFileData,
+    FileData,
+    RepoData,
+    RepoStatusCountData,
+    ReportDiffData,
+    ReportLinkData,
+    UrlData,
+)
+from watney.db.session import get_engine_from_settings, get_session
+from watney.diff import link_key
+from watney.errors import StorageLayoutError
+from watney.fastjson import render_report
+from watney.helpers import (
+    clear_db,
+    delete_report_data,
+    get_report_by_id,
+    persist,
+    query_report_diff,
+    report_rows,
+)
+from watney.layouts import convert_layout, storage_layout
+from watney.normalized import intern_values
+from watney.settings import settings
+from watney.tests.test_fixtures import empty_db, make_report, session
+
+
+@pytest.fixture
+def normalized(monkeypatch):
+    monkeypatch.setattr(settings, "storage_layout", "normalized")
+
+
+def count(session, model) -> int:
+    return session.exec(select(func.count()).select_from(model)).one()
+
+
+def keys(rows):
+    return sorted(link_key(row) for row in rows)
+
+
+def changed_reports():
+    """
+    Three reports: links added, then a link fixed
+    """
+    first = make_report("2023-05-01T00:00:00", 2, 3)
+    second = make_report("2023-05-02T00:00:00", 2, 4)
+    third = make_report("2023-05-03T00:00:00", 2, 4)
+    del third.report[0].broken_links[0]
+    return [first, second, third]
+
+
+def test_intern_values(empty_db, session):
+    ids = intern_values(session, UrlData, ("url",), [("a",), ("b",), ("a",)])
+    assert set(ids) == {("a",), ("b",)}
+    assert intern_values(session, UrlData, ("url",), [("b",), ("c",)]) == {
+        ("b",): ids[("b",)],
+        ("c",): ids[("b",)] + 1,
+    }
+    assert count(session, UrlData) == 3
+
+
+def test_intern_values_stored_concurrently(empty_db, session):
+    # Another ingest stores a value between the lookup and the insert of this one
+    def store_concurrently(connection, cursor, statement, *args):
+        if statement.startswith("INSERT INTO urldata") and not stored:
+            stored.append(True)
+            with get_session() as other:
+                intern_values(other, UrlData, ("url",), [("b",)])
+                other.commit()
+
+    stored = []
+    engine = get_engine_from_settings()
+    event.listen(engine, "before_cursor_execute", store_concurrently)
+    try:
+        ids = intern_values(session, UrlData, ("url",), [("a",), ("b",)])
+    finally:
+        event.remove(engine, "before_cursor_execute", store_concurrently)
+    assert stored
+    assert set(ids) == {("a",), ("b",)}
+    assert count(session, UrlData) == 2
+
+
+def test_normalized_round_trip(empty_db, normalized, session, monkeypatch):
+    monkeypatch.setattr(settings, "ingest_chunk_size", 5)
+    report = make_report("2023-05-01T00:00:00", 3, 4)
+    report_id = persist(session, report)
+    result = get_report_by_id(session, report_id)
+    assert result.report_date == report.report_date
+    assert result.report == report.report
+    assert count(session, BrokenLinkFileData) == 0
+    monkeypatch.setattr(settings, "storage_layout", "flat")
+    assert get_report_by_id(session, report_id).report == []
+
+
+def test_normalized_stores_values_once(empty_db, normalized, session):
+    persist(session, make_report("2023-05-01T00:00:00", 3, 4))
+    persist(session, make_report("2023-05-02T00:00:00", 3, 5))
+    assert count(session, RepoData) == 3
+    assert count(session, FileData) == 3 * 5
+    assert count(session, UrlData) == 5
+    assert count(session, ReportLinkData) == 3 * 4 + 3 * 5
+
+
+def derived_data(session, report_ids) -> list:
+    """
+    What the API serves of the reports: the reports, the diffs of every pair of them,
+    materialized or not, and the rollups
+    """
+    diffs = [
+        [keys(rows) for rows in query_report_diff(session, *pair)]
+        for pair in [report_ids[0:2], report_ids[1:3], report_ids[0:3:2]]
+    ]
+    rollups = session.exec(
+        select(
+            RepoStatusCountData.repo_name,
+            RepoStatusCountData.status_code,
+            RepoStatusCountData.count,
+        ).order_by(RepoStatusCountData.repo_name, RepoStatusCountData.count)
+    ).all()
+    reports = [get_report_by_id(session, report_id).report for report_id in report_ids]
+    rendered = [
+        json.loads(render_report(id_, *report_rows(session, id_)))["report"]
+        for id_ in report_ids
+    ]
+    return [reports, rendered, diffs, rollups, count(session, ReportDiffData)]
+
+
+def test_normalized_derived_data_matches_flat(empty_db, session, monkeypatch):
+    flat = derived_data(
+        session, [persist(session, report) for report in changed_reports()]
+    )
+    clear_db(session)
+    monkeypatch.setattr(settings, "storage_layout", "normalized")
+    report_ids = [persist(session, report) for report in changed_reports()]
+    assert derived_data(session, report_ids) == flat
+    assert count(session, BrokenLinkFileData) == 0
+
+
+def test_convert_layout(empty_db, session, monkeypatch, capsys):
+    report_ids = [persist(session, report) for report in changed_reports()]
+    reports = [get_report_by_id(session, report_id) for report_id in report_ids]
+
+    monkeypatch.setattr(settings, "storage_layout", "normalized")
+    with pytest.raises(StorageLayoutError):
+        bootstrap(get_engine_from_settings())
+    main(["convert-layout"])
+    assert "Moved 21 broken links to the normalized layout" in capsys.readouterr().out
+    main(["convert-layout"])
+    assert "Moved 0 broken links" in capsys.readouterr().out
+    bootstrap(get_engine_from_settings())
+    assert count(session, BrokenLinkFileData) == 0
+    assert [get_report_by_id(session, id_) for id_ in report_ids] == reports
+
+    delete_report_data(session, report_ids[1])
+    assert count(session, ReportLinkData) == 6 + 7
+
+    monkeypatch.setattr(settings, "storage_layout", "flat")
+    assert convert_layout(session) == 13
+    assert count(session, ReportLinkData) == count(session, RepoData) == 0
+    assert get_report_by_id(session, report_ids[2]) == reports[2]
+
+
+def test_unknown_storage_layout():
+    with pytest.raises(ValueError):
+        storage_layout("columnar")
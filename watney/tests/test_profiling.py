@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import uuid
+
+import httpx
+import pytest
+
+from watney.db.session import get_async_engine_from_settings, get_engine_from_settings
+from watney.helpers import get_report_list
+from watney.main import app
+from watney.profiling import (
+    RequestProfile,
+    current_profile,
+    log_slow_queries,
+    profile_lock,
+    profiled,
+)
+from watney.settings import settings
+from watney.tests.test_fixtures import fake_report, session
+
+
+@pytest.fixture
+def profiling(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "profile_token", "secret")
+    monkeypatch.setattr(settings, "profile_dir", str(tmp_path))
+    return tmp_path
+
+
+def get(*requests) -> list:
+    async def send():
+        try:
+            async with httpx.AsyncClient(app=app, base_url="http://watney") as client:
+                return [await client.get(path, **kwargs) for path, kwargs in requests]
+        finally:
+            await get_async_engine_from_settings().dispose()
+
+    return asyncio.run(send())
+
+
+def test_slow_query_log(fake_report, session, monkeypatch, caplog):
+    log_slow_queries(get_engine_from_settings())
+    get_report_list(session)
+    assert not caplog.records
+
+    monkeypatch.setattr(settings, "slow_query_threshold", 1e-9)
+    with caplog.at_level(logging.WARNING, logger="watney.slow_queries"):
+        get_report_list(session)
+    message = caplog.records[0].getMessage()
+    assert "from watney.helpers.get_report_list" in message
+    assert "brokenlinkreportdata" in message
+    assert "parameters:" in message
+
+
+def test_profiled_nests():
+    @profiled
+    def inner():
+        return 1
+
+    @profiled
+    def outer():
+        return inner() + 1
+
+    assert outer() == 2
+    request_profile = RequestProfile()
+    token = current_profile.set(request_profile)
+    try:
+        assert outer() == 2
+    finally:
+        current_profile.reset(token)
+    assert request_profile.calls == 2
+    assert request_profile.depth == 0
+
+
+def test_profile_request(fake_report, profiling):
+    plain, wrong_token, by_header, by_query = get(
+        (f"/report/{fake_report}", {}),
+        (f"/report/{fake_report}", dict(headers={"X-Watney-Profile": "guess"})),
+        (f"/report/{fake_report}", dict(headers={"X-Watney-Profile": "secret"})),
+        (f"/report/{fake_report}", dict(params={"profile": "secret"})),
+    )
+    assert "x-watney-profile-id" not in plain.headers
+    assert "x-watney-profile-id" not in wrong_token.headers
+    assert by_header.json() == plain.json()
+    profile_id = by_header.headers["x-watney-profile-id"]
+    assert (profiling / f"{profile_id}.prof").exists()
+    assert by_query.headers["x-watney-profile-id"] != profile_id
+
+    path = f"/profiles/{profile_id}"
+    text, raw, forbidden, missing = get(
+        (path, dict(params={"profile": "secret"})),
+        (
+            path,
+            dict(params={"format": "pstats"}, headers={"X-Watney-Profile": "secret"}),
+        ),
+        (path, {}),
+        (f"/profiles/{uuid.uuid4().hex}", dict(params={"profile": "secret"})),
+    )
+    assert text.status_code == 200
+    assert "build_report" in text.text
+    assert raw.content == (profiling / f"{profile_id}.prof").read_bytes()
+    assert forbidden.status_code == 403
+    assert missing.status_code == 404
+
+
+def test_profile_id_only_when_profiled(fake_report, profiling):
+    (summary,) = get(("/report-summary", dict(params={"profile": "secret"})))
+    assert summary.status_code == 200
+    assert "x-watney-profile-id" not in summary.headers
+    assert not list(profiling.iterdir())
+
+
+def test_one_profile_at_a_time(fake_report, profiling):
+    with profile_lock:
+        (skipped,) = get((f"/report/{fake_report}", dict(params={"profile": "secret"})))
+    assert skipped.status_code == 200
+    assert skipped.headers["x-watney-profile-skipped"] == "1"
+    assert "x-watney-profile-id" not in skipped.headers
+    assert not list(profiling.iterdir())
+
+    (profiled_,) = get((f"/report/{fake_report}", dict(params={"profile": "secret"})))
+    assert "x-watney-profile-skipped" not in profiled_.headers
+    assert "x-watney-profile-id" in profiled_.headers
+
+
+def test_profiling_disabled(fake_report, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profile_dir", str(tmp_path))
+    response, profile = get(
+        (f"/report/{fake_report}", dict(headers={"X-Watney-Profile": ""})),
+        (f"/profiles/{uuid.uuid4().hex}", dict(params={"profile": ""})),
+    )
+    assert "x-watney-profile-id" not in response.headers
+    assert profile.status_code == 403
+    assert not list(tmp_path.iterdir())
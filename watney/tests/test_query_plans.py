@@ -0,0 +1,114 @@
+"""
+Check the query plans of the helpers against the indexing scheme in watney.db.models.
+Every statement a helper sends is run through EXPLAIN QUERY PLAN, and the test fails if
+SQLite would scan a whole table or sort rows in a temporary b-tree instead of reading them
+from an index.
+"""
+import re
+import uuid
+
+import pytest
+
+from watney import helpers, rollups
+from watney.db.session import get_engine_from_settings
+from watney.tests.synthetic import clone_report
+from watney.tests.test_fixtures import (
+    FAKE_REPORT_DATE,
+    count_queries,
+    fake_report,
+    session,
+)
+
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(?P<table>\w+)( AS \w+)?$")
+TEMP_SORT = re.compile(r"USE TEMP B-TREE")
+# The statements that read a whole table by design, by helper: the table and the start
+# of the statement
+FULL_SCANS = {
+    # openlinkdata holds the links of the latest report, the links a new report fixed
+    # are deleted from all of it
+    "clone_report": ("openlinkdata", "DELETE FROM openlinkdata "),
+    # The time to fix over every report sums all of fixtimedata
+    "time_to_fix": ("fixtimedata", "SELECT "),
+}
+
+pytestmark = pytest.mark.skipif(
+    get_engine_from_settings().dialect.name != "sqlite",
+    reason="query plan checks use SQLite's EXPLAIN QUERY PLAN",
+)
+
+OTHER_REPORT_ID = uuid.uuid4()
+
+HELPER_CALLS = {
+    "report_exists": lambda s, r: helpers.report_exists(s, r),
+    "report_exists_for_date": lambda s, r: helpers.report_exists_for_date(
+        s, FAKE_REPORT_DATE
+    ),
+    "get_report_date": lambda s, r: helpers.get_report_date(s, r),
+    "get_last_report_id_and_datestamp": lambda s, r: (
+        helpers.get_last_report_id_and_datestamp(s)
+    ),
+    "get_report_list": lambda s, r: helpers.get_report_list(s),
+    "get_report_list_before": lambda s, r: helpers.get_report_list(
+        s, before=FAKE_REPORT_DATE
+    ),
+    "get_report_list_after": lambda s, r: helpers.get_report_list(
+        s, after=FAKE_REPORT_DATE
+    ),
+    "get_report_by_id": lambda s, r: helpers.get_report_by_id(s, r),
+    "get_last_two_reports": lambda s, r: helpers.get_last_two_reports(s),
+    "report_has_links": lambda s, r: helpers.report_has_links(s, r),
+    "broken_links_from_report": lambda s, r: helpers.broken_links_from_report(s, r),
+    "get_report_diff": lambda s, r: helpers.get_report_diff(s, r, OTHER_REPORT_ID),
+    "query_report_diff": lambda s, r: helpers.query_report_diff(s, r, OTHER_REPORT_ID),
+    "clone_report": lambda s, r: clone_report(
+        s, r, uuid.uuid4(), "2023-04-15T14:15:34"
+    ),
+    "delete_report_data": lambda s, r: helpers.delete_report_data(s, r),
+    "repo_trends": lambda s, r: rollups.repo_trends(s),
+    "repo_trends_of_repo": lambda s, r: rollups.repo_trends(s, repo_name="repo-0"),
+    "repo_trends_since": lambda s, r: rollups.repo_trends(
+        s, repo_name="repo-0", since=FAKE_REPORT_DATE
+    ),
+    "top_urls": lambda s, r: rollups.top_urls(s, r),
+    "status_code_counts": lambda s, r: rollups.status_code_counts(s, r),
+    "time_to_fix": lambda s, r: rollups.time_to_fix(s),
+    "time_to_fix_since": lambda s, r: rollups.time_to_fix(s, since=FAKE_REPORT_DATE),
+}
+
+
+def is_full_scan(step: str, helper: str, statement: str) -> bool:
+    match = FULL_SCAN.match(step)
+    if match is None:
+        return False
+    table, start = FULL_SCANS.get(helper, (None, None))
+    return match.group("table") != table or not statement.lstrip().startswith(start)
+
+
+def query_plan(session, statement, parameters) -> list:
+    connection = session.connection()
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return [row[3] for row in rows]
+
+
+@pytest.mark.parametrize("helper", HELPER_CALLS.keys())
+def test_helper_queries_use_indexes(fake_report, session, helper):
+    clone_report(session, fake_report, OTHER_REPORT_ID, "2023-04-01T00:00:00")
+    with count_queries() as statements:
+        try:
+            HELPER_CALLS[helper](session, fake_report)
+        except helpers.NotEnoughDataError:
+            pass
+    queries = [
+        (statement, parameters)
+        for statement, parameters in statements
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))
+    ]
+    assert queries
+
+    for statement, parameters in queries:
+        plan = query_plan(session, statement, parameters)
+        assert not [
+            step
+            for step in plan
+            if is_full_scan(step, helper, statement) or TEMP_SORT.search(step)
+        ], f"{helper} does not use an index:\n{statement}\n{plan}"
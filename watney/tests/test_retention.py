@@ -0,0 +1,146 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy import func
+from sqlmodel import select
+
+from watney.cli import main
+from watney.db.leases import release_lease, take_lease
+from watney.db.models import BrokenLinkDiffData, BrokenLinkFileData
+from watney.helpers import delete_report_data, get_report_list, persist
+from watney.retention import (
+    RETENTION_LEASE,
+    RetentionPolicy,
+    expired_reports,
+    prune_reports,
+    run_retention,
+)
+from watney.settings import settings
+from watney.tests.test_fixtures import count_queries, empty_db, make_report, session
+
+NOW = datetime.datetime(2023, 6, 1)
+
+
+def persist_daily_reports(session, days: int) -> list:
+    """
+    One report a day up to NOW, oldest first
+    """
+    return [
+        persist(
+            session,
+            make_report((NOW - datetime.timedelta(days=day)).isoformat(), 1, 2),
+        )
+        for day in reversed(range(days))
+    ]
+
+
+def count_rows(session, model) -> int:
+    return session.exec(select(func.count()).select_from(model)).one()
+
+
+def test_expired_reports_keep_newest(empty_db, session):
+    report_ids = persist_daily_reports(session, 5)
+    policy = RetentionPolicy(keep_reports=2)
+    assert expired_reports(session, policy, NOW) == report_ids[:3]
+
+
+def test_expired_reports_max_age_and_weekly(empty_db, session):
+    report_ids = persist_daily_reports(session, 30)
+    policy = RetentionPolicy(max_age=datetime.timedelta(days=7), keep_weekly=True)
+    expired = expired_reports(session, policy, NOW)
+    kept = [report_id for report_id in report_ids if report_id not in expired]
+    # The last 7 days, which cover the ISO weeks of May 22 and May 29, plus the newest
+    # report of each of the 3 weeks before
+    assert len(kept) == 7 + 3
+    assert kept[-7:] == report_ids[-7:]
+
+
+def test_expired_reports_weekly_beyond_newest(empty_db, session):
+    report_ids = persist_daily_reports(session, 14)
+    policy = RetentionPolicy(keep_reports=2, keep_weekly=True)
+    expired = expired_reports(session, policy, NOW)
+    kept = [report_id for report_id in report_ids if report_id not in expired]
+    # The 2 newest reports are in the week of May 29, which needs no other report
+    assert kept == [report_ids[2], report_ids[-5], *report_ids[-2:]]
+
+
+def test_expired_reports_without_rules(empty_db, session):
+    persist_daily_reports(session, 3)
+    assert expired_reports(session, RetentionPolicy(), NOW) == []
+
+
+def test_prune_reports(empty_db, session):
+    report_ids = persist_daily_reports(session, 4)
+    deleted = prune_reports(session, RetentionPolicy(keep_reports=1), NOW)
+    assert deleted == report_ids[:3]
+    assert [r.report_id for r in get_report_list(session).reports] == [
+        str(report_ids[-1])
+    ]
+    assert count_rows(session, BrokenLinkFileData) == 2
+    assert count_rows(session, BrokenLinkDiffData) == 0
+
+
+def test_delete_report_data_in_batches(empty_db, session):
+    report_id = persist(session, make_report("2023-05-01T00:00:00", 3, 10))
+    with count_queries() as statements:
+        delete_report_data(session, report_id, batch_size=7)
+    deletes = [
+        statement
+        for statement, _ in statements
+        if statement.startswith("DELETE FROM brokenlinkfiledata")
+    ]
+    assert len(deletes) == 5
+    assert count_rows(session, BrokenLinkFileData) == 0
+    # Deleting a missing report is a no-op
+    delete_report_data(session, report_id)
+
+
+def test_prune_cli(empty_db, session, capsys):
+    report_ids = persist_daily_reports(session, 3)
+    main(["prune", "--dry-run", "--keep-reports", "1"])
+    assert "Would delete 2 reports" in capsys.readouterr().out
+    assert len(get_report_list(session).reports) == 3
+    main(["prune", "--keep-reports", "1"])
+    output = capsys.readouterr().out
+    assert str(report_ids[0]) in output
+    assert "Deleted 2 reports" in output
+
+
+async def run_once():
+    task = asyncio.create_task(run_retention(60))
+    await asyncio.sleep(0.5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def test_run_retention(empty_db, session, monkeypatch):
+    persist_daily_reports(session, 3)
+    monkeypatch.setattr(settings, "retention_keep_reports", 2)
+    asyncio.run(run_once())
+    assert len(get_report_list(session).reports) == 2
+    # The lease is released when the task stops
+    assert take_lease(session, RETENTION_LEASE, "other", datetime.timedelta(minutes=1))
+
+
+def test_run_retention_without_lease(empty_db, session, monkeypatch):
+    persist_daily_reports(session, 3)
+    monkeypatch.setattr(settings, "retention_keep_reports", 2)
+    take_lease(session, RETENTION_LEASE, "other", datetime.timedelta(minutes=1))
+    asyncio.run(run_once())
+    assert len(get_report_list(session).reports) == 3
+
+
+def test_take_lease(empty_db, session):
+    minute = datetime.timedelta(minutes=1)
+    assert take_lease(session, "job", "first", minute, NOW)
+    assert not take_lease(session, "job", "second", minute, NOW)
+    # Renewed by its holder, taken by another once expired
+    assert take_lease(session, "job", "first", minute, NOW + minute / 2)
+    assert not take_lease(session, "job", "second", minute, NOW + minute)
+    assert take_lease(session, "job", "second", minute, NOW + 2 * minute)
+    release_lease(session, "job", "first")
+    assert not take_lease(session, "job", "first", minute, NOW + 2 * minute)
+    release_lease(session, "job", "second")
+    assert take_lease(session, "job", "first", minute, NOW + 2 * minute)
@@ -0,0 +1,98 @@
+import copy
+import datetime
+
+from sqlalchemy import func
+from sqlmodel import select
+
+from watney.cli import main
+from watney.db.models import OpenLinkData, RepoStatusCountData, UrlCountData
+from watney.helpers import delete_report_data, persist
+from watney.rollups import repo_trends, status_code_counts, time_to_fix, top_urls
+from watney.schema import BrokenLink
+from watney.tests.test_fixtures import empty_db, make_report, session
+
+
+def daily_reports():
+    """
+    Three daily reports. The second fixes one link of the first and adds one with a 500
+    status code, the third fixes the new link and another link of the first.
+    """
+    first = make_report("2023-05-01T00:00:00", 2, 3)
+    second = copy.deepcopy(first)
+    second.report_date = datetime.datetime(2023, 5, 2)
+    del second.report[0].broken_links[0]
+    second.report[1].broken_links.append(
+        BrokenLink(file="docs/new.md", url="https://a.b/0", status_code=500)
+    )
+    third = copy.deepcopy(second)
+    third.report_date = datetime.datetime(2023, 5, 3)
+    del third.report[1].broken_links[-2:]
+    return [first, second, third]
+
+
+def count_rows(session, model) -> int:
+    return session.exec(select(func.count()).select_from(model)).one()
+
+
+def test_repo_trends(empty_db, session):
+    report_ids = [persist(session, report) for report in daily_reports()]
+    trends = repo_trends(session)
+    assert [(trend.repo_name, [p.count for p in trend.counts]) for trend in trends] == [
+        ("repo-0", [3, 2, 2]),
+        ("repo-1", [3, 4, 2]),
+    ]
+    assert [p.report_id for p in trends[0].counts] == report_ids
+
+    trends = repo_trends(
+        session, repo_name="repo-1", since=datetime.datetime(2023, 5, 2)
+    )
+    assert [[p.count for p in trend.counts] for trend in trends] == [[4, 2]]
+
+
+def test_top_urls_and_status_codes(empty_db, session):
+    report_ids = [persist(session, report) for report in daily_reports()]
+    urls = top_urls(session, report_ids[1], limit=2)
+    assert [(url.url, url.count) for url in urls] == [
+        ("https://a.b/0", 2),
+        ("https://a.b/1", 2),
+    ]
+    assert [
+        (count.status_code, count.count)
+        for count in status_code_counts(session, report_ids[1])
+    ] == [(404, 5), (500, 1)]
+
+
+def test_time_to_fix(empty_db, session):
+    for report in daily_reports():
+        persist(session, report)
+    day = datetime.timedelta(days=1).total_seconds()
+    # Fixed after 1 day by the second report, after 2 days and 1 day by the third
+    result = time_to_fix(session)
+    assert result.fixed_links == 3
+    assert result.mean_time_to_fix == (day + 2 * day + day) / 3
+    result = time_to_fix(session, until=datetime.datetime(2023, 5, 2))
+    assert (result.fixed_links, result.mean_time_to_fix) == (1, day)
+    result = time_to_fix(session, until=datetime.datetime(2023, 5, 1))
+    assert (result.fixed_links, result.mean_time_to_fix) == (0, None)
+
+
+def test_out_of_order_report_leaves_open_links(empty_db, session):
+    first, second, third = daily_reports()
+    persist(session, third)
+    open_links = session.exec(select(OpenLinkData)).fetchall()
+    persist(session, first)
+    assert session.exec(select(OpenLinkData)).fetchall() == open_links
+    assert len(repo_trends(session)[0].counts) == 2
+
+
+def test_rebuild_rollups(empty_db, session, capsys):
+    report_ids = [persist(session, report) for report in daily_reports()]
+    expected = (repo_trends(session), time_to_fix(session))
+    main(["rollup"])
+    assert "Rolled up 3 reports" in capsys.readouterr().out
+    assert (repo_trends(session), time_to_fix(session)) == expected
+
+    delete_report_data(session, report_ids[0])
+    assert len(repo_trends(session)[0].counts) == 2
+    assert count_rows(session, RepoStatusCountData) == 3 + 2
+    assert count_rows(session, UrlCountData) == 3 + 3
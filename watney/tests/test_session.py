@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.pool import QueuePool
+
+import pytest
+
+from watney.db.session import (
+    get_async_database_url,
+    get_db_session,
+    get_engine,
+    get_engine_from_settings,
+    get_session,
+)
+from watney.helpers import get_report_by_id
+from watney.settings import settings
+from watney.tests.test_fixtures import fake_report, MAX_REPOS
+
+
+def test_get_session_returns_new_sessions():
+    with get_session() as first, get_session() as second:
+        assert first is not second
+        assert first.get_bind() is second.get_bind()
+
+
+def test_get_db_session_closes_session():
+    dependency = get_db_session()
+    session = next(dependency)
+    session.connection()
+    assert session.in_transaction()
+    dependency.close()
+    assert not session.in_transaction()
+
+
+def test_pool_configured_from_settings():
+    pool = get_engine_from_settings().pool
+    assert isinstance(pool, QueuePool)
+    assert pool.size() == settings.database_pool_size
+    assert pool._max_overflow == settings.database_max_overflow
+    assert pool._recycle == settings.database_pool_recycle
+
+
+def test_get_async_database_url():
+    assert get_async_database_url("sqlite:///database.db") == (
+        "sqlite+aiosqlite:///database.db"
+    )
+    assert get_async_database_url("postgresql://watney:pw@db/watney") == (
+        "postgresql+asyncpg://watney:pw@db/watney"
+    )
+    assert get_async_database_url("postgresql+psycopg2://db/watney") == (
+        "postgresql+asyncpg://db/watney"
+    )
+    with pytest.raises(ValueError):
+        get_async_database_url("mysql://db/watney")
+
+
+def test_in_memory_sqlite_keeps_default_pool():
+    assert not isinstance(get_engine("sqlite://").pool, QueuePool)
+
+
+def test_sessions_used_from_many_threads(fake_report):
+    def load_report(_):
+        with get_session() as session:
+            return len(get_report_by_id(session, fake_report).report)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(load_report, range(32)))
+    assert results == [MAX_REPOS] * 32
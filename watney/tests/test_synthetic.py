@@ -0,0 +1,156 @@
+import datetime
+import uuid
+
+import pytest
+from sqlmodel import func, select
+
+from watney.db.models import BrokenLinkFileData, BrokenLinkReportData, ReportDiffData
+from watney.diff import link_key
+from watney.errors import StorageLayoutError
+from watney.helpers import (
+    broken_links_from_report,
+    get_report_by_id,
+    query_report_diff,
+)
+from watney.settings import settings
+from watney.tests.synthetic import (
+    clone_report,
+    insert_report,
+    make_report,
+    report_links,
+    report_series,
+    seed_reports,
+)
+from watney.tests.test_fixtures import (
+    count_queries,
+    empty_db,
+    fake_report,
+    MAX_BROKEN_LINKS,
+    MAX_REPOS,
+    session,
+)
+
+REPORT_DATE = datetime.datetime(2023, 6, 1)
+
+
+def links(report):
+    return [
+        (repo.repo_name, repo.repo_url, link.file, link.url, link.status_code)
+        for repo in report.report
+        for link in repo.broken_links
+    ]
+
+
+def keys(report):
+    return [
+        (repo.repo_name, repo.repo_url, link.file)
+        for repo in report.report
+        for link in repo.broken_links
+    ]
+
+
+def test_report_links_are_deterministic():
+    links = list(report_links(5, 10, seed=1))
+    assert links == list(report_links(5, 10, seed=1))
+    assert links != list(report_links(5, 10, seed=2))
+    assert len({link[:3] for link in links}) == 50
+    # Links share urls, so the top urls of a report are meaningful
+    assert len({link[3] for link in links}) < 50
+
+
+def test_make_report_matches_report_links():
+    report = make_report(REPORT_DATE, 5, 10, seed=3)
+    assert report.report_date == REPORT_DATE
+    assert links(report) == list(report_links(5, 10, seed=3))
+
+
+def test_report_series_churn():
+    first, second = report_series(1000, 2, churn=0.1)
+    assert second.report_date - first.report_date == datetime.timedelta(days=1)
+    assert len(keys(second)) == 1000
+    assert len(set(keys(first)) & set(keys(second))) == 900
+
+
+def test_insert_report(empty_db, session):
+    report_id = uuid.uuid4()
+    insert_report(session, report_id, REPORT_DATE, 5, 10, seed=4)
+    report = get_report_by_id(session, report_id)
+    assert report.report_date == REPORT_DATE
+    assert sorted(links(report)) == sorted(report_links(5, 10, seed=4))
+
+
+def test_clone_report_is_insert_select(fake_report, session, monkeypatch):
+    monkeypatch.setattr(settings, "maintain_rollups", False)
+    monkeypatch.setattr(settings, "materialize_diffs", False)
+    new_id = uuid.uuid4()
+    with count_queries() as statements:
+        clone_report(session, fake_report, new_id, "2023-04-15T14:15:34")
+    assert [statement.split()[0] for statement, _ in statements] == [
+        "INSERT",
+        "INSERT",
+    ]
+    prev_rows = broken_links_from_report(session, fake_report)
+    assert sorted(broken_links_from_report(session, new_id)) == sorted(prev_rows)
+
+
+def test_clone_report_derives_report_data(fake_report, session):
+    new_id = uuid.uuid4()
+    clone_report(session, fake_report, new_id, "2023-04-15T00:00:00", True, 3)
+    diff = session.get(ReportDiffData, (fake_report, new_id))
+    assert diff is not None
+    assert len(query_report_diff(session, fake_report, new_id).new) == 3
+
+
+def test_synthetic_reports_require_flat_layout(fake_report, session, monkeypatch):
+    monkeypatch.setattr(settings, "storage_layout", "normalized")
+    with pytest.raises(StorageLayoutError):
+        clone_report(session, fake_report, uuid.uuid4(), "2023-04-15T00:00:00")
+    with pytest.raises(StorageLayoutError):
+        insert_report(session, uuid.uuid4(), datetime.datetime(2023, 4, 15), 1, 1)
+    assert session.exec(select(func.count(BrokenLinkReportData.report_id))).one() == 1
+
+
+def test_clone_report_adds_and_removes_links(fake_report, session):
+    more, fewer = uuid.uuid4(), uuid.uuid4()
+    clone_report(session, fake_report, more, "2023-04-15T00:00:00", True, 3)
+    clone_report(session, more, fewer, "2023-04-16T00:00:00", True, -5)
+    assert (
+        len(broken_links_from_report(session, more)) == MAX_REPOS * MAX_BROKEN_LINKS + 3
+    )
+    assert (
+        len(broken_links_from_report(session, fewer))
+        == MAX_REPOS * MAX_BROKEN_LINKS - 2
+    )
+
+
+def test_clone_report_mutates_a_fraction(fake_report, session):
+    moved, same_seed, other_seed = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    clone_report(session, fake_report, moved, "2023-04-15T00:00:00", mutate=0.1)
+    clone_report(session, fake_report, same_seed, "2023-04-16T00:00:00", mutate=0.1)
+    clone_report(
+        session, fake_report, other_seed, "2023-04-17T00:00:00", mutate=0.1, seed=7
+    )
+
+    diff = query_report_diff(session, fake_report, moved)
+    num_links = MAX_REPOS * MAX_BROKEN_LINKS
+    assert len(diff.new) == len(diff.fixed)
+    assert abs(len(diff.new) - num_links * 0.1) <= num_links * 0.02
+    assert len(diff.existing) == num_links - len(diff.new)
+    assert {row.url for row in diff.new} <= {row.url for row in diff.fixed}
+
+    def fixed(report_id):
+        return sorted(
+            link_key(row)
+            for row in query_report_diff(session, fake_report, report_id).fixed
+        )
+
+    assert fixed(same_seed) == fixed(moved)
+    assert fixed(other_seed) != fixed(moved)
+
+
+def test_seed_reports(empty_db, session):
+    report_ids = seed_reports(session, 5, 10, 100, churn=0.25)
+    query = select(func.count()).select_from(BrokenLinkFileData)
+    assert session.exec(query).one() == 5 * 1000
+    diff = query_report_diff(session, report_ids[-2], report_ids[-1])
+    assert len(diff.new) == 250